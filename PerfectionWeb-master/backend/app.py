@@ -1,22 +1,48 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, g, request, jsonify, send_file
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 import os
 from dotenv import load_dotenv
-from supabase import create_client, Client
-import pandas as pd
 from datetime import datetime
 import traceback
+import time
+import uuid
 import re
 from dateutil import parser as date_parser
 import logging
 from logging.handlers import RotatingFileHandler
-from collections import deque
+from collections import Counter, deque
+from profiling import RequestProfiler
+from ratelimit import RateLimiter
+from json_provider import FastJSONProvider
+from compression import ResponseCompressor
+from ingest_executor import IngestExecutor
+from events import STREAM_LENGTH, EventBroker
+from identity_index import INSERT, RENAME, UPDATE, StudentIdentityIndex
+from row_writes import UPDATE_WHERE, run_row_write
+from sheet_formats import read_sheet, supported_extensions
+from upload_plans import UploadPlanStore
+from resumable_uploads import ResumableUploadError, ResumableUploadStore
+from ingest_journal import IngestJournal
+from write_scheduler import WriteScheduler
+from async_writer import AsyncSessionWriter
+from read_guard import ReadGuard, ReadUnavailable
+from normalization import normalize_name, normalize_name_series, normalize_phone, normalize_phone_series
+from metrics import registry
+from http_pool import pool_stats
+from write_behind import last_login_buffer
+from month_backfill import month_from_timestamps
+import session_format
+import delta_sync
+from tokens import ROLE_ADMIN, ROLE_PARENT, InvalidToken, TokenService, bearer_token
+from repository import Repositories, RepositoryError, create_repositories, is_transient_error
 
 # Load environment variables
 load_dotenv()
 
 app = Flask(__name__)
+# orjson-backed JSON when installed (JSON_ENCODER, see json_provider.py)
+app.json = FastJSONProvider(app)
 CORS(app, resources={
     r"/api/*": {
         "origins": ["*"],
@@ -38,76 +64,134 @@ logger.propagate = False
 
 # Configuration
 UPLOAD_FOLDER = 'uploads'
-ALLOWED_EXTENSIONS = {'xlsx', 'xls'}
+# xlsx/xls and csv; parquet too when pyarrow or fastparquet is installed (sheet_formats.py)
+ALLOWED_EXTENSIONS = supported_extensions()
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
 # Create uploads directory if it doesn't exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-# Supabase configuration
+# Opt-in request profiler (PROFILE_ENABLED / PROFILE_ADMIN_KEY, see profiling.py)
+profiler = RequestProfiler.from_env(os.path.join(os.path.dirname(__file__), 'profiles'))
+profiler.init_app(app)
+
+# Auth rate limits and upload concurrency cap shared by all workers (RATE_LIMIT_* / UPLOAD_*, see ratelimit.py)
+limiter = RateLimiter.from_env(os.path.join(os.path.dirname(__file__), 'ratelimit'))
+limiter.init_app(app)
+
+# gzip/brotli for larger JSON responses (COMPRESS_*, see compression.py)
+compressor = ResponseCompressor.from_env()
+compressor.init_app(app)
+
+# Uploads are parsed and written in a separate low-priority process pool (INGEST_*, see ingest_executor.py)
+ingest = IngestExecutor.from_env()
+ingest.init_app(app)
+
+# Upload writes journaled for retry after transient database errors (INGEST_JOURNAL_* / INGEST_RETRY_*,
+# see ingest_journal.py); each worker runs a retrier thread replaying them through replay_journal_rows
+ingest_journal = IngestJournal.from_env(os.path.join(os.path.dirname(__file__), 'journal'))
+ingest_journal.init_app(app, lambda rows: replay_journal_rows(rows))
+
+# Upload writes sent in batches with adaptive concurrency and batch size (WRITE_*, see write_scheduler.py),
+# or with WRITE_ENGINE=async as concurrent row writes over an async HTTP client (ASYNC_WRITE_*, see async_writer.py)
+write_scheduler = WriteScheduler.from_env()
+async_writer = AsyncSessionWriter.from_env()
+
+# Dry-run upload plans waiting to be committed (UPLOAD_PLAN_*, see upload_plans.py)
+upload_plans = UploadPlanStore.from_env(os.path.join(UPLOAD_FOLDER, 'plans'))
+
+# Chunked, resumable uploads assembled on local disk (UPLOAD_CHUNK_* / UPLOAD_RESUMABLE_*, see resumable_uploads.py)
+resumable_uploads = ResumableUploadStore.from_env(os.path.join(UPLOAD_FOLDER, 'chunks'))
+
+# Dashboard reads with per-call budgets, a circuit breaker and last-known-good answers (READ_*, see read_guard.py)
+read_guard = ReadGuard.from_env()
+
+# Server-Sent Events announcing new uploads to parent dashboards (EVENTS_*, see events.py)
+event_broker = EventBroker.from_env(os.path.join(os.path.dirname(__file__), 'events'))
+event_broker.init_app(app)
+
+# Data access configuration
+# DATA_BACKEND selects the storage: supabase (default), sqlite (SQLITE_PATH) or memory
+DATA_BACKEND = (os.getenv('DATA_BACKEND') or 'supabase').lower()
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_KEY')
 
-# Initialize supabase as None; will fail gracefully if not set
-supabase: Client = None
-if SUPABASE_URL and SUPABASE_KEY:
+# Initialize repositories as None; will fail gracefully if not set
+db: Repositories = None
+try:
+    db = create_repositories(DATA_BACKEND, SUPABASE_URL, SUPABASE_KEY)
+    if db:
+        logger.info(f"Data backend '{db.backend_name}' initialized successfully")
+    else:
+        logger.warning("SUPABASE_URL or SUPABASE_KEY not set - database operations will fail")
+except Exception as e:
+    logger.error(f"Failed to initialize data backend '{DATA_BACKEND}': {str(e)}")
+    db = None
+
+def init_worker():
+    """
+    Per-worker setup after fork (called from gunicorn.conf.py). With --preload
+    the app and its data backend are created once in the master; each worker
+    then needs its own database connections, which are opened here so the
+    first request doesn't pay for DNS/TCP/TLS.
+    """
+    if not db:
+        return
+    started = datetime.now()
     try:
-        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-        logger.info("Supabase client initialized successfully")
+        db.after_fork()
+        db.warm()
+        logger.info(f"Worker {os.getpid()} warmed {db.backend_name} connection in {(datetime.now() - started).total_seconds() * 1000:.0f} ms")
     except Exception as e:
-        logger.error(f"Failed to initialize Supabase: {str(e)}")
-        supabase = None
-else:
-    logger.warning("SUPABASE_URL or SUPABASE_KEY not set - database operations will fail")
+        logger.warning(f"Worker {os.getpid()} could not warm the database connection: {str(e)}")
 
-# Allowed groups (added 'online' option)
-ALLOWED_GROUPS = ['cam1', 'maimi', 'cam2', 'west', 'station1', 'station2', 'station3', 'online']
 
-# Allowed session numbers
-ALLOWED_SESSIONS = list(range(1, 9))  # 1 to 8
+# parents.last_login is written in batches off the request path (LAST_LOGIN_*, see write_behind.py)
+last_login_writes = last_login_buffer(lambda: db.parents if db else None)
 
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+# Signed session tokens issued at login (AUTH_*, see tokens.py)
+auth_tokens = TokenService.from_env()
 
 
-def normalize_phone(phone: str) -> str:
-    """Normalize phone numbers to local format starting with '01' and 11 digits when possible.
-    Examples:
-      +201012345678 -> 01012345678
-      201012345678 -> 01012345678
-      01012345678 -> 01012345678
-      1012345678   -> 01012345678
-    """
-    if not phone:
-        return ''
+def account_password(account):
+    """Stored password of a parents / admins row (password_hash, or the older password column)."""
+    return account.get('password_hash') or account.get('password') or ''
 
-    # Keep only digits
-    cleaned = ''.join(ch for ch in phone if ch.isdigit())
-    if cleaned.startswith('00'):
-        cleaned = cleaned[2:]
 
-    # If it has country code 20 (Egypt), convert to local starting with 0
-    if cleaned.startswith('20') and len(cleaned) >= 11:
-        candidate = '0' + cleaned[2:]
-        if candidate.startswith('01') and len(candidate) == 11:
-            return candidate
+def token_account_password(role, subject):
+    """Current password of a token's account, None when the account is gone (tokens.py revokes on change)."""
+    if db is None:
+        raise RuntimeError('database not initialized')
+    account = db.admins.get_by_username(subject) if role == ROLE_ADMIN else db.parents.get_by_phone(subject)
+    return account_password(account) if account else None
 
-    # If it's already local 11-digit starting with 01
-    if len(cleaned) == 11 and cleaned.startswith('01'):
-        return cleaned
 
-    # If it's 10 digits starting with 1 (missing leading zero)
-    if len(cleaned) == 10 and cleaned.startswith('1'):
-        return '0' + cleaned
+auth_tokens.password_lookup = token_account_password
 
-    # As a last resort, if cleaned ends with 10 digits starting with '1', use that
-    if len(cleaned) > 11 and cleaned[-10].isdigit():
-        last10 = cleaned[-10:]
-        if last10.startswith('1'):
-            return '0' + last10
 
-    return cleaned
+def password_changed_response(role, subject, password, message):
+    """Success response of a password change, with a new token (the caller's old one stops working)."""
+    auth_tokens.forget(role, subject)
+    token, expires_in = auth_tokens.issue(role, subject, password)
+    return jsonify({'success': True, 'message': message, 'token': token, 'expires_in': expires_in}), 200
+
+# Allowed groups (added 'online' option)
+ALLOWED_GROUPS = ['cam1', 'maimi', 'cam2', 'west', 'station1', 'station2', 'station3', 'online']
+
+# Allowed session numbers
+ALLOWED_SESSIONS = list(range(1, 9))  # 1 to 8
+
+# Largest page of /api/parent/sessions a client may request with ?limit=
+MAX_SESSIONS_PAGE = 500
+
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+def invalid_file_type_message():
+    allowed = ', '.join(f'.{ext}' for ext in sorted(ALLOWED_EXTENSIONS))
+    return f'Invalid file type. Allowed: {allowed}'
 
 
 def normalize_timestamp(value):
@@ -152,30 +236,6 @@ def normalize_timestamp(value):
     return s
 
 
-def normalize_name(name: str) -> str:
-    """Normalize a person name for matching: lower-case, collapse whitespace,
-    remove common Arabic diacritics and Unicode combining marks to improve matching
-    across uploads."""
-    if not name:
-        return ''
-    try:
-        import unicodedata
-        s = str(name).strip().lower()
-        # remove Arabic diacritics (harakat)
-        s = re.sub(r'[\u064B-\u0652]', '', s)
-        # normalize and remove combining marks
-        nfkd = unicodedata.normalize('NFKD', s)
-        s = ''.join(ch for ch in nfkd if not unicodedata.combining(ch))
-        # collapse whitespace
-        s = re.sub(r'\s+', ' ', s).strip()
-        return s
-    except Exception:
-        try:
-            return re.sub(r'\s+', ' ', str(name).strip().lower())
-        except Exception:
-            return str(name).strip().lower()
-
-
 def format_start_time_arabic(value):
     """Format a datetime-like value into DD/MM/YYYY HH:MM:SS plus Arabic AM/PM marker (ص for AM, م for PM)."""
     # If value is missing/empty, show explicit placeholder for frontend
@@ -204,24 +264,11 @@ def parse_general_exam_sheet(file_path):
     Parse general exam Excel sheet
     Expected columns: id, name, .Parent No, a, p, Q
     """
+    # pandas/openpyxl are loaded on the first upload, not at worker start
+    import pandas as pd
     try:
-        # Try reading with header=0 first
-        try:
-            df = pd.read_excel(file_path, header=0)
-        except AttributeError as ae:
-            # Handle openpyxl ReadOnlyWorksheet lacking some attributes
-            if 'defined_names' in str(ae) or 'ReadOnlyWorksheet' in str(ae):
-                from openpyxl import load_workbook
-                wb = load_workbook(file_path, data_only=True)
-                ws = wb.active
-                data = list(ws.values)
-                if not data:
-                    raise
-                header = [str(h).strip() if h is not None else '' for h in data[0]]
-                rows = data[1:]
-                df = pd.DataFrame(rows, columns=header)
-            else:
-                raise
+        # Excel, CSV or Parquet, by extension
+        df = read_sheet(file_path)
         
         # Clean column names
         df.columns = df.columns.astype(str).str.strip()
@@ -356,26 +403,9 @@ def parse_normal_lecture_sheet(file_path):
     Parse normal lecture Excel sheet
     Columns: id, name, pokin, student no., Parent No., a, p, Q, time, s1
     """
+    import pandas as pd
     try:
-        try:
-            df = pd.read_excel(file_path, header=0)
-        except AttributeError as ae:
-            # Workaround for openpyxl returning ReadOnlyWorksheet without
-            # `defined_names` when pandas/openpyxl open the file in
-            # read-only mode. Fall back to loading with openpyxl directly
-            # and build a DataFrame from the sheet values.
-            if 'defined_names' in str(ae):
-                from openpyxl import load_workbook
-                wb = load_workbook(file_path, data_only=True)
-                ws = wb.active
-                data = list(ws.values)
-                if not data:
-                    raise
-                header = [str(h).strip() if h is not None else '' for h in data[0]]
-                rows = data[1:]
-                df = pd.DataFrame(rows, columns=header)
-            else:
-                raise
+        df = read_sheet(file_path)
         
         # Clean column names
         df.columns = df.columns.astype(str).str.strip()
@@ -528,8 +558,8 @@ def create_or_update_parent(parent_no, student_name=None):
     
     try:
         # Check if parent exists
-        existing = supabase.table('parents').select('*').eq('phone_number', parent_no_norm).execute()
-        if existing.data and len(existing.data) > 0:
+        existing = db.parents.get_by_phone(parent_no_norm)
+        if existing:
             # Parent exists, no need to update
             return
         else:
@@ -541,267 +571,477 @@ def create_or_update_parent(parent_no, student_name=None):
                 'name': student_name or f'Parent {parent_no_norm}'
             }
             try:
-                res = supabase.table('parents').insert(parent_data).execute()
-                if getattr(res, 'error', None):
-                    logger.warning(f"Could not create parent {parent_no_norm}: {res.error}")
+                db.parents.insert(parent_data)
+            except RepositoryError as e:
+                logger.warning(f"Could not create parent {parent_no_norm}: {str(e)}")
             except Exception as e:
                 logger.exception(f"Exception creating parent {parent_no_norm}: {str(e)}")
     except Exception as e:
         # Silently fail parent creation - don't block the main upload
         logger.warning(f"Could not create parent account for {parent_no}: {str(e)}")
 
-def update_database(records, session_number, quiz_mark, finish_time, group, is_general_exam, lecture_name='', exam_name='', has_exam_grade=True, has_payment=True, has_time=True, month_param=None):
+def write_planned_row(write):
+    """
+    Send one classified session_records write (identity_index.PlannedWrite)
+    through the repository, with the rules in row_writes.py.
+    Returns None on success or the exception that made it fail.
+    """
+    def transport(request):
+        if request[0] == UPDATE_WHERE:
+            _, payload, where = request
+            db.session_records.update(payload, where=where)
+        elif write.action == INSERT:
+            db.session_records.insert(request[1])
+        else:
+            db.session_records.update(request[1], where={'id': write.target_id})
+
+    return run_row_write(write, transport)
+
+
+def write_planned_batch(writes):
+    """
+    Send a batch of classified writes (write_scheduler.py); returns None or the
+    exception for each write. Updates and renames go one by one, then the
+    inserts in one request; when that request is refused for a reason other
+    than a transient error (a duplicate key, a column missing from the schema
+    cache), the inserts are sent one by one to resolve and report each row.
+    """
+    results = [None] * len(writes)
+    inserts = []
+    for i, write in enumerate(writes):
+        if write.action == INSERT:
+            inserts.append(i)
+        else:
+            results[i] = write_planned_row(write)
+    if len(inserts) < 2:
+        for i in inserts:
+            results[i] = write_planned_row(writes[i])
+        return results
+
+    # PostgREST takes the columns of a bulk insert from its first row
+    by_columns = {}
+    for i in inserts:
+        by_columns.setdefault(tuple(writes[i].row), []).append(i)
+    for group in by_columns.values():
+        try:
+            db.session_records.insert_many([writes[i].row for i in group])
+        except RepositoryError as e:
+            if is_transient_error(e):
+                for i in group:
+                    results[i] = e
+                continue
+            logger.info(f"Bulk insert of {len(group)} rows refused ({str(e)}); inserting them one by one")
+            for i in group:
+                results[i] = write_planned_row(writes[i])
+            continue
+        for i in group:
+            logger.info(f"Inserted record for {writes[i].row['student_id']} (session {writes[i].row['session_number']}, "
+                        f"group {writes[i].row['group_name']})")
+    return results
+
+
+def planned_batch_requests(writes):
+    """Database requests write_planned_batch sends for a batch, without fallbacks (the scheduler's cost)."""
+    inserts = [write for write in writes if write.action == INSERT]
+    if len(inserts) < 2:
+        return len(writes)
+    return len(writes) - len(inserts) + len({tuple(write.row) for write in inserts})
+
+
+def write_engine():
+    """What sends upload writes: async_writer with WRITE_ENGINE=async on Supabase, else write_scheduler."""
+    if async_writer.enabled and db is not None and db.backend_name == 'supabase':
+        return async_writer
+    return write_scheduler
+
+
+def send_planned_writes(planned, on_result=None):
+    """
+    Send classified writes through write_engine(); returns None or the exception
+    for each write. on_result(index, error) is called as each write settles.
+    """
+    if write_engine() is async_writer:
+        session = db.backend.client.postgrest.session
+        return async_writer.run(planned, str(session.base_url), dict(session.headers),
+                                key=lambda write: (write.row['parent_no'], write.row['student_name']),
+                                on_result=on_result)
+    # A parent's rows share a batch
+    return write_scheduler.run(planned, write_planned_batch, key=lambda write: write.row['parent_no'],
+                               on_result=on_result, cost=planned_batch_requests)
+
+
+def build_upload_rows(records, session_number, quiz_mark, finish_time, group, is_general_exam, lecture_name='', exam_name='', month_param=None):
+    """
+    session_records payloads for parsed records; returns (rows, errors), one
+    error message per rejected record. Nothing is read or written here.
+    """
+    errors = []
+    # Payloads for every valid row; nothing is written until all rows are classified
+    rows_to_write = []
+    # The whole parent_no column is normalized in one call (normalization.py)
+    parent_nos_raw = [record.get('parent_no', '') or '' for record in records]
+    parent_nos_normalized = normalize_phone_series(parent_nos_raw).tolist()
+
+    for position, record in enumerate(records):
+        try:
+            student_id = record.get('id', '').strip()
+            student_name = record.get('name', '').strip() or 'Unknown'
+            parent_no_raw = parent_nos_raw[position]
+            parent_no = parent_nos_normalized[position]
+
+            # Validate required fields
+            if not parent_no:
+                msg = f"Missing parent_no for student '{student_name}' (raw='{parent_no_raw}')"
+                logger.warning(msg)
+                errors.append(msg)
+                continue
+            
+            if not student_name or student_name == 'Unknown':
+                msg = f"Missing student_name for id '{student_id}'"
+                logger.warning(msg)
+                errors.append(msg)
+                continue
+            
+            # Prepare data for database
+            db_data = {
+                'student_id': student_id or f'student_{position}',
+                'student_name': student_name,
+                'parent_no': parent_no,
+                'session_number': session_number,
+                'group_name': group,
+                'is_general_exam': bool(is_general_exam),  # CRITICAL: Ensure boolean
+                'attendance': int(record.get('attendance', 0)) if record.get('attendance') else 0,
+                'payment': float(record.get('payment', 0)) if record.get('payment') else 0,
+            }
+            
+            # Add lecture/exam name
+            if is_general_exam and exam_name:
+                db_data['exam_name'] = exam_name
+            elif not is_general_exam and lecture_name:
+                db_data['lecture_name'] = lecture_name
+            
+            # Add admin quiz mark
+            if quiz_mark is not None:
+                db_data['admin_quiz_mark'] = float(quiz_mark)
+            
+            # Add optional fields
+            if record.get('quiz_mark') is not None:
+                db_data['quiz_mark'] = float(record.get('quiz_mark'))
+            
+            if finish_time:
+                try:
+                    normalized_finish = normalize_timestamp(finish_time)
+                    db_data['finish_time'] = normalized_finish if normalized_finish else finish_time
+                except Exception:
+                    db_data['finish_time'] = finish_time
+
+            if record.get('start_time'):
+                # Normalize start_time from the parsed record (handles Arabic AM/PM, etc.)
+                try:
+                    normalized_start = normalize_timestamp(record.get('start_time'))
+                    db_data['start_time'] = normalized_start if normalized_start else record.get('start_time')
+                except Exception:
+                    db_data['start_time'] = record.get('start_time')
+
+            # Month: prefer explicit admin-provided month_param, otherwise derive from timestamps
+            try:
+                provided_month = None
+                if month_param:
+                    try:
+                        m_int = int(month_param)
+                        if 1 <= m_int <= 12:
+                            provided_month = m_int
+                    except Exception:
+                        provided_month = None
+
+                if provided_month is not None:
+                    db_data['month'] = provided_month
+                else:
+                    # Derive month from finish_time or start_time if available
+                    month_val = month_from_timestamps(db_data.get('finish_time'), db_data.get('start_time'))
+                    if month_val is not None:
+                        db_data['month'] = month_val
+            except Exception:
+                pass
+            
+            if record.get('homework_status') is not None:
+                db_data['homework_status'] = int(record.get('homework_status'))
+            
+            if record.get('pokin'):
+                db_data['pokin'] = float(record.get('pokin'))
+            
+            if record.get('student_no'):
+                db_data['student_no'] = str(record.get('student_no')).strip()
+            
+            rows_to_write.append(db_data)
+        except Exception as e:
+            errors.append(str(e))
+    return rows_to_write, errors
+
+
+def plan_upload_rows(rows_to_write):
+    """
+    Classify payloads into PlannedWrites (insert / update / rename) against
+    one bulk read of the uploaded parents' existing rows (identity_index.py).
+    """
+    existing = []
+    parent_nos = {row['parent_no'] for row in rows_to_write}
+    if parent_nos:
+        try:
+            existing = db.session_records.for_parents(parent_nos, ['id', 'student_id', 'student_name', 'parent_no', 'session_number'])
+        except Exception as e:
+            logger.warning("Error pre-fetching existing records: %s", str(e))
+    planned = StudentIdentityIndex.from_env(existing, normalize_name, normalize_name_series).plan(rows_to_write)
+    actions = Counter(write.action for write in planned)
+    logger.info(f"Upload plan: {actions[INSERT]} inserts, {actions[UPDATE]} updates, {actions[RENAME]} renames "
+                f"({sum(1 for w in planned if w.match in ('folded', 'student_id', 'fuzzy'))} matched by a different spelling or ID)")
+    return planned
+
+
+def write_upload_plan(planned, errors, total_records, upload_id=None):
+    """
+    Write planned rows; returns (updated_count, errors) with failed writes appended to errors.
+    The rows are journaled in batches first (ingest_journal.py) and sent through
+    send_planned_writes (adaptive batches, or concurrent async row writes): rows
+    still failing with a transient error are left to the journal's retrier instead of
+    being reported.
+    """
+    updated_count = 0
+    queued = 0
+    # Rows written per parent_no, announced to open dashboards at the end
+    written = Counter()
+
+    upload_id = upload_id or uuid.uuid4().hex
+    batches = ingest_journal.split(planned)
+    batch_ids = ingest_journal.begin(upload_id, [[write.row for write in batch] for batch in batches])
+    # Journal batch of each planned write, and what is left to settle in each batch
+    journal_batch = [n for n, batch in enumerate(batches) for _ in batch]
+    unsettled = [len(batch) for batch in batches]
+    retry_rows = [[] for _ in batches]
+    last_errors = [None] * len(batches)
+
+    def settle(index, error):
+        nonlocal updated_count, queued
+        write = planned[index]
+        n = journal_batch[index]
+        if error is None:
+            updated_count += write.sources
+            written[write.row['parent_no']] += write.sources
+        elif batch_ids[n] is not None and is_transient_error(error):
+            retry_rows[n].append(write.row)
+            queued += write.sources
+            last_errors[n] = str(error)
+        else:
+            errors.append(f"Row {write.row['student_id']}: {error} | payload: {write.row}")
+        unsettled[n] -= 1
+        if not unsettled[n]:
+            ingest_journal.complete(batch_ids[n], retry_rows[n], error=last_errors[n])
+
+    # Keeps other workers' retriers off these batches however long the writes take
+    with ingest_journal.holding(batch_ids):
+        send_planned_writes(planned, on_result=settle)
+
+    stats = write_engine().last_run
+    logger.info(f"Upload summary: {updated_count}/{total_records} records uploaded, {len(errors)} errors"
+                + (f", {queued} queued for retry (upload {upload_id})" if queued else '')
+                + f"; {stats['rows_per_second']} rows/s, {stats['concurrency']} batches of {stats['batch_size']} "
+                  f"rows in flight, {stats['throttled']} throttled")
+    event_broker.publish((p, {'type': 'sessions', 'changed': n}) for p, n in written.items())
+    return updated_count, errors
+
+
+def replay_journal_rows(rows):
+    """
+    Journal retrier callback: classify journaled rows against a fresh read and
+    write them again; returns (rows to retry, rejected rows, last error text).
+    """
+    retry_rows, rejected_rows, last_error = [], [], None
+    written = Counter()
+    planned = plan_upload_rows(rows)
+    for write, error in zip(planned, send_planned_writes(planned)):
+        if error is None:
+            written[write.row['parent_no']] += write.sources
+            continue
+        last_error = str(error)
+        (retry_rows if is_transient_error(error) else rejected_rows).append(write.row)
+    event_broker.publish((p, {'type': 'sessions', 'changed': n}) for p, n in written.items())
+    return retry_rows, rejected_rows, last_error
+
+
+def update_database(records, session_number, quiz_mark, finish_time, group, is_general_exam, lecture_name='', exam_name='', has_exam_grade=True, has_payment=True, has_time=True, month_param=None, upload_id=None):
     """
     Update database with parsed records using UPSERT logic
     Works with existing constraint: UNIQUE (student_name, session_number, parent_no)
+    Rows are classified (insert / update / rename) against one read of the
+    uploaded parents' existing rows before the first write (identity_index.py).
     """
     try:
-        updated_count = 0
-        errors = []
+        rows_to_write, errors = build_upload_rows(records, session_number, quiz_mark, finish_time, group,
+                                                  is_general_exam, lecture_name, exam_name, month_param)
+        return write_upload_plan(plan_upload_rows(rows_to_write), errors, len(records), upload_id)
+    except Exception as e:
+        logger.exception(f"✗ Critical error in update_database: {str(e)}")
+        raise Exception(f"Error updating database: {str(e)}")
+
+def process_upload(file_path, upload):
+    """
+    Parse a saved upload and write it to the database; returns (response, status).
+    Runs in the ingestion process pool (see ingest_executor.py), so it only
+    takes and returns picklable values and removes the file when done.
+    """
+    session_number = upload['session_number']
+    quiz_mark = upload['quiz_mark']
+    finish_time = upload['finish_time']
+    group = upload['group']
+    is_general_exam = upload['is_general_exam']
+    lecture_name = upload['lecture_name']
+    lecture_key = upload['lecture_key']
+    exam_name = upload['exam_name']
+    has_exam_grade = upload['has_exam_grade']
+    has_payment = upload['has_payment']
+    has_time = upload['has_time']
+    month_param = upload['month_param']
+
+    try:
+        # Parse Excel file based on type
+        if is_general_exam:
+            records = parse_general_exam_sheet(file_path)
+        else:
+            records = parse_normal_lecture_sheet(file_path)
         
-        # Collect unique parent_no values from all records to pre-fetch existing records
-        unique_parent_nos = set()
-        for rec in records:
-            parent_no_raw = rec.get('parent_no', '') or ''
-            parent_no = normalize_phone(parent_no_raw) or ''
-            if parent_no:
-                unique_parent_nos.add(parent_no)
+        if not records:
+            return {'error': 'No records found in Excel file'}, 400
         
-        # Pre-fetch all existing records for these parent numbers (cache lookup)
-        existing_by_parent = {}
-        if unique_parent_nos:
+        # If lecture_name not provided but lecture_key exists, lookup lecture_name from `lectures` table
+        if not lecture_name and lecture_key:
             try:
-                for parent_no in unique_parent_nos:
-                    existing = supabase.table('session_records').select('student_id', 'student_name').eq('parent_no', parent_no).execute()
-                    if getattr(existing, 'data', None):
-                        existing_by_parent[parent_no] = existing.data
-                    else:
-                        existing_by_parent[parent_no] = []
+                lecture_name = db.lectures.lecture_name_for_key(lecture_key) or lecture_name
             except Exception as e:
-                logger.warning("Error pre-fetching existing records: %s", str(e))
+                logger.warning(f"Could not resolve lecture_key {lecture_key}: {str(e)}")
+
+        if upload.get('dry_run'):
+            # Classify without writing; the payloads are kept for a later commit (upload_plans.py)
+            rows_to_write, errors = build_upload_rows(records, session_number, quiz_mark, finish_time, group,
+                                                      is_general_exam, lecture_name, exam_name, month_param)
+            summary = describe_upload_plan(plan_upload_rows(rows_to_write), errors, len(records))
+            plan_id = upload_plans.save({'rows': rows_to_write, 'errors': errors, 'total_records': len(records),
+                                         'summary': summary})
+            os.remove(file_path)
+            return dict(summary, success=True, dry_run=True, plan_id=plan_id,
+                        expires_in=int(upload_plans.ttl_seconds)), 200
+
+        # Update database
+        upload_id = uuid.uuid4().hex
+        updated_count, errors = update_database(
+            records,
+            session_number,
+            quiz_mark,
+            finish_time,
+            group,
+            is_general_exam,
+            lecture_name,
+            exam_name,
+            has_exam_grade,
+            has_payment,
+            has_time,
+            month_param,
+            upload_id
+        )
         
-        # Batch lists for insert and update operations
-        inserts_to_do = []
-        updates_to_do = []  # (old_id, update_data)
+        # Clean up uploaded file
+        os.remove(file_path)
         
-        for record in records:
-            try:
-                student_id = record.get('id', '').strip()
-                student_name = record.get('name', '').strip() or 'Unknown'
-                parent_no_raw = record.get('parent_no', '') or ''
-                parent_no = normalize_phone(parent_no_raw) or ''
+        return upload_response(updated_count, errors, len(records), ingest_journal.pending_rows(upload_id)), 200
+        
+    except Exception as e:
+        # Clean up file on error
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        return {'error': f'Error processing file: {str(e)}', 'traceback': traceback.format_exc()}, 500
 
-                # Validate required fields
-                if not parent_no:
-                    msg = f"Missing parent_no for student '{student_name}' (raw='{parent_no_raw}')"
-                    logger.warning(msg)
-                    errors.append(msg)
-                    continue
-                
-                if not student_name or student_name == 'Unknown':
-                    msg = f"Missing student_name for id '{student_id}'"
-                    logger.warning(msg)
-                    errors.append(msg)
-                    continue
-                
-                # Prepare data for database
-                db_data = {
-                    'student_id': student_id or f'student_{updated_count}',
-                    'student_name': student_name,
-                    'parent_no': parent_no,
-                    'session_number': session_number,
-                    'group_name': group,
-                    'is_general_exam': bool(is_general_exam),  # CRITICAL: Ensure boolean
-                    'attendance': int(record.get('attendance', 0)) if record.get('attendance') else 0,
-                    'payment': float(record.get('payment', 0)) if record.get('payment') else 0,
-                }
-                
-                # Add lecture/exam name
-                if is_general_exam and exam_name:
-                    db_data['exam_name'] = exam_name
-                elif not is_general_exam and lecture_name:
-                    db_data['lecture_name'] = lecture_name
-                
-                # Add admin quiz mark
-                if quiz_mark is not None:
-                    db_data['admin_quiz_mark'] = float(quiz_mark)
-                
-                # Add optional fields
-                if record.get('quiz_mark') is not None:
-                    db_data['quiz_mark'] = float(record.get('quiz_mark'))
-                
-                if finish_time:
-                    try:
-                        normalized_finish = normalize_timestamp(finish_time)
-                        db_data['finish_time'] = normalized_finish if normalized_finish else finish_time
-                    except Exception:
-                        db_data['finish_time'] = finish_time
 
-                if record.get('start_time'):
-                    # Normalize start_time from the parsed record (handles Arabic AM/PM, etc.)
-                    try:
-                        normalized_start = normalize_timestamp(record.get('start_time'))
-                        db_data['start_time'] = normalized_start if normalized_start else record.get('start_time')
-                    except Exception:
-                        db_data['start_time'] = record.get('start_time')
+def upload_response(updated_count, errors, total_records, queued=0):
+    """Response body of a finished upload (or plan commit)."""
+    response = {
+        'success': True,
+        'message': f'Successfully processed {updated_count} records',
+        'updated_count': updated_count,
+        'total_records': total_records,
+        'partial': False
+    }
+    if write_engine().last_run:
+        # Rate and settings of the writes just made (write_scheduler.py / async_writer.py)
+        response['write_stats'] = write_engine().last_run
+    if queued:
+        # Failed with a transient database error; the journal's retrier writes them later
+        response['queued_for_retry'] = queued
+        response['message'] += f' ({queued} queued for retry)'
+
+    if errors:
+        response['errors'] = errors
+        response['error_count'] = len(errors)
+        # If some records succeeded but some failed, mark as partial
+        if updated_count > 0:
+            response['partial'] = True
+            response['message'] = f'Processed {updated_count}/{total_records} records with {len(errors)} errors'
+            response['success'] = True
+        else:
+            # All records failed
+            response['partial'] = False
+            response['success'] = False
+            response['message'] = f'All records failed: {len(errors)} errors'
+    return response
+
+
+def describe_upload_plan(planned, errors, total_records):
+    """Dry-run summary: counts per action and the planned rows, renames and inexact matches first."""
+    actions = Counter(write.action for write in planned)
+    ordered = sorted(planned, key=lambda w: (w.action != RENAME, w.match in (None, 'exact')))
+    preview = ordered[:upload_plans.preview_rows]
+    return {
+        'total_records': total_records,
+        'inserts': actions[INSERT],
+        'updates': actions[UPDATE],
+        'renames': actions[RENAME],
+        'rejected': len(errors),
+        # Rows listed twice for the same student and session; the last one is written
+        'duplicates': sum(w.sources - 1 for w in planned),
+        'rows': [{
+            'action': w.action,
+            'match': w.match,
+            'student_id': w.row['student_id'],
+            'student_name': w.row['student_name'],
+            'parent_no': w.row['parent_no'],
+            'session_number': w.row['session_number'],
+            'previous_student_id': w.previous_id,
+        } for w in preview],
+        'rows_truncated': len(preview) < len(planned),
+        'rejects': errors,
+    }
 
-                # Month: prefer explicit admin-provided month_param, otherwise derive from timestamps
-                try:
-                    provided_month = None
-                    if month_param:
-                        try:
-                            m_int = int(month_param)
-                            if 1 <= m_int <= 12:
-                                provided_month = m_int
-                        except Exception:
-                            provided_month = None
-
-                    if provided_month is not None:
-                        db_data['month'] = provided_month
-                    else:
-                        # Derive month from finish_time or start_time if available
-                        month_val = None
-                        if db_data.get('finish_time'):
-                            try:
-                                dt = date_parser.parse(str(db_data.get('finish_time')))
-                                month_val = dt.month
-                            except Exception:
-                                month_val = None
-                        if month_val is None and db_data.get('start_time'):
-                            try:
-                                dt = date_parser.parse(str(db_data.get('start_time')))
-                                month_val = dt.month
-                            except Exception:
-                                month_val = None
-                        if month_val is not None:
-                            db_data['month'] = int(month_val)
-                except Exception:
-                    pass
-                
-                if record.get('homework_status') is not None:
-                    db_data['homework_status'] = int(record.get('homework_status'))
-                
-                if record.get('pokin'):
-                    db_data['pokin'] = float(record.get('pokin'))
-                
-                if record.get('student_no'):
-                    db_data['student_no'] = str(record.get('student_no')).strip()
-                
-                # Try to insert record; handle Supabase response errors (client may not raise)
-                try:
-                    insert_res = supabase.table('session_records').insert(db_data).execute()
-                    insert_error = getattr(insert_res, 'error', None)
-                    if not insert_error:
-                        updated_count += 1
-                        logger.info(f"Inserted record for {student_id} (session {session_number}, group {group})")
-                    else:
-                        # Log full error dict + payload for diagnostics
-                        try:
-                            logger.error("Insert error for %s: %s -- payload: %s", student_id, insert_error, db_data)
-                        except Exception:
-                            logger.error("Insert error for %s: %s", student_id, str(insert_error))
 
-                        # Normalize error message text for checks and append to errors
-                        error_msg = None
-                        try:
-                            error_msg = insert_error.get('message') if isinstance(insert_error, dict) else str(insert_error)
-                        except Exception:
-                            error_msg = str(insert_error)
-
-                        # If the error is caused by a missing column in the schema cache
-                        # (e.g. admin_quiz_mark), try removing that column and retrying.
-                        if isinstance(error_msg, str) and ("Could not find the 'admin_quiz_mark'" in error_msg or 'PGRST204' in str(insert_error)):
-                            try:
-                                reduced_payload = dict(db_data)
-                                if 'admin_quiz_mark' in reduced_payload:
-                                    reduced_payload.pop('admin_quiz_mark')
-                                # attempt insert without the offending column
-                                retry_res = supabase.table('session_records').insert(reduced_payload).execute()
-                                retry_error = getattr(retry_res, 'error', None)
-                                if not retry_error:
-                                    updated_count += 1
-                                    logger.info(f"Inserted record for %s after removing admin_quiz_mark (session %s, group %s)", student_id, session_number, group)
-                                    # remove last recorded error if present
-                                    if errors:
-                                        errors.pop()
-                                    continue
-                                else:
-                                    logger.error("Retry insert error for %s: %s -- reduced payload: %s", student_id, retry_error, reduced_payload)
-                            except Exception as retry_exc:
-                                logger.exception("Retry insert exception for %s: %s", student_id, str(retry_exc))
-
-                        # If duplicate key (unique constraint) - try updating the existing row instead of failing
-                        if isinstance(error_msg, str) and ('23505' in error_msg or 'duplicate' in error_msg.lower() or 'unique' in error_msg.lower() or 'session_records_student_name_session_number_parent_no_key' in error_msg):
-                            try:
-                                # Preferred: update by the desired unique key (student_name, parent_no)
-                                update_res = supabase.table('session_records').update(db_data).eq('student_name', student_name).eq('parent_no', parent_no).execute()
-                                update_error = getattr(update_res, 'error', None)
-                                if not update_error:
-                                    updated_count += 1
-                                    logger.info("Updated existing record by student_name+parent_no for %s", student_id)
-                                    if errors:
-                                        errors.pop()
-                                    continue
-                            except Exception:
-                                logger.exception("Exception while attempting update by student_name+parent_no for %s", student_id)
-
-                            # Fallback: try targeted update by student_id + session/group
-                            try:
-                                fut_update = supabase.table('session_records').update(db_data).eq('student_id', student_id).eq('session_number', session_number).eq('group_name', group).eq('is_general_exam', is_general_exam).execute()
-                                fut_err = getattr(fut_update, 'error', None)
-                                if not fut_err:
-                                    updated_count += 1
-                                    logger.info("Updated duplicate record for %s via fallback keys", student_id)
-                                    if errors:
-                                        errors.pop()
-                                    continue
-                                else:
-                                    logger.error("Fallback update also failed for %s: %s", student_id, fut_err)
-                            except Exception:
-                                logger.exception("Fallback update exception for %s", student_id)
-
-                        # Record detailed error for response
-                        errors.append(f"Row {student_id}: {error_msg} | payload: {db_data}")
-
-                        # As a last attempt, try to find an existing record by name/session/group and update student_id if it differs
-                        try:
-                            existing = supabase.table('session_records').select('student_id').eq('student_name', student_name).eq('session_number', session_number).eq('group_name', group).eq('is_general_exam', is_general_exam).limit(1).execute()
-                            if getattr(existing, 'data', None) and len(existing.data) > 0:
-                                old_id = existing.data[0].get('student_id')
-                                if old_id and old_id != student_id:
-                                    logger.info("Found same person '%s' with old ID '%s', updating to new ID '%s'", student_name, old_id, student_id)
-                                    update_data = dict(db_data)
-                                    update_data['student_id'] = student_id
-                                    try:
-                                        update_by_name = supabase.table('session_records').update(update_data).eq('student_id', old_id).eq('session_number', session_number).eq('group_name', group).eq('is_general_exam', is_general_exam).execute()
-                                        update_name_error = getattr(update_by_name, 'error', None)
-                                        if not update_name_error:
-                                            updated_count += 1
-                                            logger.info("Updated student ID from '%s' to '%s' for '%s'", old_id, student_id, student_name)
-                                            if errors:
-                                                errors.pop()
-                                        else:
-                                            name_err = update_name_error.get('message') if isinstance(update_name_error, dict) else str(update_name_error)
-                                            logger.error("Name-based update failed for %s: %s -- payload: %s", student_name, name_err, db_data)
-                                    except Exception:
-                                        logger.exception("Name-based update exception for %s", student_name)
-                        except Exception as name_err:
-                            logger.exception("Name-based lookup/update exception for %s: %s", student_name, str(name_err))
-                except Exception as e:
-                    # Exception from Supabase client call
-                    err_text = str(e)
-                    errors.append(f"Row {student_id}: {err_text}")
-                    logger.exception(f"Insert exception for {student_id}: {err_text}")
-                    
-            except Exception as e:
-                errors.append(str(e))
-        
-        logger.info(f"Upload summary: {updated_count}/{len(records)} records uploaded, {len(errors)} errors")
-        return updated_count, errors
-        
+def commit_planned_upload(plan_id):
+    """
+    Write a dry-run plan saved by process_upload; returns (response, status).
+    Runs in the ingestion process pool like process_upload.
+    """
+    plan = upload_plans.claim(plan_id)
+    if plan is None:
+        return {'error': 'Upload plan not found. It may have expired or been committed already.'}, 404
+    total_records = plan['total_records']
+    try:
+        # Classified again: other uploads may have written these students since the dry run
+        planned = plan_upload_rows(plan['rows'])
+        summary = describe_upload_plan(planned, plan['errors'], total_records)
+        updated_count, errors = write_upload_plan(planned, list(plan['errors']), total_records, plan_id)
     except Exception as e:
-        logger.exception(f"✗ Critical error in update_database: {str(e)}")
-        raise Exception(f"Error updating database: {str(e)}")
+        logger.exception(f"Error committing upload plan {plan_id}: {str(e)}")
+        return {'error': f'Error committing upload plan: {str(e)}', 'traceback': traceback.format_exc()}, 500
+    response = upload_response(updated_count, errors, total_records, ingest_journal.pending_rows(plan_id))
+    response['plan_id'] = plan_id
+    response['changed_since_dry_run'] = any(summary[k] != plan['summary'][k] for k in ('inserts', 'updates', 'renames'))
+    return response, 200
+
 
 @app.route('/', methods=['GET'])
 def root():
@@ -813,6 +1053,79 @@ def health_check():
     """Health check endpoint"""
     return jsonify({'status': 'ok', 'message': 'Flask backend is running'}), 200
         
+def upload_options(form):
+    """
+    Validated upload settings from the /api/upload-excel form fields (or the
+    same keys in a JSON body); returns (upload, None) or (None, error message).
+    """
+    session_number = form.get('session_number')
+    # Optional month provided by admin (1..12)
+    month_param = form.get('month')
+    quiz_mark = form.get('quiz_mark')
+    finish_time = form.get('finish_time')
+    group = form.get('group')
+    is_general_exam = str(form.get('is_general_exam', 'false')).lower() == 'true'
+    lecture_name = str(form.get('lecture_name') or '').strip()
+    # Optional: allow passing a lecture unique key which maps to a lecture_name
+    lecture_key = str(form.get('lecture_key') or '').strip()
+    exam_name = str(form.get('exam_name') or '').strip()
+    has_exam_grade = str(form.get('has_exam_grade', 'true')).lower() == 'true'
+    has_payment = str(form.get('has_payment', 'true')).lower() == 'true'
+    has_time = str(form.get('has_time', 'true')).lower() == 'true'
+    dry_run = str(form.get('dry_run', 'false')).lower() == 'true'
+
+    # Validate session number
+    try:
+        session_number = int(session_number)
+        if session_number not in ALLOWED_SESSIONS:
+            return None, 'Session number must be between 1 and 8'
+    except (ValueError, TypeError):
+        return None, 'Invalid session number'
+
+    # Validate quiz mark (required for general exam)
+    if is_general_exam:
+        try:
+            quiz_mark = float(quiz_mark) if quiz_mark else None
+        except (ValueError, TypeError):
+            return None, 'Invalid quiz mark'
+    else:
+        quiz_mark = float(quiz_mark) if quiz_mark else None
+
+    # Validate group
+    if not group or group not in ALLOWED_GROUPS:
+        return None, f'Invalid group. Must be one of: {", ".join(ALLOWED_GROUPS)}'
+
+    return {
+        'session_number': session_number,
+        'quiz_mark': quiz_mark,
+        'finish_time': finish_time,
+        'group': group,
+        'is_general_exam': is_general_exam,
+        'lecture_name': lecture_name,
+        'lecture_key': lecture_key,
+        'exam_name': exam_name,
+        'has_exam_grade': has_exam_grade,
+        'has_payment': has_payment,
+        'has_time': has_time,
+        'month_param': month_param,
+        'dry_run': dry_run,
+    }, None
+
+
+def run_upload_job(file_path, upload):
+    """Run process_upload on a saved file in the ingestion pool; returns a Flask response."""
+    try:
+        response, status = ingest.run(process_upload, file_path, upload, backend_name=db.backend_name)
+    except Exception as e:
+        # The ingestion process died before it could answer
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        logger.exception(f"Upload job failed: {str(e)}")
+        return jsonify({'error': f'Error processing file: {str(e)}', 'traceback': traceback.format_exc()}), 500
+    write_scheduler.record_upload(response.get('write_stats'))
+    return jsonify(response), status
+
+
 @app.route('/api/upload-excel', methods=['POST'])
 def upload_excel():
     """
@@ -829,10 +1142,12 @@ def upload_excel():
     - has_exam_grade: true/false (show exam grade in parent dashboard)
     - has_payment: true/false (show payment in parent dashboard)
     - has_time: true/false (show finish time in parent dashboard)
+    - dry_run: true/false (classify the rows and return the plan without writing;
+      POST /api/upload-excel/plans/<plan_id>/commit writes it)
     """
     try:
         # Check if Supabase is initialized
-        if not supabase:
+        if not db:
             return jsonify({'error': 'Database not configured. Please contact administrator.'}), 500
         
         # Validate required fields
@@ -844,121 +1159,125 @@ def upload_excel():
             return jsonify({'error': 'No file selected'}), 400
         
         if not allowed_file(file.filename):
-            return jsonify({'error': 'Invalid file type. Only .xlsx and .xls files are allowed'}), 400
-        
-        # Get form data
-        session_number = request.form.get('session_number')
-        # Optional month provided by admin (1..12)
-        month_param = request.form.get('month')
-        quiz_mark = request.form.get('quiz_mark')
-        finish_time = request.form.get('finish_time')
-        group = request.form.get('group')
-        is_general_exam = request.form.get('is_general_exam', 'false').lower() == 'true'
-        lecture_name = request.form.get('lecture_name', '').strip()
-        # Optional: allow passing a lecture unique key which maps to a lecture_name
-        lecture_key = request.form.get('lecture_key', '').strip()
-        exam_name = request.form.get('exam_name', '').strip()
-        has_exam_grade = request.form.get('has_exam_grade', 'true').lower() == 'true'
-        has_payment = request.form.get('has_payment', 'true').lower() == 'true'
-        has_time = request.form.get('has_time', 'true').lower() == 'true'
-
-        # Validate session number
-        try:
-            session_number = int(session_number)
-            if session_number not in ALLOWED_SESSIONS:
-                return jsonify({'error': f'Session number must be between 1 and 8'}), 400
-        except (ValueError, TypeError):
-            return jsonify({'error': 'Invalid session number'}), 400
-        
-        # Validate quiz mark (required for general exam)
-        if is_general_exam:
-            try:
-                quiz_mark = float(quiz_mark) if quiz_mark else None
-            except (ValueError, TypeError):
-                return jsonify({'error': 'Invalid quiz mark'}), 400
-        else:
-            quiz_mark = float(quiz_mark) if quiz_mark else None
-        
-        # Validate group
-        if not group or group not in ALLOWED_GROUPS:
-            return jsonify({'error': f'Invalid group. Must be one of: {", ".join(ALLOWED_GROUPS)}'}), 400
+            return jsonify({'error': invalid_file_type_message()}), 400
         
+        upload, error = upload_options(request.form)
+        if error:
+            return jsonify({'error': error}), 400
+
         # Save file
         filename = secure_filename(file.filename)
         file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         file.save(file_path)
+        return run_upload_job(file_path, upload)
         
-        try:
-            # Parse Excel file based on type
-            if is_general_exam:
-                records = parse_general_exam_sheet(file_path)
-            else:
-                records = parse_normal_lecture_sheet(file_path)
-            
-            if not records:
-                return jsonify({'error': 'No records found in Excel file'}), 400
-            
-            # If lecture_name not provided but lecture_key exists, lookup lecture_name from `lectures` table
-            if not lecture_name and lecture_key:
-                try:
-                    lookup = supabase.table('lectures').select('lecture_name').eq('unique_key', lecture_key).limit(1).execute()
-                    if lookup.data and len(lookup.data) > 0:
-                        lecture_name = lookup.data[0].get('lecture_name', '') or lecture_name
-                except Exception as e:
-                    logger.warning(f"Could not resolve lecture_key {lecture_key}: {str(e)}")
-
-            # Update database
-            updated_count, errors = update_database(
-                records,
-                session_number,
-                quiz_mark,
-                finish_time,
-                group,
-                is_general_exam,
-                lecture_name,
-                exam_name,
-                has_exam_grade,
-                has_payment,
-                has_time,
-                month_param
-            )
-            
-            # Clean up uploaded file
-            os.remove(file_path)
-            
-            response = {
-                'success': True,
-                'message': f'Successfully processed {updated_count} records',
-                'updated_count': updated_count,
-                'total_records': len(records),
-                'partial': False
-            }
+    except Exception as e:
+        return jsonify({'error': f'Server error: {str(e)}', 'traceback': traceback.format_exc()}), 500
 
-            if errors:
-                response['errors'] = errors
-                response['error_count'] = len(errors)
-                # If some records succeeded but some failed, mark as partial
-                if updated_count > 0:
-                    response['partial'] = True
-                    response['message'] = f'Processed {updated_count}/{len(records)} records with {len(errors)} errors'
-                    response['success'] = True
-                else:
-                    # All records failed
-                    response['partial'] = False
-                    response['success'] = False
-                    response['message'] = f'All records failed: {len(errors)} errors'
+@app.route('/api/upload-excel/plans/<plan_id>', methods=['GET'])
+def get_upload_plan(plan_id):
+    """Summary of a dry-run upload plan that has not been committed yet."""
+    plan = upload_plans.get(plan_id)
+    if plan is None:
+        return jsonify({'error': 'Upload plan not found. It may have expired or been committed already.'}), 404
+    expires_in = max(0, int(plan['created'] + upload_plans.ttl_seconds - time.time()))
+    return jsonify(dict(plan['summary'], plan_id=plan_id, expires_in=expires_in)), 200
 
-            return jsonify(response), 200
-            
+
+@app.route('/api/upload-excel/plans/<plan_id>/commit', methods=['POST'])
+def commit_upload_plan(plan_id):
+    """Write a dry-run upload plan (see upload_plans.py); answers like /api/upload-excel."""
+    try:
+        if not db:
+            return jsonify({'error': 'Database not configured. Please contact administrator.'}), 500
+        try:
+            response, status = ingest.run(commit_planned_upload, plan_id, backend_name=db.backend_name)
         except Exception as e:
-            # Clean up file on error
-            if os.path.exists(file_path):
-                os.remove(file_path)
-            return jsonify({'error': f'Error processing file: {str(e)}', 'traceback': traceback.format_exc()}), 500
-        
+            logger.exception(f"Upload plan commit failed: {str(e)}")
+            return jsonify({'error': f'Error committing upload plan: {str(e)}', 'traceback': traceback.format_exc()}), 500
+        write_scheduler.record_upload(response.get('write_stats'))
+        return jsonify(response), status
+    except Exception as e:
+        return jsonify({'error': f'Server error: {str(e)}', 'traceback': traceback.format_exc()}), 500
+
+
+def resumable_upload_error(e):
+    body = {'error': str(e)}
+    if e.offset is not None:
+        body['offset'] = e.offset
+    return jsonify(body), e.status
+
+
+@app.route('/api/uploads', methods=['POST'])
+def create_resumable_upload():
+    """
+    Start a chunked upload (see resumable_uploads.py). JSON body: filename,
+    size (bytes), sha256 (hex) and the /api/upload-excel form fields.
+    """
+    try:
+        if not db:
+            return jsonify({'error': 'Database not configured. Please contact administrator.'}), 500
+        data = request.get_json(silent=True) or {}
+        filename = secure_filename(str(data.get('filename') or ''))
+        if not filename:
+            return jsonify({'error': 'No file name provided'}), 400
+        if not allowed_file(filename):
+            return jsonify({'error': invalid_file_type_message()}), 400
+        upload, error = upload_options(data)
+        if error:
+            return jsonify({'error': error}), 400
+        return jsonify(resumable_uploads.create(filename, data.get('size'), data.get('sha256'), upload)), 201
+    except ResumableUploadError as e:
+        return resumable_upload_error(e)
     except Exception as e:
         return jsonify({'error': f'Server error: {str(e)}', 'traceback': traceback.format_exc()}), 500
 
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def get_resumable_upload(upload_id):
+    """Bytes received so far (`offset`): where a client resumes after a failure."""
+    try:
+        return jsonify(resumable_uploads.status(upload_id)), 200
+    except ResumableUploadError as e:
+        return resumable_upload_error(e)
+
+
+@app.route('/api/uploads/<upload_id>', methods=['PUT'])
+def put_upload_chunk(upload_id):
+    """Store the raw request body at ?offset= (at most the bytes received so far)."""
+    try:
+        status = resumable_uploads.write_chunk(upload_id, request.args.get('offset'), request.stream,
+                                               request.content_length)
+        return jsonify(status), 200
+    except ResumableUploadError as e:
+        return resumable_upload_error(e)
+
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def abort_resumable_upload(upload_id):
+    try:
+        resumable_uploads.abort(upload_id)
+        return jsonify({'success': True}), 200
+    except ResumableUploadError as e:
+        return resumable_upload_error(e)
+
+
+@app.route('/api/uploads/<upload_id>/finalize', methods=['POST'])
+def finalize_resumable_upload(upload_id):
+    """Check the assembled file and process it like /api/upload-excel."""
+    try:
+        if not db:
+            return jsonify({'error': 'Database not configured. Please contact administrator.'}), 500
+        meta = resumable_uploads.status(upload_id)
+        file_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{upload_id}-{meta['filename']}")
+        upload = resumable_uploads.finish(upload_id, file_path)
+        return run_upload_job(file_path, upload)
+    except ResumableUploadError as e:
+        return resumable_upload_error(e)
+    except Exception as e:
+        return jsonify({'error': f'Server error: {str(e)}', 'traceback': traceback.format_exc()}), 500
+
+
 @app.route('/api/groups', methods=['GET'])
 def get_groups():
     """Get list of available groups"""
@@ -970,51 +1289,83 @@ def get_sessions():
     return jsonify({'sessions': ALLOWED_SESSIONS}), 200
 
 
+def guarded_read(key, loader, budget=None):
+    """
+    Run a read query through read_guard; a stale (last-known-good) answer marks
+    the response as stale (see flag_stale_response).
+    """
+    value, stale_age = read_guard.read(key, loader, budget)
+    if stale_age is not None:
+        g.stale_age = max(stale_age, g.get('stale_age', 0))
+    return value
+
+
+def read_unavailable_response(e):
+    """503 with Retry-After when read_guard has neither a live nor a stored answer."""
+    response = jsonify({'error': str(e)})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(e.retry_after or 1)
+    return response
+
+
+@app.after_request
+def flag_stale_response(response):
+    """Mark JSON built from last-known-good data: `stale` / `stale_age_seconds` in the body and a Warning header."""
+    stale_age = g.get('stale_age')
+    if stale_age is None or not response.is_json or response.direct_passthrough:
+        return response
+    body = response.get_json(silent=True)
+    if isinstance(body, dict):
+        body.update(stale=True, stale_age_seconds=stale_age)
+        response.set_data(app.json.dumps(body))
+    response.headers['Warning'] = '110 - "Response is Stale"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+def parent_phone_from_request(allow_query_token=False):
+    """
+    Phone number whose data the request may read, as (phone, None) or (None, error response).
+    A parent bearer token decides the phone by itself; only admins pass
+    phone_number. With allow_query_token, the token may also come as
+    ?access_token= (for EventSource, which cannot send headers).
+    """
+    token = bearer_token(request.headers)
+    if not token and allow_query_token:
+        token = request.args.get('access_token') or None
+    if token:
+        try:
+            claims = auth_tokens.verify(token)
+        except InvalidToken as e:
+            return None, (jsonify({'error': str(e), 'token_expired': e.expired}), 401)
+        if claims['role'] == ROLE_PARENT:
+            return claims['sub'], None
+    else:
+        return None, (jsonify({'error': 'Authorization token required'}), 401)
+
+    phone = request.args.get('phone_number')
+    if not phone:
+        return None, (jsonify({'error': 'phone_number query parameter required'}), 400)
+    return normalize_phone(phone), None
+
+
 @app.route('/api/parent/sessions/months', methods=['GET'])
 def get_parent_months():
     """Return available months for a parent's student sessions (distinct months present)
-    Query params: phone_number (required), student_name (optional)
+    Query params: phone_number (unless a parent token is sent), student_name (optional)
     """
-    phone = request.args.get('phone_number')
+    phone, error = parent_phone_from_request()
+    if error:
+        return error
     student_name = request.args.get('student_name')
-    if not phone:
-        return jsonify({'error': 'phone_number query parameter required'}), 400
-    phone = normalize_phone(phone)
     try:
-        query = supabase.table('session_records').select('month', 'finish_time', 'start_time', 'created_at').eq('parent_no', phone)
-        if student_name:
-            query = query.eq('student_name', student_name)
-        res = query.execute()
-        records = res.data or []
-
-        months_set = set()
-        for r in records:
-            try:
-                m = r.get('month')
-                if m is not None:
-                    # ensure int
-                    try:
-                        months_set.add(int(m))
-                        continue
-                    except Exception:
-                        pass
-
-                # If month is missing or invalid, try deriving from finish_time or start_time
-                # (do NOT derive from created_at — upload timestamp can cause unrelated months to appear)
-                for dkey in ('finish_time', 'start_time'):
-                    val = r.get(dkey)
-                    if val:
-                        try:
-                            dt = date_parser.parse(str(val))
-                            months_set.add(int(dt.month))
-                            break
-                        except Exception:
-                            continue
-            except Exception:
-                continue
-
-        months = sorted(list(months_set))
+        # `month` is set at upload time (and by month_backfill.py for older rows),
+        # so this is a DISTINCT over an index instead of parsing every timestamp
+        months = guarded_read(('months', phone, student_name),
+                              lambda: db.session_records.months_for_parent(phone, student_name=student_name))
         return jsonify({'months': months}), 200
+    except ReadUnavailable as e:
+        return read_unavailable_response(e)
     except Exception as e:
         logger.exception(f"Error fetching parent months: {str(e)}")
         return jsonify({'error': f'Error fetching months: {str(e)}'}), 500
@@ -1023,14 +1374,12 @@ def get_parent_months():
 @app.route('/api/parent/students', methods=['GET'])
 def get_parent_students():
     """Return aggregated student list for a parent, grouped by parent_no + student_name"""
-    phone = request.args.get('phone_number')
-    if not phone:
-        return jsonify({'error': 'phone_number query parameter required'}), 400
-    phone = normalize_phone(phone)
+    phone, error = parent_phone_from_request()
+    if error:
+        return error
 
     try:
-        result = supabase.table('session_records').select('*').eq('parent_no', phone).execute()
-        records = result.data or []
+        records = guarded_read(('students', phone), lambda: db.session_records.for_parent(phone))
         # Debug logging: report counts and sample flags
         try:
             total_records = len(records)
@@ -1097,20 +1446,82 @@ def get_parent_students():
             })
 
         return jsonify({'students': students}), 200
+    except ReadUnavailable as e:
+        return read_unavailable_response(e)
     except Exception as e:
         logger.exception(f"Error fetching students: {str(e)}")
         return jsonify({'error': f'Error fetching students: {str(e)}'}), 500
     
     
+def session_v1(r):
+    """One session_records row in the /api/parent/sessions v1 format."""
+    has_exam_grade = r.get('has_exam_grade', True)
+    has_payment = r.get('has_payment', True)
+    has_time = r.get('has_time', True)
+    
+    # CRITICAL FIX: Properly handle is_general_exam boolean
+    is_general_exam_raw = r.get('is_general_exam')
+    is_general_exam = False
+    
+    # Handle all possible true values
+    if is_general_exam_raw is True:
+        is_general_exam = True
+    elif isinstance(is_general_exam_raw, str) and is_general_exam_raw.lower() == 'true':
+        is_general_exam = True
+    elif isinstance(is_general_exam_raw, int) and is_general_exam_raw == 1:
+        is_general_exam = True
+    
+    formatted_start = format_start_time_arabic(r.get('start_time'))
+
+    session = {
+        'id': r.get('id') or r.get('student_no') or r.get('student_id'),
+        'chapter': r.get('session_number'),
+        'name': r.get('lecture_name') or r.get('exam_name') or f"Session {r.get('session_number')}",
+        'lectureName': r.get('lecture_name') or r.get('exam_name'),
+        'date': r.get('finish_time') or '',
+        # include created_at so frontend can order by upload time
+        'created_at': r.get('created_at') or r.get('createdAt') or r.get('created at'),
+        'is_general_exam': r.get('is_general_exam', False),
+        'isGeneralExam': r.get('is_general_exam', False),
+        'startTime': formatted_start,
+        'start_time': formatted_start,
+        'attendance': 'attended' if int(r.get('attendance') or 0) == 1 else 'missed',
+        'homeworkStatus': 'completed' if (r.get('homework_status') in (0, None)) else 'pending',
+        'is_general_exam': is_general_exam,
+        'isGeneralExam': is_general_exam
+    }
+    
+    if has_exam_grade:
+        quiz_mark = int(r.get('quiz_mark') or 0)
+        admin_quiz_mark = r.get('admin_quiz_mark')
+        
+        session['quizCorrect'] = quiz_mark
+        
+        if admin_quiz_mark is not None:
+            session['adminQuizMark'] = int(admin_quiz_mark)
+            session['quizTotal'] = int(admin_quiz_mark)
+        else:
+            session['quizTotal'] = 15
+    
+    if has_payment:
+        session['payment'] = float(r.get('payment') or 0)
+    
+    if has_time:
+        session['endTime'] = r.get('finish_time') or ''
+
+    return session
+
+
 @app.route('/api/parent/sessions', methods=['GET'])
 def get_parent_sessions():
-    """Return session records for a parent with proper boolean handling"""
-    phone = request.args.get('phone_number')
-    student_name = request.args.get('student_name')  # ✅ ADD THIS LINE
-    
-    if not phone:
-        return jsonify({'error': 'phone_number query parameter required'}), 400
-    phone = normalize_phone(phone)
+    """Return session records for a parent with proper boolean handling
+    Query params: student_name, month (optional), limit and cursor (optional
+    pagination, newest upload first; see session_format.py)
+    """
+    phone, error = parent_phone_from_request()
+    if error:
+        return error
+    student_name = request.args.get('student_name')
 
     # Optional filters
     student_id = request.args.get('student_id')
@@ -1120,21 +1531,40 @@ def get_parent_sessions():
     logger.info(f"/api/parent/sessions called with phone={phone}, student_id={student_id}, month={month_param}, raw_args={dict(request.args)}")
 
     try:
-        query = supabase.table('session_records').select('*').eq('parent_no', phone)
-
-        # ✅ ADD THIS FILTER
-        if student_name:
-            query = query.eq('student_name', student_name)
         # Optional month filter
+        month_int = None
         if month_param:
             try:
                 month_int = int(month_param)
-                query = query.eq('month', month_int)
             except Exception:
                 pass
-            
-        result = query.execute()
-        records = result.data or []
+
+        # Optional keyset pagination
+        limit = request.args.get('limit')
+        cursor = request.args.get('cursor')
+        after = None
+        if limit is not None:
+            try:
+                limit = int(limit)
+            except ValueError:
+                return jsonify({'error': 'limit must be an integer'}), 400
+            if not 1 <= limit <= MAX_SESSIONS_PAGE:
+                return jsonify({'error': f'limit must be between 1 and {MAX_SESSIONS_PAGE}'}), 400
+        if cursor:
+            try:
+                after = session_format.decode_cursor(cursor)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+
+        # Ordered (and limited) by the database; one extra row tells whether there is a next page
+        records = guarded_read(
+            ('sessions', phone, student_name, month_int, limit, after),
+            lambda: db.session_records.page_for_parent(phone, student_name=student_name, month=month_int,
+                                                       limit=limit + 1 if limit else None, after=after))
+        next_cursor = None
+        if limit and len(records) > limit:
+            records = records[:limit]
+            next_cursor = session_format.encode_cursor(records[-1])
         if student_name:
             logger.info(f"Filtered sessions for parent {phone}, student {student_name}: {len(records)} sessions")
         else:
@@ -1149,94 +1579,118 @@ def get_parent_sessions():
             months = []
         logger.info(f"/api/parent/sessions result: {len(records)} records, months_present={months}")
 
-        sessions = []
-        for r in records:
-            has_exam_grade = r.get('has_exam_grade', True)
-            has_payment = r.get('has_payment', True)
-            has_time = r.get('has_time', True)
-            
-            # CRITICAL FIX: Properly handle is_general_exam boolean
-            is_general_exam_raw = r.get('is_general_exam')
-            is_general_exam = False
-            
-            # Handle all possible true values
-            if is_general_exam_raw is True:
-                is_general_exam = True
-            elif isinstance(is_general_exam_raw, str) and is_general_exam_raw.lower() == 'true':
-                is_general_exam = True
-            elif isinstance(is_general_exam_raw, int) and is_general_exam_raw == 1:
-                is_general_exam = True
-            
-            formatted_start = format_start_time_arabic(r.get('start_time'))
-
-            session = {
-                'id': r.get('id') or r.get('student_no') or r.get('student_id'),
-                'chapter': r.get('session_number'),
-                'name': r.get('lecture_name') or r.get('exam_name') or f"Session {r.get('session_number')}",
-                'lectureName': r.get('lecture_name') or r.get('exam_name'),
-                'date': r.get('finish_time') or '',
-                # include created_at so frontend can order by upload time
-                'created_at': r.get('created_at') or r.get('createdAt') or r.get('created at'),
-                'is_general_exam': r.get('is_general_exam', False),
-                'isGeneralExam': r.get('is_general_exam', False),
-                'startTime': formatted_start,
-                'start_time': formatted_start,
-                'attendance': 'attended' if int(r.get('attendance') or 0) == 1 else 'missed',
-                'homeworkStatus': 'completed' if (r.get('homework_status') in (0, None)) else 'pending',
-                'is_general_exam': is_general_exam,
-                'isGeneralExam': is_general_exam
-            }
-            
-            if has_exam_grade:
-                quiz_mark = int(r.get('quiz_mark') or 0)
-                admin_quiz_mark = r.get('admin_quiz_mark')
-                
-                session['quizCorrect'] = quiz_mark
-                
-                if admin_quiz_mark is not None:
-                    session['adminQuizMark'] = int(admin_quiz_mark)
-                    session['quizTotal'] = int(admin_quiz_mark)
-                else:
-                    session['quizTotal'] = 15
-            
-            if has_payment:
-                session['payment'] = float(r.get('payment') or 0)
-            
-            if has_time:
-                session['endTime'] = r.get('finish_time') or ''
-            
-            sessions.append(session)
-
-        # Prefer ordering by upload/creation time (newest first). If created_at
-        # is not present, fall back to ordering by chapter/session number.
-        sessions = sorted(
-            sessions,
-            key=lambda s: ((s.get('created_at') or ''), (s.get('chapter') or 0)),
-            reverse=True
-        )
-        return jsonify({'sessions': sessions}), 200
-        
+        # Compact v2 format on request (?v=2 or Accept header, see session_format.py)
+        version, layout = session_format.negotiate()
+        if version == 2:
+            body = session_format.build_v2(records, layout, format_start_time_arabic)
+            if limit:
+                body['nextCursor'] = next_cursor
+            response = jsonify(body)
+            if session_format.V2_MEDIA_TYPE in (request.headers.get('Accept') or ''):
+                response.mimetype = session_format.V2_MEDIA_TYPE
+            response.vary.add('Accept')
+            return response, 200
+
+        sessions = [session_v1(r) for r in records]
+
+        # Already ordered by upload time (newest first), then chapter, by the query
+        body = {'sessions': sessions}
+        if limit:
+            body['next_cursor'] = next_cursor
+            body['has_more'] = next_cursor is not None
+        return jsonify(body), 200
+
+    except ReadUnavailable as e:
+        return read_unavailable_response(e)
     except Exception as e:
         logger.exception(f"Error fetching sessions: {str(e)}")
         return jsonify({'error': f'Error fetching sessions: {str(e)}'}), 500
     
     
+@app.route('/api/parent/sessions/changes', methods=['GET'])
+def get_parent_session_changes():
+    """Sessions changed since the client's watermark, plus deleted session ids
+    Query params: since (watermark from the previous response, omit for a full
+    list), student_name (optional), v=2 for compact rows (see delta_sync.py)
+    """
+    phone, error = parent_phone_from_request()
+    if error:
+        return error
+    student_name = request.args.get('student_name')
+    try:
+        records, deleted, watermark, full = delta_sync.changes_for_parent(
+            db, phone, since=request.args.get('since'), student_name=student_name)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.exception(f"Error fetching session changes: {str(e)}")
+        return jsonify({'error': f'Error fetching session changes: {str(e)}'}), 500
+
+    version, _ = session_format.negotiate()
+    if version == 2:
+        body = session_format.build_v2(records, 'rows', format_start_time_arabic)
+    else:
+        body = {'sessions': [session_v1(r) for r in records]}
+    body.update({'deleted': deleted, 'watermark': watermark, 'full': full})
+    response = jsonify(body)
+    response.vary.add('Accept')
+    return response, 200
+
+
+@app.route('/api/parent/events', methods=['GET'])
+def get_parent_events():
+    """Server-Sent Events stream: `sessions` events when an upload wrote the parent's rows
+    Query params: access_token (or phone_number, as for the other parent endpoints).
+    Clients re-fetch (e.g. /api/parent/sessions/changes) on each event and when
+    the stream reconnects (see events.py)
+    """
+    if not event_broker.enabled:
+        return jsonify({'error': 'Live updates are disabled'}), 404
+    phone, error = parent_phone_from_request(allow_query_token=True)
+    if error:
+        return error
+    if not event_broker.has_capacity():
+        registry.counter('events.rejected').inc()
+        response = jsonify({'error': 'Too many live connections, please retry later'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(max(1, event_broker.retry_ms // 1000))
+        return response
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    sock = request.environ.get('gunicorn.socket')
+    if sock is not None:
+        opening = event_broker.opening()
+
+        def handoff():
+            yield opening
+            # gunicorn has written the headers and the opening frame; the
+            # event hub keeps the connection without holding this thread
+            event_broker.adopt(sock, phone, sent=len(opening))
+
+        headers['Content-Length'] = str(STREAM_LENGTH)
+        return Response(handoff(), mimetype='text/event-stream', headers=headers)
+
+    stream = event_broker.subscribe(phone)
+    if stream is None:
+        return jsonify({'error': 'Too many live connections, please retry later'}), 503
+    return Response(event_broker.stream_frames(stream), mimetype='text/event-stream', headers=headers)
+
+
 @app.route('/api/students', methods=['GET'])
 def get_all_students():
     """Return aggregated student list across all parents (for admin)"""
     try:
         # Allow optional month filtering for admin analytics
         month_param = request.args.get('month')
-        query = supabase.table('session_records').select('*')
+        month_int = None
         if month_param:
             try:
                 month_int = int(month_param)
-                query = query.eq('month', month_int)
             except Exception:
                 # ignore invalid month parameter and fetch all
                 pass
-        result = query.execute()
-        records = result.data or []
+        records = guarded_read(('all_students', month_int), lambda: db.session_records.all(month=month_int),
+                               budget=read_guard.admin_budget)
 
         students_map = {}
         for r in records:
@@ -1289,6 +1743,8 @@ def get_all_students():
             })
 
         return jsonify({'students': students}), 200
+    except ReadUnavailable as e:
+        return read_unavailable_response(e)
     except Exception as e:
         return jsonify({'error': f'Error fetching all students: {str(e)}', 'traceback': traceback.format_exc()}), 500
 
@@ -1312,9 +1768,9 @@ def login():
         
         # Normalize phone and find parent by phone number
         phone_number = normalize_phone(phone_number)
-        result = supabase.table('parents').select('*').eq('phone_number', phone_number).execute()
+        parent = db.parents.get_by_phone(phone_number)
         
-        if not result.data or len(result.data) == 0:
+        if not parent:
             # Parent doesn't exist, create a new one with default password
             logger.info(f"Creating new parent account for {phone_number}")
             try:
@@ -1322,11 +1778,11 @@ def login():
                     'phone_number': phone_number,
                     'password_hash': password,
                     'needs_password_reset': True,
-                    'name': f'Parent {phone_number}'
+                    'name': f'Parent {phone_number}',
+                    'last_login': datetime.now().isoformat()
                 }
-                create_result = supabase.table('parents').insert(parent_data).execute()
-                if create_result and create_result.data:
-                    parent = create_result.data[0]
+                parent = db.parents.insert(parent_data)
+                if parent:
                     logger.info(f"Parent account created for {phone_number}")
                 else:
                     return jsonify({'success': False, 'message': 'Failed to create parent account'}), 500
@@ -1334,19 +1790,22 @@ def login():
                 logger.exception(f"Error creating parent: {str(create_error)}")
                 return jsonify({'success': False, 'message': f'Error creating account: {str(create_error)}'}), 500
         else:
-            parent = result.data[0]
-            
             # Check password (in production, use proper password hashing)
             if parent['password_hash'] != password:
                 return jsonify({'success': False, 'message': 'Invalid phone number or password'}), 401
+
+            # Update last login (new accounts got it on insert); buffered unless LAST_LOGIN_WRITE_BEHIND=false
+            try:
+                login_time = datetime.now().replace(microsecond=0).isoformat()
+                if last_login_writes:
+                    last_login_writes.put(phone_number, login_time)
+                else:
+                    db.parents.update_by_phone(phone_number, {'last_login': login_time})
+            except:
+                pass  # Don't fail login if update fails
         
-        # Update last login
-        try:
-            supabase.table('parents').update({'last_login': datetime.now().isoformat()}).eq('phone_number', phone_number).execute()
-        except:
-            pass  # Don't fail login if update fails
-        
-        # Return user data
+        # Return user data with a signed session token for the parent endpoints
+        token, expires_in = auth_tokens.issue(ROLE_PARENT, parent['phone_number'], account_password(parent))
         return jsonify({
             'success': True,
             'user': {
@@ -1354,7 +1813,9 @@ def login():
                 'name': parent.get('name', ''),
                 'needs_password_reset': parent.get('needs_password_reset', True)
             },
-            'needs_password_reset': parent.get('needs_password_reset', True)
+            'needs_password_reset': parent.get('needs_password_reset', True),
+            'token': token,
+            'expires_in': expires_in
         }), 200
         
     except Exception as e:
@@ -1386,18 +1847,17 @@ def reset_password():
         phone_number = normalize_phone(phone_number)
 
         # Find parent
-        result = supabase.table('parents').select('*').eq('phone_number', phone_number).execute()
-        if not result.data or len(result.data) == 0:
+        if not db.parents.get_by_phone(phone_number):
             return jsonify({'success': False, 'message': 'Parent not found'}), 404
 
         try:
-            update_result = supabase.table('parents').update({
+            update_result = db.parents.update_by_phone(phone_number, {
                 'password_hash': new_password,
                 'needs_password_reset': False
-            }).eq('phone_number', phone_number).execute()
+            })
 
-            if update_result and update_result.data:
-                return jsonify({'success': True, 'message': 'Password updated successfully'}), 200
+            if update_result:
+                return password_changed_response(ROLE_PARENT, phone_number, new_password, 'Password updated successfully')
             else:
                 return jsonify({'success': False, 'message': 'Failed to update password'}), 500
         except Exception as e:
@@ -1431,13 +1891,11 @@ def change_password():
         
         # Normalize phone and find parent
         phone_number = normalize_phone(phone_number)
-        result = supabase.table('parents').select('*').eq('phone_number', phone_number).execute()
+        parent = db.parents.get_by_phone(phone_number)
         
-        if not result.data or len(result.data) == 0:
+        if not parent:
             return jsonify({'success': False, 'message': 'Parent not found'}), 404
         
-        parent = result.data[0]
-        
         # Check if password_hash column exists and has a value
         if 'password_hash' not in parent or not parent['password_hash']:
             # For new parents without password set, allow setting one without verification
@@ -1453,29 +1911,25 @@ def change_password():
         try:
             # First, try to update with password_hash column
             try:
-                update_result = supabase.table('parents').update({
+                update_result = db.parents.update_by_phone(phone_number, {
                     'password_hash': new_password
-                }).eq('phone_number', phone_number).execute()
+                })
                 
                 # Check if update actually worked by verifying the data was updated
-                if update_result and update_result.data:
-                    return jsonify({
-                        'success': True,
-                        'message': 'Password changed successfully'
-                    }), 200
+                if update_result:
+                    return password_changed_response(ROLE_PARENT, phone_number, new_password,
+                                                     'Password changed successfully')
             except Exception as hash_error:
                 # If password_hash fails, try password column instead
                 logger.warning(f"password_hash update failed, trying password column: {str(hash_error)}")
                 try:
-                    update_result = supabase.table('parents').update({
+                    update_result = db.parents.update_by_phone(phone_number, {
                         'password': new_password
-                    }).eq('phone_number', phone_number).execute()
+                    })
                     
-                    if update_result and update_result.data:
-                        return jsonify({
-                            'success': True,
-                            'message': 'Password changed successfully'
-                        }), 200
+                    if update_result:
+                        return password_changed_response(ROLE_PARENT, phone_number, new_password,
+                                                         'Password changed successfully')
                 except Exception as password_error:
                     logger.exception(f"password update failed: {str(password_error)}")
                     raise password_error
@@ -1495,10 +1949,10 @@ def change_password():
         return jsonify({'success': False, 'message': f'Error changing password: {str(e)}'}), 500
         
         # Update password (in production, hash the password)
-        supabase.table('parents').update({
+        db.parents.update_by_phone(phone_number, {
             'password_hash': new_password,
             'needs_password_reset': False
-        }).eq('phone_number', phone_number).execute()
+        })
         
         return jsonify({
             'success': True,
@@ -1520,40 +1974,35 @@ def admin_login():
         username = (data.get('username') or '').strip()
         password = (data.get('password') or '').strip()
 
-        print(f"📝 Received data: {data}")
         print(f"👤 Username: '{username}'")
-        print(f"🔑 Password: '{password}'")
 
         if not username or not password:
             print("❌ Missing username or password")
             return jsonify({'success': False, 'message': 'Username and password are required'}), 400
 
-        print(f"🔍 Querying Supabase for admin: {username}")
-        result = supabase.table('admins').select('*').eq('username', username).execute()
-        
-        print(f"📊 Query executed")
-        print(f"📊 Result type: {type(result)}")
-        print(f"📊 Result data: {result.data if hasattr(result, 'data') else 'NO DATA ATTRIBUTE'}")
+        # The admins row holds the password: log that it was found, never the row
+        admin = db.admins.get_by_username(username)
+        logger.debug("Admin lookup for %s on %s: %s", username, db.backend_name, 'found' if admin else 'not found')
         
-        if result.data and len(result.data) > 0:
-            admin = result.data[0]
-            print(f"✅ Admin found: {admin}")
+        if admin:
+            print("✅ Admin found")
             
             # Compare plain password with stored password_hash (both stored as plain text in DB)
             stored_password = admin.get('password_hash', '')
             if stored_password == password:
                 print("✅ Password match - Login successful!")
+                token, expires_in = auth_tokens.issue(ROLE_ADMIN, admin.get('username'), stored_password)
                 return jsonify({
                     'success': True,
                     'user': {
                         'username': admin.get('username'),
                         'name': admin.get('name', '')
-                    }
+                    },
+                    'token': token,
+                    'expires_in': expires_in
                 }), 200
             else:
-                print(f"❌ Password mismatch!")
-                print(f"   Stored: '{stored_password}'")
-                print(f"   Provided: '{password}'")
+                print("❌ Password mismatch!")
                 return jsonify({'success': False, 'message': 'Invalid username or password'}), 401
         else:
             print("❌ No admin found with that username")
@@ -1585,11 +2034,9 @@ def admin_change_password():
 
         # Find admin user
         try:
-            result = supabase.table('admins').select('*').eq('username', username).execute()
-            if not result.data or len(result.data) == 0:
+            admin = db.admins.get_by_username(username)
+            if not admin:
                 return jsonify({'success': False, 'message': 'Admin user not found'}), 404
-
-            admin = result.data[0]
             
             # Check if password_hash column exists and has a value
             if 'password_hash' not in admin or not admin['password_hash']:
@@ -1606,18 +2053,19 @@ def admin_change_password():
             try:
                 # First, try to update with password_hash column
                 try:
-                    update_result = supabase.table('admins').update({'password_hash': new_password}).eq('username', username).execute()
+                    update_result = db.admins.update_by_username(username, {'password_hash': new_password})
                     
-                    if update_result and update_result.data:
-                        return jsonify({'success': True, 'message': 'Password changed successfully'}), 200
+                    if update_result:
+                        return password_changed_response(ROLE_ADMIN, username, new_password, 'Password changed successfully')
                 except Exception as hash_error:
                     # If password_hash fails, try password column instead
                     logger.warning(f"Admin password_hash update failed, trying password column: {str(hash_error)}")
                     try:
-                        update_result = supabase.table('admins').update({'password': new_password}).eq('username', username).execute()
+                        update_result = db.admins.update_by_username(username, {'password': new_password})
                         
-                        if update_result and update_result.data:
-                            return jsonify({'success': True, 'message': 'Password changed successfully'}), 200
+                        if update_result:
+                            return password_changed_response(ROLE_ADMIN, username, new_password,
+                                                             'Password changed successfully')
                     except Exception as password_error:
                         logger.exception(f"Admin password update failed: {str(password_error)}")
                         raise password_error
@@ -1788,6 +2236,146 @@ def export_upload_errors():
         return jsonify({'error': f'Error reading log file: {str(e)}'}), 500
 
 
+def admin_access_error(key_matches=None):
+    """
+    None when the request carries an admin bearer token (/api/admin/login),
+    else an error response. key_matches() may accept another credential.
+    """
+    token = bearer_token(request.headers)
+    if token:
+        try:
+            claims = auth_tokens.verify(token)
+        except InvalidToken as e:
+            return jsonify({'error': str(e), 'token_expired': e.expired}), 401
+        if claims['role'] == ROLE_ADMIN:
+            return None
+    if key_matches is not None and key_matches():
+        return None
+    if token:
+        return jsonify({'error': 'Admin access required'}), 403
+    return jsonify({'error': 'Admin token required'}), 401
+
+
+@app.route('/api/admin/ingest-journal', methods=['GET'])
+def get_ingest_journal():
+    """Pending / failed upload batches waiting in the write journal (ingest_journal.py)."""
+    error = admin_access_error()
+    if error:
+        return error
+    try:
+        limit = int(request.args.get('limit', 20))
+    except:
+        limit = 20
+
+    try:
+        summary = ingest_journal.summary(upload_id=request.args.get('upload_id') or None, recent=limit)
+        summary.update(ingest_journal.settings())
+        return jsonify(summary), 200
+    except Exception as e:
+        logger.exception(f"Error reading ingest journal: {str(e)}")
+        return jsonify({'error': f'Error reading ingest journal: {str(e)}'}), 500
+
+
+@app.route('/api/admin/ingest-journal/retry', methods=['POST'])
+def retry_ingest_journal():
+    """Queue failed batches again: all of them, or {"batch_ids": [...]}."""
+    error = admin_access_error()
+    if error:
+        return error
+    data = request.get_json(silent=True) or {}
+    batch_ids = data.get('batch_ids')
+    if batch_ids is not None and not isinstance(batch_ids, list):
+        return jsonify({'error': 'batch_ids must be a list of batch ids'}), 400
+    try:
+        queued = ingest_journal.requeue(batch_ids)
+        return jsonify({'success': True, 'queued': queued}), 200
+    except (TypeError, ValueError):
+        return jsonify({'error': 'batch_ids must be a list of batch ids'}), 400
+    except Exception as e:
+        logger.exception(f"Error queueing journal batches: {str(e)}")
+        return jsonify({'error': f'Error queueing journal batches: {str(e)}'}), 500
+
+
+def profile_access_error():
+    """admin_access_error() that also lets PROFILE_ADMIN_KEY (X-Profile / ?profile=) through."""
+    return admin_access_error(key_matches=profiler.key_matches)
+
+
+@app.route('/api/admin/profiles', methods=['GET'])
+def list_request_profiles():
+    """List recently captured request profiles (newest first)."""
+    error = profile_access_error()
+    if error:
+        return error
+    try:
+        limit = int(request.args.get('limit', 50))
+    except:
+        limit = 50
+
+    try:
+        profiles = profiler.list_profiles(limit=limit)
+        return jsonify({
+            'profiles': profiles,
+            'count': len(profiles),
+            'enabled': profiler.enabled,
+            'threshold_ms': profiler.threshold_ms,
+            'sample_rate': profiler.sample_rate,
+            'engine': profiler.engine
+        }), 200
+    except Exception as e:
+        logger.exception(f"Error listing profiles: {str(e)}")
+        return jsonify({'error': f'Error listing profiles: {str(e)}', 'profiles': []}), 500
+
+
+@app.route('/api/admin/profiles/<profile_id>', methods=['GET'])
+def download_request_profile(profile_id):
+    """Download a captured profile. Use ?format=text for a readable pstats summary."""
+    error = profile_access_error()
+    if error:
+        return error
+    try:
+        found = profiler.get_profile(profile_id)
+        if not found:
+            return jsonify({'error': 'Profile not found'}), 404
+        meta, path = found
+
+        if request.args.get('format') == 'text' and meta.get('format') == 'pstats':
+            return profiler.render_text(path), 200, {'Content-Type': 'text/plain; charset=utf-8'}
+
+        mimetype = 'text/html' if meta.get('format') == 'html' else 'application/octet-stream'
+        return send_file(path, as_attachment=True, download_name=os.path.basename(path), mimetype=mimetype)
+    except Exception as e:
+        logger.exception(f"Error sending profile: {str(e)}")
+        return jsonify({'error': f'Error sending profile: {str(e)}'}), 500
+
+
+@app.route('/api/admin/metrics', methods=['GET'])
+def get_metrics():
+    """Per-worker counters and timers (database pool usage, etc.)."""
+    error = admin_access_error()
+    if error:
+        return error
+    try:
+        snapshot = registry.snapshot()
+        snapshot['data_backend'] = db.backend_name if db else None
+        snapshot['rate_limit'] = limiter.settings()
+        snapshot['json_encoder'] = app.json.engine
+        snapshot['ingest'] = ingest.settings()
+        snapshot['events'] = event_broker.settings()
+        snapshot['upload_plans'] = upload_plans.settings()
+        snapshot['resumable_uploads'] = resumable_uploads.settings()
+        snapshot['ingest_journal'] = ingest_journal.settings()
+        snapshot['write_scheduler'] = write_scheduler.settings()
+        snapshot['async_writer'] = async_writer.settings()
+        snapshot['read_guard'] = read_guard.settings()
+        if db and db.backend_name == 'supabase':
+            snapshot['db_pool'] = pool_stats(db.backend.client)
+        return jsonify(snapshot), 200
+    except Exception as e:
+        logger.exception(f"Error reading metrics: {str(e)}")
+        return jsonify({'error': f'Error reading metrics: {str(e)}'}), 500
+
+
 @app.route('/api/upload-log/download', methods=['GET'])
 def download_upload_log():
     """Serve the uploads.log file as a downloadable attachment."""
@@ -0,0 +1,205 @@
+"""
+Concurrent row writes for uploads over an async HTTP client (WRITE_ENGINE=async).
+
+The writes of one upload are independent across students, but each one is a
+PostgREST round trip, so sending them one after another spends most of an
+upload waiting on the network. AsyncSessionWriter sends the row-level
+operations of update_database as coroutines on an httpx.AsyncClient; what to
+send for each row (the retry without admin_quiz_mark, the update after a
+duplicate insert, the log lines) is decided by row_writes.py, as for
+app.write_planned_row. Only the transport is here:
+
+  - at most ASYNC_WRITE_CONCURRENCY requests are in flight (an
+    asyncio.Semaphore; default 16), over as many keep-alive connections
+  - writes with the same key (parent_no, student_name) run one after another
+    in their original order; different students run concurrently
+  - nothing is retried here: transient failures go back to the caller, which
+    leaves them to the journal (ingest_journal.py)
+
+run() is called from sync code (the Flask handler or the ingestion process).
+The coroutines run on one event loop thread per process, started on first
+use, with one client per PostgREST URL; the calling thread waits for the
+results and gets on_result() calls on its own thread, like
+write_scheduler.WriteScheduler.run().
+
+Only used with the Supabase backend. Requests time out after
+SUPABASE_TIMEOUT_SECONDS (http_pool.PoolConfig). Metrics: `async_writer.*`.
+"""
+import asyncio
+import os
+import queue
+import threading
+import time
+
+import httpx
+
+from http_pool import PoolConfig
+from identity_index import INSERT
+from metrics import registry
+from repository import DuplicateKeyError, RepositoryError
+from row_writes import UPDATE_WHERE, run_row_write_async
+
+_DONE = object()
+
+
+def _error_from_response(response):
+    """RepositoryError for a failed PostgREST response, like SupabaseBackend._wrap_error."""
+    try:
+        body = response.json()
+    except ValueError:
+        body = None
+    if not isinstance(body, dict):
+        # Proxy error pages: the HTTP status is the code (see repository.is_transient_error)
+        return RepositoryError(response.text[:200] or response.reason_phrase, str(response.status_code))
+    code = body.get('code') or str(response.status_code)
+    message = body.get('message') or response.reason_phrase
+    if code == '23505' or 'duplicate key' in str(message).lower():
+        return DuplicateKeyError(message, '23505', body.get('details'))
+    return RepositoryError(message, code, body.get('details'))
+
+
+class AsyncSessionWriter:
+    """session_records writes sent concurrently from one event loop thread per process."""
+
+    table = 'session_records'
+
+    def __init__(self, enabled=False, concurrency=16, timeout=None):
+        self.enabled = enabled
+        self.concurrency = max(1, int(concurrency))
+        self.timeout = timeout or PoolConfig.from_env().timeout
+        self._loop = None
+        self._loop_pid = None
+        self._clients = {}
+        self._start_lock = threading.Lock()
+        self._local = threading.local()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            enabled=(os.getenv('WRITE_ENGINE') or 'scheduler').strip().lower() == 'async',
+            concurrency=int(os.getenv('ASYNC_WRITE_CONCURRENCY', '16')),
+        )
+
+    def settings(self):
+        return {
+            'enabled': self.enabled,
+            'concurrency': self.concurrency,
+            'loop_running': self._loop is not None and self._loop_pid == os.getpid(),
+        }
+
+    @property
+    def last_run(self):
+        """Rows, time and rate of the last run() on this thread (the shape of WriteScheduler.last_run)."""
+        return getattr(self._local, 'last_run', None)
+
+    # ------------------------------------------------------------------
+    # Event loop
+    # ------------------------------------------------------------------
+    def _event_loop(self):
+        # One loop thread per process; started again after fork
+        if self._loop is not None and self._loop_pid == os.getpid():
+            return self._loop
+        with self._start_lock:
+            if self._loop is None or self._loop_pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='async-writer', daemon=True).start()
+                self._clients = {}
+                self._loop, self._loop_pid = loop, os.getpid()
+        return self._loop
+
+    def _client(self, base_url, headers):
+        # Only called on the loop thread
+        client = self._clients.get(base_url)
+        if client is None:
+            limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+            client = self._clients[base_url] = httpx.AsyncClient(
+                base_url=base_url, headers=dict(headers, Prefer='return=minimal'),
+                timeout=httpx.Timeout(self.timeout), limits=limits)
+        return client
+
+    # ------------------------------------------------------------------
+    # Requests
+    # ------------------------------------------------------------------
+    async def _request(self, client, semaphore, method, params=None, payload=None):
+        async with semaphore:
+            in_flight = registry.gauge('async_writer.in_flight')
+            in_flight.inc()
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, self.table, params=params, json=payload)
+            finally:
+                in_flight.dec()
+                registry.timer('async_writer.request').observe(time.perf_counter() - started)
+        if response.status_code >= 400:
+            raise _error_from_response(response)
+
+    async def _write(self, client, semaphore, write):
+        """One planned write; returns None or the exception (rules in row_writes.py)."""
+        async def transport(request):
+            if request[0] == UPDATE_WHERE:
+                _, payload, where = request
+                params = {column: f'eq.{value}' for column, value in where.items()}
+                await self._request(client, semaphore, 'PATCH', params=params, payload=payload)
+            elif write.action == INSERT:
+                await self._request(client, semaphore, 'POST', payload=request[1])
+            else:
+                await self._request(client, semaphore, 'PATCH', params={'id': f'eq.{write.target_id}'},
+                                    payload=request[1])
+
+        return await run_row_write_async(write, transport)
+
+    async def _run(self, writes, groups, base_url, headers, results):
+        client = self._client(base_url, headers)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def chain(indexes):
+            # One student's writes, in order
+            for index in indexes:
+                results.put((index, await self._write(client, semaphore, writes[index])))
+
+        try:
+            await asyncio.gather(*(chain(indexes) for indexes in groups))
+        finally:
+            results.put(_DONE)
+
+    # ------------------------------------------------------------------
+    # Sync entry point
+    # ------------------------------------------------------------------
+    def run(self, writes, base_url, headers, key=None, on_result=None):
+        """
+        Send planned writes (identity_index.PlannedWrite) to the PostgREST API at
+        `base_url`; returns None or the exception for each write, in order.
+        Writes with the same key(write) are sent one after another.
+        """
+        writes = list(writes)
+        groups = {}
+        for index, write in enumerate(writes):
+            groups.setdefault(key(write) if key else index, []).append(index)
+
+        errors = [None] * len(writes)
+        results = queue.Queue()
+        started = time.monotonic()
+        future = asyncio.run_coroutine_threadsafe(
+            self._run(writes, list(groups.values()), base_url, headers, results), self._event_loop())
+        written = 0
+        while True:
+            item = results.get()
+            if item is _DONE:
+                break
+            index, error = item
+            errors[index] = error
+            if error is None:
+                written += 1
+            if on_result is not None:
+                on_result(index, error)
+        # Re-raises what went wrong outside the per-write handling
+        future.result()
+
+        registry.counter('async_writer.rows').inc(written)
+        took = time.monotonic() - started
+        self._local.last_run = {
+            'rows': len(writes), 'throttled': 0, 'retries': 0, 'seconds': round(took, 3),
+            'rows_per_second': round(len(writes) / took, 1) if took > 0 else 0.0,
+            'concurrency': self.concurrency, 'batch_size': 1,
+        }
+        return errors
@@ -0,0 +1,6 @@
+"""
+Benchmarks and load-test tooling for the Flask backend.
+
+Run from the backend directory, e.g.:
+    python -m benchmarks.run --sizes 100,1000,10000
+"""
@@ -0,0 +1,62 @@
+"""
+Upload parsing per file format: the same synthetic sheet written as xlsx,
+UTF-8 CSV, cp1256 CSV (semicolon separated, as Arabic Windows Excel saves it)
+and, when pyarrow or fastparquet is installed, Parquet, read with
+read_sheet() alone and through the full sheet parser.
+
+Before timing, the parsed records of every format are compared with the
+xlsx ones on the fields that identify a row (id, name, normalized parent_no).
+"""
+import os
+import tempfile
+
+from benchmarks import common  # noqa: F401  (selects the memory backend)
+from benchmarks.synthetic import (general_exam_rows, normal_lecture_rows, write_csv, write_parquet,
+                                  write_workbook)
+from normalization import normalize_phone
+from sheet_formats import parquet_available, read_sheet
+
+LAYOUTS = {
+    'normal': (normal_lecture_rows, 'parse_normal_lecture_sheet'),
+    'general': (general_exam_rows, 'parse_general_exam_sheet'),
+}
+
+FORMATS = {
+    'xlsx': ('xlsx', write_workbook),
+    'csv': ('csv', write_csv),
+    'csv-cp1256': ('csv', lambda rows, path: write_csv(rows, path, encoding='cp1256', sep=';')),
+    'parquet': ('parquet', write_parquet),
+}
+
+
+def _identity(records):
+    return [(r['id'], r['name'], normalize_phone(r['parent_no'])) for r in records]
+
+
+def run(sizes, iterations=3, layouts=('normal', 'general')):
+    import app
+
+    formats = [name for name in FORMATS if name != 'parquet' or parquet_available()]
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for layout in layouts:
+            make_rows, parser_name = LAYOUTS[layout]
+            parser = getattr(app, parser_name)
+            for size in sizes:
+                rows = make_rows(size)
+                expected = None
+                for name in formats:
+                    ext, write = FORMATS[name]
+                    path = write(rows, os.path.join(tmp, f'{layout}-{size}-{name}.{ext}'))
+
+                    records = parser(path)
+                    if expected is None:
+                        expected = _identity(records)
+                    elif _identity(records) != expected:
+                        raise AssertionError(f'{parser_name} on {name} differs from xlsx ({size} rows)')
+
+                    samples = common.time_calls(lambda: read_sheet(path), iterations)
+                    results.append(common.summarize(f'read_sheet[{layout},{name},{size}]', samples, size))
+                    samples = common.time_calls(lambda: parser(path), iterations)
+                    results.append(common.summarize(f'{parser_name}[{name},{size}]', samples, size))
+    return results
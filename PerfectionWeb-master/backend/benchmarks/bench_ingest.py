@@ -0,0 +1,50 @@
+"""
+Upload ingestion benchmarks: sheet parsing and update_database against the
+local in-memory backend.
+"""
+import os
+import tempfile
+
+from benchmarks import common  # noqa: F401  (selects the memory backend)
+from benchmarks.synthetic import general_exam_rows, normal_lecture_rows, write_workbook
+from repository import Repositories, SQLiteBackend
+
+LAYOUTS = {
+    'normal': (normal_lecture_rows, 'parse_normal_lecture_sheet', False),
+    'general': (general_exam_rows, 'parse_general_exam_sheet', True),
+}
+
+
+def run(sizes, iterations=3, layouts=('normal', 'general')):
+    import app
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for layout in layouts:
+            make_rows, parser_name, is_general_exam = LAYOUTS[layout]
+            parser = getattr(app, parser_name)
+            for size in sizes:
+                path = write_workbook(make_rows(size), os.path.join(tmp, f'{layout}-{size}.xlsx'))
+
+                samples = common.time_calls(lambda: parser(path), iterations)
+                results.append(common.summarize(f'{parser_name}[{size}]', samples, size))
+
+                records = parser(path)
+
+                def fresh_db():
+                    app.db = Repositories(SQLiteBackend(':memory:'))
+
+                def upload():
+                    app.update_database(records, 1, 15 if is_general_exam else None, '2025-01-15 10:00:00',
+                                        'cam1', is_general_exam, lecture_name='Lecture 1' if not is_general_exam else '',
+                                        exam_name='Exam 1' if is_general_exam else '')
+
+                samples = common.time_calls(upload, iterations, setup=fresh_db)
+                results.append(common.summarize(f'update_database[{layout},{size},fresh]', samples, len(records)))
+
+                # Re-uploading the same sheet exercises the duplicate-key update path
+                fresh_db()
+                upload()
+                samples = common.time_calls(upload, iterations, warmup=0)
+                results.append(common.summarize(f'update_database[{layout},{size},reupload]', samples, len(records)))
+    return results
@@ -0,0 +1,65 @@
+"""
+JSON encoding and response compression benchmarks.
+
+Encodes the /api/students and /api/parent/sessions payloads with the stdlib
+provider and FastJSONProvider (orjson when installed), then measures the
+end-to-end request with and without Accept-Encoding: gzip, reporting bytes on
+the wire.
+"""
+import random
+
+from benchmarks import common  # noqa: F401  (selects the memory backend)
+from benchmarks.synthetic import parent_headers, seed_session_records
+from repository import Repositories, SQLiteBackend
+
+
+def run(parents=200, students_per_parent=40, iterations=50, seed=9):
+    import app
+    import compression
+    from flask.json.provider import DefaultJSONProvider
+    from json_provider import FastJSONProvider
+
+    app.db = Repositories(SQLiteBackend(':memory:'))
+    phones = seed_session_records(app.db, parents=parents, students_per_parent=3)
+    heavy = seed_session_records(app.db, parents=5, students_per_parent=students_per_parent, seed=seed)
+    client = app.app.test_client()
+    rng = random.Random(seed)
+
+    payloads = {
+        '/api/students': client.get('/api/students').get_json(),
+        '/api/parent/sessions': client.get('/api/parent/sessions', headers=parent_headers(heavy[0])).get_json(),
+    }
+
+    results = []
+    stdlib = DefaultJSONProvider(app.app)
+    fast = FastJSONProvider(app.app)
+    for path, payload in payloads.items():
+        with app.app.app_context():
+            for label, provider in (('stdlib', stdlib), (fast.engine, fast)):
+                body = provider.response(payload).get_data()
+                samples = common.time_calls(lambda: provider.response(payload), iterations)
+                results.append(common.summarize(f'encode {path} [{label}]', samples, 1, 'responses',
+                                                extra={'bytes': len(body)}))
+
+    # Headers of the caller: none for the admin list, a parent token for the parent endpoint
+    tokens = {phone: parent_headers(phone) for phone in heavy}
+    callers = {
+        '/api/students': lambda: {},
+        '/api/parent/sessions': lambda: tokens[rng.choice(heavy)],
+    }
+    encodings = [('identity', {}), ('gzip', {'Accept-Encoding': 'gzip'})]
+    if compression.brotli is not None:
+        encodings.append(('br', {'Accept-Encoding': 'br, gzip'}))
+    for path, caller in callers.items():
+        for label, headers in encodings:
+            sizes = []
+
+            def call():
+                resp = client.get(path, headers={**caller(), **headers})
+                assert resp.status_code == 200, resp.status_code
+                sizes.append(len(resp.data))
+
+            samples = common.time_calls(call, max(5, iterations // 5))
+            results.append(common.summarize(f'GET {path} [{label}]', samples, 1, 'req',
+                                            extra={'bytes': sum(sizes) // len(sizes)}))
+    return results
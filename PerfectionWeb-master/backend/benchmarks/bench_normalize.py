@@ -0,0 +1,88 @@
+"""
+Name and phone normalization: the per-value functions against the Series
+kernels in normalization.py.
+
+Before timing, both are run on randomly generated values built from the
+pieces that make normalization tricky (Arabic letters with harakat and
+tatweel, presentation forms, Latin accents and compatibility characters,
+every kind of whitespace, Arabic-Indic and superscript digits, country code
+prefixes, separators, None and empty cells) and the run fails listing the
+values where the two disagree. `--seed` changes the generated values.
+"""
+import random
+
+from benchmarks import common  # noqa: F401  (selects the memory backend)
+from benchmarks.synthetic import make_name, make_phone
+from normalization import normalize_name, normalize_name_series, normalize_phone, normalize_phone_series
+
+NAME_PIECES = [
+    'أحمد', 'مُحَمَّد', 'عبد الرحمن', 'فاطمة', 'مـريـم', 'إبراهيم', 'آية', 'ﻣﺤﻤﺪ', 'ﷺ', 'ﹰ',
+    'Ahmed', 'ÉLODIE', 'José', 'ﬁras', 'Ⅻ', 'ℌassan', 'Straße', 'İbrahim', 'Ǆ', '½', 'ΟΔΥΣΣΕΥΣ', 'Σ',
+    'ً', 'ّ', '́', '̈', 'ـ', '‏', '‍',
+]
+SPACES = [' ', '  ', '\t', '\n', ' ', ' ', '　', ' ', '\x1c', ' ', '']
+PHONE_PIECES = [
+    '0', '1', '2', '5', '9', '00', '20', '+20', '0020', '01', '010', '٠', '١', '٢', '٩',
+    '۱', '²', '๑', '-', ' ', '(', ')', '.', 'x', 'ext', '‎',
+]
+
+
+def random_name(rng):
+    roll = rng.random()
+    if roll < 0.05:
+        return rng.choice([None, '', 0, 0.0, float('nan'), 12345, '   '])
+    if roll < 0.35:
+        return make_name(rng)
+    parts = [rng.choice(SPACES)]
+    for _ in range(rng.randint(1, 6)):
+        parts.append(rng.choice(NAME_PIECES))
+        parts.append(rng.choice(SPACES))
+    return ''.join(parts)
+
+
+def random_phone(rng):
+    roll = rng.random()
+    if roll < 0.05:
+        return rng.choice([None, ''])
+    if roll < 0.45:
+        return str(make_phone(rng))
+    return ''.join(rng.choice(PHONE_PIECES) for _ in range(rng.randint(1, 18)))
+
+
+def check_equivalence(values, scalar, kernel):
+    """Raise AssertionError listing the first values where kernel and scalar differ."""
+    expected = [scalar(v) for v in values]
+    actual = list(kernel(values))
+    mismatches = [(v, e, a) for v, e, a in zip(values, expected, actual) if e != a]
+    if mismatches:
+        shown = '\n'.join(f'  {v!r}: scalar {e!r}, series {a!r}' for v, e, a in mismatches[:10])
+        raise AssertionError(f'{kernel.__name__} differs from {scalar.__name__} on {len(mismatches)} '
+                             f'of {len(values)} values:\n{shown}')
+    return len(values)
+
+
+def run(sizes=(1000, 10000, 100000), iterations=3, seed=42, checks=50000):
+    import pandas as pd
+
+    rng = random.Random(seed)
+    check_equivalence([random_name(rng) for _ in range(checks)], normalize_name, normalize_name_series)
+    check_equivalence([random_phone(rng) for _ in range(checks)], normalize_phone, normalize_phone_series)
+    # A cell containing the kernels' separator takes the per-value path
+    check_equivalence(['ΣΑ\x00ΣΑ ', ' أحمد '], normalize_name, normalize_name_series)
+    check_equivalence(['+20\x00101', '01012345678'], normalize_phone, normalize_phone_series)
+    check_equivalence([], normalize_name, normalize_name_series)
+    # Build the Unicode tables outside the timed calls
+    normalize_name_series(['x'])
+    normalize_phone_series(['1'])
+
+    results = []
+    for size in sizes:
+        names = pd.Series([make_name(rng) for _ in range(size)], dtype=object)
+        phones = pd.Series([str(make_phone(rng)) for _ in range(size)], dtype=object)
+        for label, scalar, kernel, column in (('name', normalize_name, normalize_name_series, names),
+                                              ('phone', normalize_phone, normalize_phone_series, phones)):
+            samples = common.time_calls(lambda: [scalar(v) for v in column], iterations)
+            results.append(common.summarize(f'normalize_{label}[scalar,{size}]', samples, size, 'values'))
+            samples = common.time_calls(lambda: kernel(column), iterations)
+            results.append(common.summarize(f'normalize_{label}[series,{size}]', samples, size, 'values'))
+    return results
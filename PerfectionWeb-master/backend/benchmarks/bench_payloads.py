@@ -0,0 +1,51 @@
+"""
+Response size and latency of /api/parent/sessions in the v1 format and the
+compact v2 format (rows and columns layouts), and of a first page of 20, for
+parents with hundreds of sessions (many siblings x 8 sessions each).
+"""
+import gzip
+import random
+
+from benchmarks import common  # noqa: F401  (selects the memory backend)
+from benchmarks.synthetic import parent_headers, seed_session_records
+from repository import Repositories, SQLiteBackend
+
+FORMATS = [
+    ('v1', ''),
+    ('v2 rows', '?v=2'),
+    ('v2 cols', '?v=2&layout=columns'),
+    # First page only, as a lazily scrolling dashboard loads it
+    ('v1 limit=20', '?limit=20'),
+    ('v2 rows limit=20', '?v=2&limit=20'),
+]
+
+
+def run(parents=20, students_per_parent=40, iterations=50, seed=5):
+    import app
+
+    app.db = Repositories(SQLiteBackend(':memory:'))
+    phones = seed_session_records(app.db, parents=parents, students_per_parent=students_per_parent)
+    client = app.app.test_client()
+    rng = random.Random(seed)
+    # Largest families first so the comparison covers the long histories
+    phones.sort(key=lambda p: len(app.db.session_records.for_parent(p, 'id')), reverse=True)
+    heavy = phones[:max(1, len(phones) // 4)]
+    sessions = sum(len(app.db.session_records.for_parent(p, 'id')) for p in heavy) // len(heavy)
+    headers = {phone: parent_headers(phone) for phone in heavy}
+
+    results = []
+    for label, query in FORMATS:
+        sizes, gz_sizes = [], []
+        parents = iter([headers[rng.choice(heavy)] for _ in range(iterations + 1)])
+
+        def call():
+            resp = client.get(f'/api/parent/sessions{query}', headers=next(parents))
+            assert resp.status_code == 200, resp.status_code
+            sizes.append(len(resp.data))
+            gz_sizes.append(len(gzip.compress(resp.data)))
+
+        samples = common.time_calls(call, iterations)
+        results.append(common.summarize(
+            f'GET /api/parent/sessions {label}[~{sessions} sessions]', samples, 1, 'req',
+            extra={'bytes': sum(sizes) // len(sizes), 'gzip_bytes': sum(gz_sizes) // len(gz_sizes)}))
+    return results
@@ -0,0 +1,99 @@
+"""
+Connection reuse check for the pooled database transport.
+
+Runs concurrent selects through SupabaseBackend against the local mock
+PostgREST server in three modes and reports how many TCP connections the
+server accepted:
+
+  - no-keepalive: every call opens a new connection (Connection: close)
+  - default:      supabase-py's own httpx client
+  - pooled:       http_pool.install_pooled_session (SUPABASE_POOL_SIZE)
+
+The pooled mode must never open more connections than the pool size; the
+script exits with status 1 otherwise.
+
+    python -m benchmarks.bench_pool --threads 8 --calls 200 --pool-size 4 --latency-ms 5
+"""
+import argparse
+import sys
+import threading
+import time
+
+from benchmarks import common
+from benchmarks.mock_postgrest import MOCK_KEY, MockPostgrest
+
+
+def run_mode(mode, args):
+    from supabase import create_client
+
+    from http_pool import PoolConfig, install_pooled_session
+    from metrics import registry
+    from repository import SupabaseBackend
+
+    server = MockPostgrest(latency_ms=args.latency_ms).start()
+    server.insert('parents', [{'phone_number': f'010{i:08d}', 'password_hash': 'x'} for i in range(50)])
+    try:
+        client = create_client(server.url, MOCK_KEY)
+        if mode == 'pooled':
+            install_pooled_session(client, PoolConfig(pool_size=args.pool_size, timeout=10))
+        elif mode == 'no-keepalive':
+            client.postgrest.session.headers['Connection'] = 'close'
+        backend = SupabaseBackend(client)
+
+        samples, lock = [], threading.Lock()
+
+        def worker(n):
+            local = []
+            for i in range(args.calls):
+                start = time.perf_counter()
+                backend.select('parents', '*', [('phone_number', 'eq', f'010{(n + i) % 50:08d}')])
+                local.append(time.perf_counter() - start)
+            with lock:
+                samples.extend(local)
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(args.threads)]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall = time.perf_counter() - started
+
+        result = common.summarize(f'select[{mode},{args.threads} threads]', samples, 1, 'req')
+        result['throughput'] = round(len(samples) / wall, 2)
+        result['connections'] = server.connections
+        if mode == 'pooled':
+            snap = registry.snapshot()['metrics']
+            result['pool'] = {k: v for k, v in snap.items() if k.startswith('db_pool.')}
+        return result
+    finally:
+        server.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--calls', type=int, default=200, help='calls per thread')
+    parser.add_argument('--pool-size', type=int, default=4)
+    parser.add_argument('--latency-ms', type=float, default=5.0)
+    parser.add_argument('--output', help='result JSON path')
+    args = parser.parse_args(argv)
+
+    results = [run_mode(mode, args) for mode in ('no-keepalive', 'default', 'pooled')]
+    common.print_results(results)
+    for r in results:
+        print(f"{r['name']:<48} connections accepted: {r['connections']}")
+    pooled = results[-1]
+    print(f"\npool metrics: {pooled['pool']}")
+    path = common.write_results('pool', results, args.output, params=vars(args))
+    print(f'Results written to {path}')
+
+    if pooled['connections'] > args.pool_size:
+        print(f"FAIL: pooled mode opened {pooled['connections']} connections (pool size {args.pool_size})")
+        return 1
+    print(f"OK: {args.threads * args.calls} pooled calls reused {pooled['connections']} connection(s)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,63 @@
+"""
+Read-path benchmarks: parent login and the parent and admin GET endpoints
+through the Flask test client against a seeded in-memory backend.
+"""
+import random
+
+from benchmarks import common  # noqa: F401  (selects the memory backend)
+from benchmarks.synthetic import PARENT_PASSWORD, parent_headers, seed_session_records
+from repository import Repositories, SQLiteBackend
+
+PARENT_ENDPOINTS = [
+    '/api/parent/sessions',
+    '/api/parent/students',
+    '/api/parent/sessions/months',
+]
+ADMIN_ENDPOINTS = [
+    '/api/students',
+    '/api/students?month=3',
+]
+
+
+def run(parents=200, iterations=200, admin_iterations=20, seed=11):
+    import app
+
+    app.db = Repositories(SQLiteBackend(':memory:'))
+    # Every test-client login comes from one address; measure the handlers, not the per-IP limit
+    app.limiter.enabled = False
+    phones = seed_session_records(app.db, parents=parents)
+    client = app.app.test_client()
+    rng = random.Random(seed)
+
+    results = []
+    logins = iter([rng.choice(phones) for _ in range(iterations + 1)])
+
+    def login():
+        resp = client.post('/api/auth/login', json={'phone_number': next(logins), 'password': PARENT_PASSWORD})
+        assert resp.status_code == 200, resp.status_code
+
+    samples = common.time_calls(login, iterations)
+    results.append(common.summarize(f'POST /api/auth/login[{parents} parents]', samples, 1, 'req'))
+    if app.last_login_writes:
+        app.last_login_writes.flush()
+
+    # Each parent reads with its own token, as the dashboard does
+    headers = {phone: parent_headers(phone) for phone in phones}
+    for path in PARENT_ENDPOINTS:
+        it = iter([headers[rng.choice(phones)] for _ in range(iterations + 1)])
+
+        def call():
+            resp = client.get(path, headers=next(it))
+            assert resp.status_code == 200, resp.status_code
+
+        samples = common.time_calls(call, iterations)
+        results.append(common.summarize(f"GET {path}[{parents} parents]", samples, 1, 'req'))
+
+    for url in ADMIN_ENDPOINTS:
+        def call_admin():
+            resp = client.get(url)
+            assert resp.status_code == 200, resp.status_code
+
+        samples = common.time_calls(call_admin, admin_iterations)
+        results.append(common.summarize(f'GET {url}[{parents} parents]', samples, 1, 'req'))
+    return results
@@ -0,0 +1,162 @@
+"""
+Worker startup benchmarks.
+
+  - import: time to `import app` in a fresh interpreter, with pandas/openpyxl
+    imported eagerly (before) and lazily (after), plus the one-off cost the
+    first upload now pays for importing them.
+  - gunicorn: time from launch until the first /api/health answer and until
+    every worker has answered, and the total memory (PSS) of master and
+    workers, for: eager imports without preload (before), lazy imports without
+    preload, and --preload.
+
+    python -m benchmarks.run --suite startup
+"""
+import http.client
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import common
+from benchmarks.loadtest import free_port
+from tokens import ROLE_ADMIN, TokenService
+
+# The servers sign tokens with this key, so the harness can read /api/admin/metrics
+AUTH_SECRET = 'bench-startup'
+
+IMPORT_CASES = [
+    ('import app [eager pandas, before]', 'import pandas, openpyxl; import app'),
+    ('import app [lazy pandas, after]', 'import app'),
+    ('first upload: import pandas+openpyxl', 'import app; import pandas, openpyxl'),
+]
+
+GUNICORN_CASES = [
+    ('gunicorn [eager, no preload, before]', 'benchmarks.eager_app:app', 'false'),
+    ('gunicorn [lazy, no preload]', 'app:app', 'false'),
+    ('gunicorn [lazy, preload]', 'app:app', 'true'),
+]
+
+
+def _env(tmp):
+    return dict(os.environ, DATA_BACKEND='memory', RATE_LIMIT_STATE_DIR=os.path.join(tmp, 'ratelimit'),
+                AUTH_SECRET_KEY=AUTH_SECRET, PYTHONDONTWRITEBYTECODE='1')
+
+
+def time_import(snippet, env, repeats):
+    """Median seconds for `snippet` in fresh interpreters, minus the interpreter's own start."""
+    code = f"import time; t = time.perf_counter(); {snippet}; print(time.perf_counter() - t)"
+    if snippet.startswith('import app; '):
+        # Only time what comes after the app import
+        rest = snippet[len('import app; '):]
+        code = f"import app, time; t = time.perf_counter(); {rest}; print(time.perf_counter() - t)"
+    samples = []
+    for _ in range(repeats):
+        out = subprocess.run([sys.executable, '-c', code], cwd=common.BACKEND_DIR, env=env,
+                             capture_output=True, text=True, check=True).stdout
+        samples.append(float(out.strip().splitlines()[-1]))
+    return samples
+
+
+def _children(pid):
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        return []
+
+
+def _pss_kb(pid):
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def _worker_pid(port, token):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+    try:
+        conn.request('GET', '/api/admin/metrics',
+                     headers={'Connection': 'close', 'Authorization': f'Bearer {token}'})
+        resp = conn.getresponse()
+        body = resp.read()
+        if resp.status == 200:
+            import json
+            return json.loads(body).get('pid')
+    finally:
+        conn.close()
+    return None
+
+
+def time_gunicorn(target, preload, workers, threads, env, timeout=120):
+    port = free_port()
+    env = dict(env, GUNICORN_PRELOAD=preload)
+    cmd = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', target,
+           '--bind', f'127.0.0.1:{port}', '--workers', str(workers), '--threads', str(threads),
+           '--log-level', 'warning']
+    token, _ = TokenService(AUTH_SECRET).issue(ROLE_ADMIN, 'bench')
+    started = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=common.BACKEND_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    first = all_up = None
+    seen = set()
+    try:
+        deadline = started + timeout
+        while time.perf_counter() < deadline and all_up is None:
+            try:
+                pid = _worker_pid(port, token)
+            except OSError:
+                time.sleep(0.01)
+                continue
+            now = time.perf_counter() - started
+            if first is None:
+                first = now
+            if pid:
+                seen.add(pid)
+            if len(seen) >= workers:
+                all_up = now
+        time.sleep(0.5)
+        pss = _pss_kb(proc.pid) + sum(_pss_kb(p) for p in _children(proc.pid))
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+    if first is None:
+        raise RuntimeError(f'gunicorn ({target}) did not answer within {timeout}s')
+    return first, all_up, pss
+
+
+def run(repeats=5, workers=4, threads=2):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        env = _env(tmp)
+        for name, snippet in IMPORT_CASES:
+            samples = time_import(snippet, env, repeats)
+            results.append(common.summarize(name, samples, 1, 'imports'))
+
+        for name, target, preload in GUNICORN_CASES:
+            firsts, alls, pss = [], [], []
+            for _ in range(max(1, repeats // 2)):
+                first, all_up, mem = time_gunicorn(target, preload, workers, threads, env)
+                firsts.append(first)
+                if all_up is not None:
+                    alls.append(all_up)
+                pss.append(mem)
+            results.append(common.summarize(f'{name} first response', firsts, 1, 'starts', extra={
+                'all_workers_ms': round(statistics.median(alls) * 1000, 1) if alls else None,
+                'pss_mb': round(statistics.median(pss) / 1024, 1),
+                'workers': workers,
+            }))
+    return results
+
+
+def print_details(results):
+    rows = [r for r in results if 'pss_mb' in r]
+    if rows:
+        print(f"\n{'gunicorn startup':<48} {'first ms':>10} {'all workers ms':>15} {'PSS MB':>8}")
+        for r in rows:
+            print(f"{r['name']:<48} {r['p50_ms']:>10.0f} {r['all_workers_ms'] or 0:>15.0f} {r['pss_mb']:>8.1f}")
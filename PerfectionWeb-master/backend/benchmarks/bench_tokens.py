@@ -0,0 +1,34 @@
+"""
+Session token micro-benchmarks: issuing and verifying tokens in-process,
+next to the `parents` lookup an auth check would otherwise cost per request
+(in-memory SQLite here, so a lower bound for a Supabase round trip).
+"""
+from benchmarks import common  # noqa: F401  (selects the memory backend)
+from benchmarks.synthetic import seed_session_records
+from repository import Repositories, SQLiteBackend
+from tokens import ROLE_PARENT, TokenService
+
+
+def run(iterations=20000, parents=200):
+    service = TokenService('benchmark-secret')
+    repos = Repositories(SQLiteBackend(':memory:'))
+    phones = seed_session_records(repos, parents=parents, sessions_per_student=1)
+    tokens = [service.issue(ROLE_PARENT, phone)[0] for phone in phones]
+
+    results = []
+    state = {'i': 0}
+
+    def next_index():
+        state['i'] = (state['i'] + 1) % len(phones)
+        return state['i']
+
+    samples = common.time_calls(lambda: service.issue(ROLE_PARENT, phones[next_index()]), iterations)
+    results.append(common.summarize('token issue', samples, 1, 'tokens'))
+
+    samples = common.time_calls(lambda: service.verify(tokens[next_index()], ROLE_PARENT), iterations)
+    results.append(common.summarize('token verify', samples, 1, 'tokens'))
+
+    lookups = max(1, iterations // 10)
+    samples = common.time_calls(lambda: repos.parents.get_by_phone(phones[next_index()]), lookups)
+    results.append(common.summarize(f'parents lookup[{parents} parents, sqlite memory]', samples, 1, 'lookups'))
+    return results
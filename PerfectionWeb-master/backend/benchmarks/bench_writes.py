@@ -0,0 +1,151 @@
+"""
+Upload writes through the adaptive write scheduler against a throttling database.
+
+Runs update_database through SupabaseBackend against the local mock PostgREST
+server, which adds latency per request, per row and (--load-latency-ms) per
+other request in flight, and answers 429 beyond
+--server-concurrency requests in flight (plus --throttle-rate at random), in
+four modes:
+
+  - sequential: WRITE_SCHEDULER_ENABLED=false, one row at a time; this is the
+                reference table, so its server doesn't add random 429s
+  - fixed:      --fixed-concurrency batches of --fixed-batch rows, no adaptation
+  - adaptive:   the AIMD scheduler with the WRITE_* settings from the environment
+  - async:      WRITE_ENGINE=async, --async-concurrency row writes in flight on
+                an httpx.AsyncClient (async_writer.py); pass --server-concurrency
+                at least as large to compare it to sequential without throttling
+
+Each mode uploads the sheet to an empty table (inserts) and again (updates)
+and reports rows/s, 429s, rows left to the journal and the concurrency and
+batch size it ended with. The script exits with status 1 if the adaptive mode
+reported errors, left rows to the journal or stored a different table than
+the sequential mode, or the async mode stored a different table.
+
+    python -m benchmarks.bench_writes --rows 2000 --latency-ms 10 --server-concurrency 4
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks import common
+from benchmarks.mock_postgrest import MOCK_KEY, MockPostgrest
+from benchmarks.synthetic import normal_lecture_rows, write_workbook
+
+
+def stored_rows(server):
+    return sorted((r['parent_no'], r['student_name'], r['session_number'], r.get('attendance'), r.get('quiz_mark'))
+                  for r in server.tables.get('session_records', []))
+
+
+def run_mode(mode, records, args):
+    from supabase import create_client
+
+    import app
+    from http_pool import PoolConfig, install_pooled_session
+    from repository import Repositories, SupabaseBackend
+    from async_writer import AsyncSessionWriter
+    from write_scheduler import WriteScheduler
+
+    if mode == 'sequential':
+        scheduler = WriteScheduler(enabled=False)
+    elif mode == 'fixed':
+        scheduler = WriteScheduler(min_concurrency=args.fixed_concurrency, max_concurrency=args.fixed_concurrency,
+                                   initial_concurrency=args.fixed_concurrency, min_batch=args.fixed_batch,
+                                   max_batch=args.fixed_batch, initial_batch=args.fixed_batch)
+    else:
+        scheduler = WriteScheduler.from_env()
+    app.write_scheduler = scheduler
+    app.async_writer = AsyncSessionWriter(enabled=mode == 'async', concurrency=args.async_concurrency)
+
+    server = MockPostgrest(latency_ms=args.latency_ms, jitter_ms=args.latency_ms / 4, row_latency_ms=args.row_latency_ms,
+                           load_latency_ms=args.load_latency_ms,
+                           throttle_rate=0.0 if mode == 'sequential' else args.throttle_rate,
+                           max_concurrency=args.server_concurrency).start()
+    try:
+        client = create_client(server.url, MOCK_KEY)
+        install_pooled_session(client, PoolConfig(pool_size=16, timeout=30))
+        app.db = Repositories(SupabaseBackend(client))
+
+        results = []
+        for phase in ('fresh', 'reupload'):
+            throttled_before = server.throttled
+            upload_id = f'bench-{mode}-{phase}-{time.time()}'
+            started = time.perf_counter()
+            updated_count, errors = app.update_database(records, 1, None, '2025-01-15 10:00:00', 'cam1', False,
+                                                        lecture_name=f'Lecture {phase}', upload_id=upload_id)
+            took = time.perf_counter() - started
+            stats = app.write_engine().last_run
+            result = common.summarize(f'update_database[{mode},{phase},{len(records)}]', [took], len(records))
+            result.update({
+                'written': updated_count,
+                'errors': len(errors),
+                'queued': app.ingest_journal.pending_rows(upload_id),
+                'throttled': server.throttled - throttled_before,
+                'max_in_flight': server.max_in_flight,
+                'concurrency': stats['concurrency'],
+                'batch_size': stats['batch_size'],
+            })
+            results.append(result)
+        return results, stored_rows(server)
+    finally:
+        server.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--latency-ms', type=float, default=10.0, help='server latency per request')
+    parser.add_argument('--row-latency-ms', type=float, default=0.5, help='server latency per row written')
+    parser.add_argument('--load-latency-ms', type=float, default=0.0,
+                        help='server latency per other request in flight (a database slowing down under load)')
+    parser.add_argument('--server-concurrency', type=int, default=4,
+                        help='requests in flight the server takes before answering 429')
+    parser.add_argument('--throttle-rate', type=float, default=0.01, help='fraction of requests answered 429 anyway')
+    parser.add_argument('--fixed-concurrency', type=int, default=8)
+    parser.add_argument('--fixed-batch', type=int, default=100)
+    parser.add_argument('--async-concurrency', type=int, default=16)
+    parser.add_argument('--modes', default='sequential,fixed,adaptive,async', help='comma separated modes to run')
+    parser.add_argument('--output', help='result JSON path')
+    args = parser.parse_args(argv)
+
+    # Rows the scheduler gives up on go to a throwaway journal
+    os.environ.setdefault('INGEST_JOURNAL_DIR', tempfile.mkdtemp(prefix='bench-journal-'))
+    import logging
+
+    import app
+    app.logger.setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        records = app.parse_normal_lecture_sheet(write_workbook(normal_lecture_rows(args.rows),
+                                                                os.path.join(tmp, 'writes.xlsx')))
+
+    results, tables = [], {}
+    modes = [m.strip() for m in args.modes.split(',') if m.strip()]
+    for mode in ['sequential'] + [m for m in modes if m != 'sequential']:
+        mode_results, tables[mode] = run_mode(mode, records, args)
+        results += mode_results
+
+    common.print_results(results)
+    for r in results:
+        print(f"{r['name']:<48} written {r['written']}, errors {r['errors']}, queued {r['queued']}, "
+              f"429s {r['throttled']}, ended at {r['concurrency']} x {r['batch_size']} rows")
+    path = common.write_results('writes', results, args.output, params=vars(args))
+    print(f'Results written to {path}')
+
+    adaptive = [r for r in results if r['name'].startswith('update_database[adaptive,')]
+    if any(r['errors'] or r['queued'] for r in adaptive):
+        print('FAIL: the adaptive scheduler reported errors or left rows to the journal')
+        return 1
+    for mode in ('adaptive', 'async'):
+        if mode in tables and tables[mode] != tables['sequential']:
+            print(f'FAIL: {mode} writes stored different rows than sequential writes')
+            return 1
+    checked = [m for m in ('adaptive', 'async') if m in tables]
+    print(f"OK: {' and '.join(checked)} writes stored the same {len(tables['sequential'])} rows as sequential writes")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
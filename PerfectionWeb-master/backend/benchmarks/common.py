@@ -0,0 +1,133 @@
+"""
+Shared helpers for benchmarks: timing, percentiles, JSON result files and
+comparison between runs.
+
+Importing this module points the app at an in-memory data backend before
+app.py is imported, so benchmarks never touch a live Supabase project.
+"""
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(BACKEND_DIR, 'benchmarks', 'results')
+
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+os.environ.setdefault('DATA_BACKEND', 'memory')
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def summarize(name, samples_s, items_per_sample=1, unit='rows', extra=None):
+    """Build a result dict from per-iteration durations in seconds."""
+    total = sum(samples_s)
+    result = {
+        'name': name,
+        'iterations': len(samples_s),
+        'p50_ms': round(percentile(samples_s, 50) * 1000, 3),
+        'p99_ms': round(percentile(samples_s, 99) * 1000, 3),
+        'mean_ms': round(statistics.mean(samples_s) * 1000, 3) if samples_s else 0.0,
+        'throughput': round((items_per_sample * len(samples_s)) / total, 2) if total > 0 else 0.0,
+        'throughput_unit': f'{unit}/s',
+    }
+    if extra:
+        result.update(extra)
+    return result
+
+
+def time_calls(fn, iterations, warmup=1, setup=None):
+    """Call fn() `iterations` times and return the list of durations in seconds.
+
+    `setup`, when given, runs before every call and is not timed.
+    """
+    for _ in range(warmup):
+        if setup:
+            setup()
+        fn()
+    samples = []
+    for _ in range(iterations):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return 'unknown'
+
+
+def write_results(suite, results, output=None, params=None):
+    """Write results to JSON and return the file path."""
+    revision = git_revision()
+    payload = {
+        'suite': suite,
+        'revision': revision,
+        'created_at': datetime.utcnow().isoformat() + 'Z',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': params or {},
+        'results': results,
+    }
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+        output = os.path.join(RESULTS_DIR, f'{suite}-{stamp}-{revision}.json')
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, indent=2, ensure_ascii=False)
+    return output
+
+
+def print_results(results):
+    print(f"{'benchmark':<48} {'p50 ms':>10} {'p99 ms':>10} {'throughput':>16}")
+    for r in results:
+        print(f"{r['name']:<48} {r['p50_ms']:>10.2f} {r['p99_ms']:>10.2f} "
+              f"{r['throughput']:>10.1f} {r['throughput_unit']}")
+    sized = [r for r in results if 'bytes' in r]
+    if sized:
+        print(f"\n{'payload':<48} {'bytes':>10} {'gzip bytes':>12}")
+        for r in sized:
+            print(f"{r['name']:<48} {r['bytes']:>10} {r.get('gzip_bytes', ''):>12}")
+
+
+def compare_results(baseline_path, results, threshold=0.10):
+    """Print p50/throughput deltas against a previous JSON result file.
+
+    Returns the number of benchmarks whose p50 regressed by more than threshold.
+    """
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {r['name']: r for r in json.load(f)['results']}
+
+    regressions = 0
+    print(f"\nComparison with {os.path.basename(baseline_path)} (regression threshold {threshold:.0%})")
+    print(f"{'benchmark':<48} {'p50 before':>11} {'p50 after':>11} {'change':>9}")
+    for r in results:
+        before = baseline.get(r['name'])
+        if not before or not before.get('p50_ms'):
+            print(f"{r['name']:<48} {'-':>11} {r['p50_ms']:>11.2f} {'new':>9}")
+            continue
+        change = (r['p50_ms'] - before['p50_ms']) / before['p50_ms']
+        flag = ''
+        if change > threshold:
+            regressions += 1
+            flag = '  REGRESSION'
+        print(f"{r['name']:<48} {before['p50_ms']:>11.2f} {r['p50_ms']:>11.2f} {change:>+8.1%}{flag}")
+    return regressions
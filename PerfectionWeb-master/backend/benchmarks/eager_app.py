@@ -0,0 +1,9 @@
+"""
+WSGI entry point that imports pandas/openpyxl before the app, reproducing the
+startup cost app.py had before those imports were made lazy. Used by
+bench_startup as the "before" case.
+"""
+import openpyxl  # noqa: F401
+import pandas  # noqa: F401
+
+from app import app  # noqa: F401
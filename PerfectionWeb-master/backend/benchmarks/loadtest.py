@@ -0,0 +1,385 @@
+"""
+Exam-night load test: parents log in and open their dashboards while admins
+upload sheets.
+
+Each virtual parent arrives during the ramp window, logs in with
+POST /api/auth/login and then loads the dashboard (/api/parent/students,
+/api/parent/sessions, /api/parent/sessions/months) `--visits` times with an
+exponentially distributed think time between visits. Admin threads upload
+synthetic workbooks to /api/upload-excel at the same time.
+
+By default the harness seeds a local SQLite database and launches gunicorn
+with the worker/thread settings under test, so Dockerfile/app.yaml settings
+can be compared on equal terms:
+
+    python -m benchmarks.loadtest --parents 300 --workers 4 --threads 2 --uploads 2
+    python -m benchmarks.loadtest --parents 300 --workers 2 --threads 8 --uploads 2
+
+Compare "GET parent reads (all)" with --uploads 0, and with uploads running
+in the ingestion pool (--ingest-mode process) or on the request threads
+(--ingest-mode inline), to see what concurrent uploads cost parents.
+
+The launched server trusts one proxy hop of X-Forwarded-For, like the deploy
+configs, so each virtual parent's address gets its own login bucket. 429s are
+reported in their own column and the run fails (status 1) when any login was
+rejected: a rate-limited run measures the limiter, not the dashboard.
+
+Use --url to target a server that is already running (it must use a data
+backend seeded by `--seed-only --db <path>`), or --server werkzeug where
+gunicorn is unavailable (e.g. Windows).
+"""
+import argparse
+import http.client
+import io
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from urllib.parse import quote, urlsplit
+
+from benchmarks import common
+from benchmarks.synthetic import PARENT_PASSWORD, normal_lecture_rows, seed_session_records, write_workbook
+
+
+class Recorder:
+    """Thread-safe per-endpoint latency, error and rate-limit recorder."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.rejected = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def record(self, endpoint, seconds, status):
+        with self._lock:
+            self.samples[endpoint].append(seconds)
+            self.statuses[endpoint][status] += 1
+            if status == 0 or status >= 500:
+                self.errors[endpoint] += 1
+            elif status == 429:
+                self.rejected[endpoint] += 1
+
+    def results(self, wall_seconds):
+        results = []
+        groups = {endpoint: self.samples[endpoint] for endpoint in sorted(self.samples)}
+        # All dashboard reads together: the number that must stay flat while uploads run
+        reads = [e for e in groups if e.startswith('GET /api/parent/')]
+        if reads:
+            groups['GET parent reads (all)'] = [s for e in reads for s in self.samples[e]]
+        for endpoint, samples in groups.items():
+            r = common.summarize(endpoint, samples, 1, 'req')
+            # Throughput over the whole run, not per-request service time
+            r['throughput'] = round(len(samples) / wall_seconds, 2) if wall_seconds else 0.0
+            r['p90_ms'] = round(common.percentile(samples, 90) * 1000, 3)
+            r['max_ms'] = round(max(samples) * 1000, 3)
+            names = reads if endpoint == 'GET parent reads (all)' else [endpoint]
+            r['errors'] = sum(self.errors[e] for e in names)
+            r['rejected'] = sum(self.rejected[e] for e in names)
+            statuses = defaultdict(int)
+            for e in names:
+                for k, v in self.statuses[e].items():
+                    statuses[k] += v
+            r['statuses'] = {str(k): v for k, v in statuses.items()}
+            results.append(r)
+        return results
+
+
+class Client:
+    """Keep-alive HTTP client, one per virtual user."""
+
+    def __init__(self, base_url, recorder, timeout=60, headers=None):
+        parts = urlsplit(base_url)
+        self.headers = dict(headers or {})
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.recorder = recorder
+        self.timeout = timeout
+        self.conn = None
+
+    def _connection(self):
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return self.conn
+
+    def request(self, endpoint, method, path, body=None, headers=None):
+        start = time.perf_counter()
+        status = 0
+        data = b''
+        # Like a browser, retry once on a fresh connection when the server
+        # closed an idle keep-alive connection (gunicorn keepalive is 2s)
+        for attempt in range(2):
+            reused = self.conn is not None
+            try:
+                conn = self._connection()
+                conn.request(method, path, body=body, headers=dict(self.headers, **(headers or {})))
+                resp = conn.getresponse()
+                data = resp.read()
+                status = resp.status
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self.close()
+                if not reused:
+                    break
+            except (OSError, http.client.HTTPException):
+                self.close()
+                break
+        self.recorder.record(endpoint, time.perf_counter() - start, status)
+        return status, data
+
+    def get_json(self, endpoint, path):
+        status, data = self.request(endpoint, 'GET', path)
+        try:
+            return status, json.loads(data or b'{}')
+        except ValueError:
+            return status, {}
+
+    def post_json(self, endpoint, path, payload):
+        body = json.dumps(payload).encode('utf-8')
+        status, data = self.request(endpoint, 'POST', path, body, {'Content-Type': 'application/json'})
+        try:
+            return status, json.loads(data or b'{}')
+        except ValueError:
+            return status, {}
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def multipart(fields, file_field, filename, content):
+    boundary = uuid.uuid4().hex
+    buf = io.BytesIO()
+    for name, value in fields.items():
+        buf.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    buf.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+              f'Content-Type: application/vnd.openxmlformats-officedocument.spreadsheetml.sheet\r\n\r\n'.encode())
+    buf.write(content)
+    buf.write(f'\r\n--{boundary}--\r\n'.encode())
+    return buf.getvalue(), f'multipart/form-data; boundary={boundary}'
+
+
+def parent_user(base_url, recorder, phone, args, rng, stop):
+    # Each parent comes from its own address so the per-IP login limit sees real traffic
+    ip = f'10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}'
+    client = Client(base_url, recorder, headers={'X-Forwarded-For': ip})
+    try:
+        status, login = client.post_json('POST /api/auth/login', '/api/auth/login',
+                                         {'phone_number': phone, 'password': PARENT_PASSWORD})
+        if status != 200:
+            return
+        # The token decides whose data is read
+        client.headers['Authorization'] = f"Bearer {login['token']}"
+        for visit in range(args.visits):
+            if stop.is_set():
+                return
+            status, students = client.get_json('GET /api/parent/students', '/api/parent/students')
+            client.get_json('GET /api/parent/sessions/months', '/api/parent/sessions/months')
+            for student in (students.get('students') or [])[:3]:
+                name = quote(student.get('name') or '')
+                client.get_json('GET /api/parent/sessions',
+                                f'/api/parent/sessions?student_name={name}')
+            if visit + 1 < args.visits and args.think_time > 0:
+                time.sleep(rng.expovariate(1.0 / args.think_time))
+    finally:
+        client.close()
+
+
+def admin_uploader(base_url, recorder, workbook, args, index, stop):
+    client = Client(base_url, recorder, timeout=600)
+    try:
+        for n in range(args.upload_repeats):
+            if stop.is_set():
+                return
+            body, content_type = multipart({
+                'session_number': str((index + n) % 8 + 1),
+                'group': 'cam1',
+                'finish_time': '2025-01-15 10:00:00',
+                'is_general_exam': 'false',
+                'lecture_name': f'Load test lecture {index}',
+            }, 'file', f'loadtest-{index}.xlsx', workbook)
+            client.request('POST /api/upload-excel', 'POST', '/api/upload-excel', body, {'Content-Type': content_type})
+    finally:
+        client.close()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_healthy(base_url, timeout=60):
+    parts = urlsplit(base_url)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=2)
+            conn.request('GET', '/api/health')
+            if conn.getresponse().status == 200:
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def seed_database(path, parents):
+    from repository import Repositories, SQLiteBackend
+    if os.path.exists(path):
+        os.remove(path)
+    repos = Repositories(SQLiteBackend(path))
+    return seed_session_records(repos, parents=parents)
+
+
+def seeded_phones(path):
+    from repository import Repositories, SQLiteBackend
+    return [r['phone_number'] for r in Repositories(SQLiteBackend(path)).parents.select('phone_number')]
+
+
+def start_server(args, db_path):
+    port = free_port()
+    # The parents' X-Forwarded-For is the one hop a proxy would append, as in app.yaml / the Dockerfile
+    env = dict(os.environ, DATA_BACKEND='sqlite', SQLITE_PATH=db_path,
+               RATE_LIMIT_STATE_DIR=os.path.join(os.path.dirname(db_path), 'ratelimit'),
+               RATE_LIMIT_TRUST_FORWARDED='true', RATE_LIMIT_PROXY_HOPS='1',
+               PORT=str(port), WEB_CONCURRENCY=str(args.workers), GUNICORN_THREADS=str(args.threads))
+    if args.ingest_mode:
+        env['INGEST_MODE'] = args.ingest_mode
+    base_url = f'http://127.0.0.1:{port}'
+    if args.server == 'gunicorn':
+        # The deploy settings (preload, post_worker_init warm-up), listening on loopback only
+        cmd = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app',
+               '--bind', f'127.0.0.1:{port}', '--log-level', 'warning']
+    else:
+        cmd = [sys.executable, '-c',
+               'import app; from werkzeug.serving import run_simple; '
+               f'run_simple("127.0.0.1", {port}, app.app, threaded=True)']
+    proc = subprocess.Popen(cmd, cwd=common.BACKEND_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if not wait_healthy(base_url):
+        proc.terminate()
+        raise RuntimeError(f'{args.server} did not become healthy on {base_url}')
+    return proc, base_url
+
+
+def run(args):
+    tmp = tempfile.mkdtemp(prefix='loadtest-')
+    db_path = args.db or os.path.join(tmp, 'loadtest.sqlite3')
+    proc = None
+
+    if args.seed_only:
+        phones = seed_database(db_path, args.parents)
+        print(f'Seeded {len(phones)} parents into {db_path}')
+        return []
+
+    if args.url:
+        if not args.db:
+            raise SystemExit('--url needs --db pointing at the database the server uses (seeded with --seed-only)')
+        base_url = args.url.rstrip('/')
+        phones = seeded_phones(db_path)
+    else:
+        phones = seed_database(db_path, args.parents)
+        proc, base_url = start_server(args, db_path)
+
+    workbook_path = write_workbook(normal_lecture_rows(args.upload_rows, seed=99), os.path.join(tmp, 'upload.xlsx'))
+    with open(workbook_path, 'rb') as f:
+        workbook = f.read()
+
+    recorder = Recorder()
+    stop = threading.Event()
+    rng = random.Random(args.seed)
+    threads = []
+    try:
+        for i in range(args.uploads):
+            t = threading.Thread(target=admin_uploader, args=(base_url, recorder, workbook, args, i, stop), daemon=True)
+            threads.append(t)
+
+        # Parents arrive uniformly over the ramp window (exam results just published)
+        parent_phones = [rng.choice(phones) for _ in range(args.parents)]
+        arrivals = sorted(rng.uniform(0, args.ramp) for _ in parent_phones)
+        semaphore = threading.BoundedSemaphore(args.concurrency)
+
+        def bounded_parent(phone, user_rng):
+            with semaphore:
+                parent_user(base_url, recorder, phone, args, user_rng, stop)
+
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for phone, at in zip(parent_phones, arrivals):
+            delay = at - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+            t = threading.Thread(target=bounded_parent, args=(phone, random.Random(rng.random())), daemon=True)
+            t.start()
+            threads.append(t)
+
+        deadline = started + args.duration if args.duration else None
+        for t in threads:
+            remaining = None if deadline is None else max(0.0, deadline - time.perf_counter())
+            t.join(remaining)
+        stop.set()
+        wall = time.perf_counter() - started
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=30)
+
+    results = recorder.results(wall)
+    for r in results:
+        r['wall_seconds'] = round(wall, 2)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--parents', type=int, default=200, help='number of parents logging in')
+    parser.add_argument('--ramp', type=float, default=10.0, help='seconds over which parents arrive')
+    parser.add_argument('--visits', type=int, default=2, help='dashboard loads per parent after login')
+    parser.add_argument('--think-time', type=float, default=1.0, help='mean seconds between dashboard loads')
+    parser.add_argument('--concurrency', type=int, default=1000, help='max simultaneously active parents')
+    parser.add_argument('--uploads', type=int, default=1, help='concurrent admin uploaders')
+    parser.add_argument('--upload-rows', type=int, default=500, help='rows per uploaded sheet')
+    parser.add_argument('--upload-repeats', type=int, default=1, help='uploads per admin uploader')
+    parser.add_argument('--duration', type=float, default=0, help='hard stop after N seconds (0 = run to completion)')
+    parser.add_argument('--ingest-mode', choices=['process', 'inline'],
+                        help='INGEST_MODE for the launched server (default: the app default, process)')
+    parser.add_argument('--server', choices=['gunicorn', 'werkzeug'], default='gunicorn')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers (Dockerfile: 4)')
+    parser.add_argument('--threads', type=int, default=2, help='gunicorn threads per worker (Dockerfile: 2)')
+    parser.add_argument('--url', help='target an already running server instead of launching one')
+    parser.add_argument('--db', help='SQLite database path to seed (default: temporary file)')
+    parser.add_argument('--seed-only', action='store_true', help='seed --db and exit')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='result JSON path')
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    if not results:
+        return 0
+    print(f"{'endpoint':<36} {'count':>7} {'err':>5} {'429':>5} {'req/s':>8} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for r in results:
+        print(f"{r['name']:<36} {r['iterations']:>7} {r['errors']:>5} {r['rejected']:>5} {r['throughput']:>8.1f} "
+              f"{r['p50_ms']:>9.1f} {r['p90_ms']:>9.1f} {r['p99_ms']:>9.1f} {r['max_ms']:>9.1f}")
+    params = {k: v for k, v in vars(args).items() if k not in ('output',)}
+    path = common.write_results('loadtest', results, args.output, params=params)
+    print(f'\nResults written to {path}')
+
+    logins = [r for r in results if r['name'] == 'POST /api/auth/login']
+    if logins and logins[0]['rejected']:
+        print(f"FAIL: {logins[0]['rejected']} of {logins[0]['iterations']} logins were rate limited (429); "
+              f"those parents never loaded a dashboard")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
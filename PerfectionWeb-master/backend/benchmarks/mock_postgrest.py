@@ -0,0 +1,338 @@
+"""
+Local stand-in for Supabase's PostgREST endpoint.
+
+Serves /rest/v1/<table> with in-memory rows and enough of the PostgREST
+protocol for supabase-py: GET (select with `col=eq.value` filters, `limit`),
+POST (insert, 23505 on duplicate unique keys), PATCH (update) and DELETE,
+plus POST /rest/v1/rpc/parent_session_months.
+
+Latency and throttling can be injected to exercise connection pooling,
+backpressure and concurrent writers:
+
+    server = MockPostgrest(latency_ms=20, throttle_rate=0.05).start()
+    ...
+    server.stop()
+
+`row_latency_ms` adds time per row inserted or updated, so a bulk insert
+costs more than a single row; `load_latency_ms` adds time per other request
+in flight, like a database slowing down under load; `max_concurrency` answers
+429 to requests beyond that many in flight, like a connection-capped database.
+
+`server.connections` counts accepted TCP connections, which shows whether
+clients reuse keep-alive connections.
+"""
+import json
+import random
+import socket
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+# supabase-py only accepts JWT-shaped keys; the mock server ignores it
+MOCK_KEY = 'eyJhbGciOiJub25lIn0.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.mock'
+
+UNIQUE_KEYS = {
+    'session_records': ('student_name', 'session_number', 'parent_no'),
+    'parents': ('phone_number',),
+    'admins': ('username',),
+    'lectures': ('unique_key',),
+}
+
+
+def _coerce(value):
+    if value in ('true', 'false'):
+        return value == 'true'
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            return float(value)
+        except ValueError:
+            return value
+
+
+def _now():
+    # Millisecond ISO timestamps, like the triggers in the real schema
+    t = time.time()
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(t)) + f'.{int(t * 1000) % 1000:03d}+00:00'
+
+
+def _split_top(text):
+    parts, depth, quoted, current = [], 0, False, ''
+    for ch in text:
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == '(':
+            depth += 1
+        elif not quoted and ch == ')':
+            depth -= 1
+        elif not quoted and ch == ',' and depth == 0:
+            parts.append(current)
+            current = ''
+            continue
+        current += ch
+    parts.append(current)
+    return parts
+
+
+def _parse_logic(value):
+    """`(a.lt.1,and(a.eq.1,b.lt.2))` -> [('a', 'lt', '1'), ('and', [...])]"""
+    terms = []
+    for part in _split_top(value[1:-1]):
+        if part.startswith('and('):
+            terms.append(('and', _parse_logic(part[3:])))
+            continue
+        col, _, rest = part.partition('.')
+        op, _, raw = rest.partition('.')
+        if raw.startswith('"') and raw.endswith('"'):
+            raw = raw[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+        terms.append((col, op, raw))
+    return terms
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        # Headers and body are written separately; without NODELAY keep-alive
+        # connections stall on delayed ACKs
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.mock._on_connection()
+
+    def log_message(self, *args):
+        pass
+
+    # -- helpers --------------------------------------------------------
+    def _send(self, status, payload=None, headers=None):
+        body = json.dumps(payload if payload is not None else []).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _parse(self):
+        parts = urlsplit(self.path)
+        segments = parts.path.rstrip('/').split('/')
+        table = segments[-1]
+        filters, limit = [], None
+        self.order = []
+        for key, value in parse_qsl(parts.query, keep_blank_values=True):
+            if key == 'select':
+                continue
+            if key == 'order':
+                for part in value.split(','):
+                    col, _, direction = part.partition('.')
+                    self.order.append((col, direction.startswith('desc')))
+                continue
+            if key == 'limit':
+                limit = int(value)
+                continue
+            if key == 'or':
+                filters.append((None, 'or', _parse_logic(value)))
+                continue
+            op, _, raw = value.partition('.')
+            filters.append((key, op, raw))
+        return table, filters, limit
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'null') if length else None
+
+    def _gate(self, rows=0):
+        """Apply injected latency/throttling; return False if the request was rejected."""
+        mock = self.server.mock
+        with mock._lock:
+            mock.in_flight += 1
+            others = mock.in_flight - 1
+            mock.max_in_flight = max(mock.max_in_flight, mock.in_flight)
+            overloaded = mock.max_concurrency and mock.in_flight > mock.max_concurrency
+        try:
+            if overloaded or (mock.throttle_rate and mock._rng.random() < mock.throttle_rate):
+                mock.throttled += 1
+                self._send(429, {'message': 'Too many requests', 'code': '429'}, {'Retry-After': '1'})
+                return False
+            if mock.error_rate and mock._rng.random() < mock.error_rate:
+                mock.errors += 1
+                self._send(503, {'message': 'Service unavailable', 'code': '503'})
+                return False
+            if mock.latency_ms or mock.row_latency_ms or mock.load_latency_ms:
+                jitter = mock._rng.uniform(-mock.jitter_ms, mock.jitter_ms) if mock.jitter_ms else 0
+                latency = mock.latency_ms + rows * mock.row_latency_ms + others * mock.load_latency_ms + jitter
+                time.sleep(max(0.0, latency) / 1000.0)
+            return True
+        finally:
+            with mock._lock:
+                mock.in_flight -= 1
+
+    # -- verbs ----------------------------------------------------------
+    def do_GET(self):
+        self._body()  # postgrest-py sends `{}` with GETs; drain it to keep the connection usable
+        if not self._gate():
+            return
+        table, filters, limit = self._parse()
+        rows = self.server.mock.select(table, filters)
+        for col, desc in reversed(self.order):
+            rows.sort(key=lambda r: (r.get(col) is None, r.get(col)), reverse=desc)
+        self._send(200, rows[:limit] if limit is not None else rows)
+
+    def do_POST(self):
+        body = self._body()
+        if not self._gate(len(body) if isinstance(body, list) else 1):
+            return
+        table, _, _ = self._parse()
+        if '/rpc/' in self.path:
+            self._rpc(table, body or {})
+            return
+        rows = body if isinstance(body, list) else [body]
+        try:
+            created = self.server.mock.insert(table, rows)
+        except KeyError as e:
+            self._send(409, {'message': f'duplicate key value violates unique constraint "{table}_key"',
+                             'code': '23505', 'details': str(e), 'hint': None})
+            return
+        self._send(201, created)
+
+    def _rpc(self, function, params):
+        if function != 'parent_session_months':
+            self._send(404, {'message': f'Could not find the function public.{function}', 'code': 'PGRST202'})
+            return
+        filters = [('parent_no', 'eq', params.get('p_parent_no'))]
+        if params.get('p_student_name') is not None:
+            filters.append(('student_name', 'eq', params['p_student_name']))
+        rows = self.server.mock.select('session_records', filters)
+        months = sorted({r['month'] for r in rows if r.get('month') is not None})
+        self._send(200, [{'month': m} for m in months])
+
+    def do_PATCH(self):
+        body = self._body() or {}
+        if not self._gate(1):
+            return
+        table, filters, _ = self._parse()
+        self._send(200, self.server.mock.update(table, filters, body))
+
+    def do_DELETE(self):
+        self._body()
+        if not self._gate():
+            return
+        table, filters, _ = self._parse()
+        self._send(200, self.server.mock.delete(table, filters))
+
+
+class MockPostgrest:
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, throttle_rate=0.0, error_rate=0.0,
+                 max_concurrency=0, seed=0, row_latency_ms=0.0, load_latency_ms=0.0):
+        self.latency_ms = latency_ms
+        self.row_latency_ms = row_latency_ms
+        self.load_latency_ms = load_latency_ms
+        self.jitter_ms = jitter_ms
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.max_concurrency = max_concurrency
+        self.tables = {}
+        self.connections = 0
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.mock = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def _on_connection(self):
+        with self._lock:
+            self.connections += 1
+
+    # -- storage --------------------------------------------------------
+    @classmethod
+    def _matches(cls, row, filters):
+        for col, op, raw in filters:
+            if op == 'or':
+                if not any(cls._matches(row, term[1] if term[0] == 'and' else [term]) for term in raw):
+                    return False
+                continue
+            value = row.get(col)
+            if op == 'eq' and value != raw and value != _coerce(raw):
+                return False
+            if op == 'in':
+                options = [v.strip('"') for v in raw.strip('()').split(',')]
+                if value not in options and value not in [_coerce(v) for v in options]:
+                    return False
+            if op == 'gt' and not (value is not None and value > _coerce(raw)):
+                return False
+            if op == 'lt' and not (value is not None and value < _coerce(raw)):
+                return False
+            if op == 'is' and value is not None:
+                return False
+        return True
+
+    def select(self, table, filters):
+        with self._lock:
+            self.requests += 1
+            return [dict(r) for r in self.tables.get(table, []) if self._matches(r, filters)]
+
+    def insert(self, table, rows):
+        key_cols = UNIQUE_KEYS.get(table)
+        with self._lock:
+            self.requests += 1
+            existing = self.tables.setdefault(table, [])
+            keys = {tuple(r.get(c) for c in key_cols) for r in existing} if key_cols else set()
+            created = []
+            for row in rows:
+                row = dict(row)
+                row.setdefault('id', str(uuid.uuid4()))
+                row.setdefault('created_at', _now())
+                row.setdefault('updated_at', row['created_at'])
+                if key_cols:
+                    key = tuple(row.get(c) for c in key_cols)
+                    if key in keys:
+                        raise KeyError(key)
+                    keys.add(key)
+                created.append(row)
+            existing.extend(created)
+            return [dict(r) for r in created]
+
+    def update(self, table, filters, values):
+        with self._lock:
+            self.requests += 1
+            updated = []
+            for row in self.tables.get(table, []):
+                if self._matches(row, filters):
+                    row.update(values)
+                    row['updated_at'] = _now()
+                    updated.append(dict(row))
+            return updated
+
+    def delete(self, table, filters):
+        with self._lock:
+            self.requests += 1
+            rows = self.tables.get(table, [])
+            keep = [r for r in rows if not self._matches(r, filters)]
+            removed = [r for r in rows if self._matches(r, filters)]
+            self.tables[table] = keep
+            return removed
@@ -0,0 +1,81 @@
+"""
+Run the benchmark suites and store results as JSON.
+
+Usage (from the backend directory):
+    python -m benchmarks.run                           # all suites, default sizes
+    python -m benchmarks.run --suite ingest --sizes 100,1000,100000
+    python -m benchmarks.run --compare benchmarks/results/<previous>.json
+
+Results are written to benchmarks/results/<suite>-<timestamp>-<git rev>.json
+unless --output is given. With --compare the exit status is 1 when any p50
+regressed by more than --threshold.
+"""
+import argparse
+import logging
+import sys
+
+from benchmarks import common
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--suite', default='all',
+                        choices=['all', 'ingest', 'reads', 'tokens', 'payloads', 'json', 'startup', 'normalize', 'formats'])
+    parser.add_argument('--sizes', default='100,1000,10000', help='comma separated row counts for ingestion')
+    parser.add_argument('--iterations', type=int, default=3, help='timed iterations per ingestion benchmark')
+    parser.add_argument('--parents', type=int, default=200, help='parents seeded for read benchmarks')
+    parser.add_argument('--requests', type=int, default=200, help='timed requests per parent endpoint')
+    parser.add_argument('--seed', type=int, default=42, help='seed for the generated normalization inputs')
+    parser.add_argument('--output', help='result JSON path')
+    parser.add_argument('--compare', help='previous result JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10, help='p50 regression threshold (fraction)')
+    parser.add_argument('--quiet-log', action='store_true',
+                        help='raise the upload logger to WARNING so per-row log writes are not timed')
+    args = parser.parse_args(argv)
+
+    import app
+    if args.quiet_log:
+        app.logger.setLevel(logging.WARNING)
+
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    results = []
+    if args.suite in ('all', 'ingest'):
+        from benchmarks import bench_ingest
+        results += bench_ingest.run(sizes, iterations=args.iterations)
+    if args.suite in ('all', 'reads'):
+        from benchmarks import bench_reads
+        results += bench_reads.run(parents=args.parents, iterations=args.requests)
+    if args.suite in ('all', 'tokens'):
+        from benchmarks import bench_tokens
+        results += bench_tokens.run(parents=args.parents)
+    if args.suite in ('all', 'payloads'):
+        from benchmarks import bench_payloads
+        results += bench_payloads.run()
+    if args.suite in ('all', 'json'):
+        from benchmarks import bench_json
+        results += bench_json.run(parents=args.parents)
+    if args.suite in ('all', 'startup'):
+        from benchmarks import bench_startup
+        results += bench_startup.run()
+    if args.suite in ('all', 'normalize'):
+        from benchmarks import bench_normalize
+        results += bench_normalize.run(iterations=args.iterations, seed=args.seed)
+    if args.suite in ('all', 'formats'):
+        from benchmarks import bench_formats
+        results += bench_formats.run(sizes, iterations=args.iterations)
+
+    common.print_results(results)
+    if args.suite in ('all', 'startup'):
+        bench_startup.print_details(results)
+    path = common.write_results(args.suite, results, args.output, params=vars(args))
+    print(f"\nResults written to {path}")
+
+    if args.compare:
+        regressions = common.compare_results(args.compare, results, args.threshold)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
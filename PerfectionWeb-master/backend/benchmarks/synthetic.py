@@ -0,0 +1,191 @@
+"""
+Synthetic workbook and database generators for benchmarks.
+
+Rows use Arabic and Latin names and the phone formats seen in real uploads
+(+20..., 0020..., 20..., 01..., 10-digit without the leading zero, numbers
+stored as floats, spaces and dashes). Generation is seeded so every run of a
+benchmark works on the same data.
+"""
+import random
+from datetime import datetime, timedelta
+
+FIRST_NAMES = [
+    'أحمد', 'محمد', 'محمود', 'عمر', 'يوسف', 'مريم', 'فاطمة', 'نور', 'سارة', 'هبة',
+    'عبد الرحمن', 'مصطفى', 'خالد', 'ياسمين', 'آية', 'Ahmed', 'Mohamed', 'Omar', 'Sara', 'Nour',
+]
+LAST_NAMES = [
+    'علي', 'حسن', 'إبراهيم', 'السيد', 'عبد الله', 'مُحَمَّد', 'عثمان', 'سالم', 'Hassan', 'Ali',
+]
+GROUPS = ['cam1', 'maimi', 'cam2', 'west', 'station1', 'station2', 'station3', 'online']
+# Password of every parent seed_session_records() creates
+PARENT_PASSWORD = '123456'
+
+
+def make_phone(rng):
+    """Return an Egyptian mobile number in one of the formats seen in sheets."""
+    local = '1' + rng.choice('0125') + ''.join(rng.choice('0123456789') for _ in range(8))
+    style = rng.randrange(7)
+    if style == 0:
+        return '0' + local
+    if style == 1:
+        return '+20' + local
+    if style == 2:
+        return '0020' + local
+    if style == 3:
+        return '20' + local
+    if style == 4:
+        return local  # missing leading zero
+    if style == 5:
+        return float(local)  # Excel numeric cell
+    return f"0{local[:2]} {local[2:6]}-{local[6:]}"
+
+
+def make_name(rng):
+    return f"{rng.choice(FIRST_NAMES)}  {rng.choice(LAST_NAMES)} {rng.choice(LAST_NAMES)}"
+
+
+def _families(rng, rows, students_per_parent):
+    """Yield (parent_phone, student_name) pairs with siblings sharing a phone."""
+    out = []
+    while len(out) < rows:
+        phone = make_phone(rng)
+        for _ in range(rng.randint(1, students_per_parent)):
+            out.append((phone, make_name(rng)))
+    return out[:rows]
+
+
+def normal_lecture_rows(rows, seed=42, students_per_parent=2):
+    """Rows for the normal lecture layout:
+    id, name, pokin, student no., Parent No., a, p, Q, time, s1
+    """
+    rng = random.Random(seed)
+    base = datetime(2025, 1, 15, 9, 0, 0)
+    data = []
+    for i, (phone, name) in enumerate(_families(rng, rows, students_per_parent)):
+        ts = base + timedelta(minutes=rng.randrange(0, 600))
+        # Mix datetime cells with Arabic AM/PM strings
+        if rng.random() < 0.5:
+            time_val = ts
+        else:
+            time_val = ts.strftime('%d/%m/%Y %I:%M:%S ') + ('ص' if ts.hour < 12 else 'م')
+        data.append({
+            'id': str(10000 + i),
+            'name': name,
+            'pokin': rng.choice([None, 1, 2, 3]),
+            'student no.': make_phone(rng),
+            'Parent No.': phone,
+            'a': rng.choice([0, 1, 1, 1]),
+            'p': rng.choice([0, 70, 140]),
+            'Q': rng.choice([None, rng.randint(0, 15)]),
+            'time': time_val,
+            's1': rng.choice([None, None, 1, 2, 3]),
+        })
+    return data
+
+
+def general_exam_rows(rows, seed=42, students_per_parent=2):
+    """Rows for the general exam layout: id, name, .Parent No, a, p, Q"""
+    rng = random.Random(seed)
+    data = []
+    for i, (phone, name) in enumerate(_families(rng, rows, students_per_parent)):
+        data.append({
+            'id': str(20000 + i),
+            'name': name,
+            '.Parent No': phone,
+            'a': rng.choice([0, 1, 1, 1]),
+            'p': rng.choice([0, 1]),
+            'Q': rng.choice([None, rng.randint(0, 50)]),
+        })
+    return data
+
+
+def write_workbook(rows, path):
+    """Write rows to an .xlsx file at path."""
+    import pandas as pd
+    pd.DataFrame(rows).to_excel(path, index=False)
+    return path
+
+
+def write_csv(rows, path, encoding='utf-8', sep=','):
+    """Write rows to a CSV file at path, as the attendance machines export them."""
+    import pandas as pd
+    pd.DataFrame(rows).to_csv(path, index=False, encoding=encoding, sep=sep)
+    return path
+
+
+def write_parquet(rows, path):
+    """Write rows to a Parquet file at path (needs pyarrow or fastparquet)."""
+    import pandas as pd
+    frame = pd.DataFrame(rows)
+    # Mixed-type columns (numbers next to formatted phones, datetimes next to
+    # Arabic time strings) are stored as text, which is what Parquet exports hold
+    for column in frame.columns:
+        if frame[column].dtype == object:
+            frame[column] = frame[column].map(lambda v: None if v is None else str(v))
+    frame.to_parquet(path, index=False)
+    return path
+
+
+def seed_session_records(repos, parents=200, students_per_parent=2, sessions_per_student=8, seed=7):
+    """Insert a realistic history of session_records and parents.
+
+    Returns the list of normalized parent phone numbers that were created.
+    The unique key (student_name, session_number, parent_no) allows at most
+    8 sessions per student, so sessions_per_student is capped at 8.
+    """
+    from app import normalize_phone
+
+    sessions_per_student = min(sessions_per_student, 8)
+
+    rng = random.Random(seed)
+    phones = []
+    base = datetime(2025, 1, 1, 10, 0, 0)
+    batch = []
+    for p in range(parents):
+        phone = normalize_phone(str(make_phone(rng)).split('.')[0])
+        if phone in phones:
+            continue
+        phones.append(phone)
+        repos.parents.insert({'phone_number': phone, 'password_hash': PARENT_PASSWORD, 'needs_password_reset': False,
+                              'name': f'Parent {phone}'})
+        names = set()
+        for s in range(rng.randint(1, students_per_parent)):
+            name = make_name(rng)
+            if name in names:
+                continue
+            names.add(name)
+            group = rng.choice(GROUPS)
+            for session in range(1, sessions_per_student + 1):
+                finish = base + timedelta(days=7 * session + rng.randrange(0, 60))
+                batch.append({
+                    'student_id': f'{p}-{s}',
+                    'student_name': name,
+                    'parent_no': phone,
+                    'session_number': session,
+                    'group_name': group,
+                    'is_general_exam': session % 4 == 0,
+                    'lecture_name': f'Lecture {session}',
+                    'quiz_mark': float(rng.randint(0, 15)),
+                    'admin_quiz_mark': 15.0,
+                    'finish_time': finish.strftime('%Y-%m-%d %H:%M:%S'),
+                    'start_time': (finish - timedelta(hours=2)).strftime('%Y-%m-%d %H:%M:%S'),
+                    'month': finish.month,
+                    'attendance': rng.choice([0, 1, 1]),
+                    'payment': float(rng.choice([0, 140])),
+                    'homework_status': rng.choice([0, 0, 1, 2, 3]),
+                })
+                if len(batch) >= 500:
+                    repos.session_records.insert_many(batch)
+                    batch = []
+    if batch:
+        repos.session_records.insert_many(batch)
+    return phones
+
+
+def parent_headers(phone):
+    """Authorization header of a parent created by seed_session_records(), as /api/auth/login would sign it."""
+    from app import auth_tokens
+    from tokens import ROLE_PARENT
+
+    token, _ = auth_tokens.issue(ROLE_PARENT, phone, PARENT_PASSWORD)
+    return {'Authorization': f'Bearer {token}'}
@@ -0,0 +1,122 @@
+"""
+Response compression negotiated by Accept-Encoding.
+
+JSON and text responses of at least COMPRESS_MIN_BYTES are compressed with
+brotli (when the optional `brotli` package is installed and the client accepts
+`br`) or gzip. Streamed file downloads, partial responses and responses that
+already carry a Content-Encoding are left alone.
+
+Settings: COMPRESS_ENABLED (default true), COMPRESS_MIN_BYTES (default 1024),
+COMPRESS_GZIP_LEVEL (default 6), COMPRESS_BROTLI_QUALITY (default 4).
+Compressed responses and bytes saved are counted under `compress.*` in the
+metrics registry.
+"""
+import gzip
+import os
+
+from flask import request
+
+from metrics import registry
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('application/json', 'text/', 'application/javascript', 'image/svg+xml')
+
+
+def _env_bool(name, default=False):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def parse_accept_encoding(header):
+    """Return {coding: q} from an Accept-Encoding header."""
+    accepted = {}
+    for part in (header or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+class ResponseCompressor:
+    def __init__(self, min_bytes=1024, gzip_level=6, brotli_quality=4, enabled=True):
+        self.min_bytes = int(min_bytes)
+        self.gzip_level = int(gzip_level)
+        self.brotli_quality = int(brotli_quality)
+        self.enabled = enabled
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            min_bytes=int(os.getenv('COMPRESS_MIN_BYTES', '1024')),
+            gzip_level=int(os.getenv('COMPRESS_GZIP_LEVEL', '6')),
+            brotli_quality=int(os.getenv('COMPRESS_BROTLI_QUALITY', '4')),
+            enabled=_env_bool('COMPRESS_ENABLED', True),
+        )
+
+    def init_app(self, app):
+        app.after_request(self._after_request)
+        app.extensions['response_compressor'] = self
+
+    def choose_encoding(self, accept_encoding):
+        accepted = parse_accept_encoding(accept_encoding)
+        wildcard = accepted.get('*', 0.0)
+        candidates = (['br'] if brotli is not None else []) + ['gzip']
+        best, best_q = None, 0.0
+        for coding in candidates:
+            q = accepted.get(coding, wildcard)
+            if q > best_q:
+                best, best_q = coding, q
+        return best
+
+    def compress(self, data, encoding):
+        if encoding == 'br':
+            return brotli.compress(data, quality=self.brotli_quality)
+        return gzip.compress(data, compresslevel=self.gzip_level, mtime=0)
+
+    @staticmethod
+    def _compressible(response):
+        if response.direct_passthrough or response.is_streamed:
+            return False
+        if not (200 <= response.status_code < 300) or response.status_code == 206:
+            return False
+        if 'Content-Encoding' in response.headers:
+            return False
+        mimetype = response.mimetype or ''
+        return mimetype.startswith(COMPRESSIBLE_TYPES) or mimetype.endswith('+json')
+
+    def _after_request(self, response):
+        if not self.enabled:
+            return response
+        response.vary.add('Accept-Encoding')
+        if not self._compressible(response):
+            return response
+
+        encoding = self.choose_encoding(request.headers.get('Accept-Encoding'))
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < self.min_bytes:
+            return response
+
+        compressed = self.compress(data, encoding)
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        registry.counter(f'compress.{encoding}.responses').inc()
+        registry.counter('compress.bytes_in').inc(len(data))
+        registry.counter('compress.bytes_out').inc(len(compressed))
+        return response
@@ -0,0 +1,87 @@
+"""
+Incremental sync of a parent's session_records.
+
+Records only change when an admin uploads a sheet, so a dashboard that keeps
+the sessions it already has only needs what changed since its last visit:
+
+    GET /api/parent/sessions/changes                 -> everything, full=true
+    GET /api/parent/sessions/changes?since=<watermark>
+        -> rows created/updated after the watermark, ids deleted after it
+
+Rows are selected by `updated_at` (set on insert and kept current by the
+update_session_records_updated_at trigger); deletions come from
+session_records_tombstones, filled by a delete trigger
+(migration_session_records_tombstones.sql).
+
+The watermark is the newest updated_at/deleted_at the client has received,
+but never later than SYNC_OVERLAP_SECONDS (default 2) before the request: a
+row stamped just before a read may commit just after it, so the most recent
+seconds are sent again on the next sync (clients upsert by id). A watermark
+older than SYNC_TOMBSTONE_RETENTION_DAYS (default 30, tombstones older than
+that may be pruned) gets the full list again with full=true.
+"""
+import os
+from datetime import datetime, timedelta, timezone
+
+from dateutil import parser as date_parser
+
+OVERLAP = timedelta(seconds=float(os.getenv('SYNC_OVERLAP_SECONDS', '2')))
+RETENTION = timedelta(days=float(os.getenv('SYNC_TOMBSTONE_RETENTION_DAYS', '30')))
+
+
+def parse_watermark(text):
+    """Aware UTC datetime from a watermark; ValueError if it is not a timestamp."""
+    try:
+        # A '+' left unescaped in the query string arrives as a space
+        dt = date_parser.isoparse(text.strip().replace(' ', '+'))
+    except (ValueError, OverflowError) as e:
+        raise ValueError(f'Invalid watermark: {e}')
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def _iso(dt):
+    # Same shape as the stored timestamps, so SQLite's text comparison agrees
+    return dt.astimezone(timezone.utc).isoformat(timespec='milliseconds')
+
+
+def _watermark(dt):
+    # 'Z' instead of '+00:00' so the value can go into a URL as is
+    return _iso(dt).replace('+00:00', 'Z') if dt else None
+
+
+def _newest(values, current=None):
+    newest = current
+    for value in values:
+        if not value:
+            continue
+        dt = parse_watermark(str(value))
+        if newest is None or dt > newest:
+            newest = dt
+    return newest
+
+
+def changes_for_parent(db, parent_no, since=None, student_name=None, now=None):
+    """Return (records, deleted_ids, watermark, full) for a parent.
+
+    `since` is the client's watermark string or None. When `full` is True,
+    `records` is the parent's complete list (newest upload first) and the
+    client should replace what it has.
+    """
+    now = now or datetime.now(timezone.utc)
+    since_dt = parse_watermark(since) if since else None
+
+    settled = now - OVERLAP
+
+    if since_dt is None or since_dt < now - RETENTION:
+        records = db.session_records.page_for_parent(parent_no, student_name=student_name)
+        newest = _newest(r.get('updated_at') or r.get('created_at') for r in records)
+        return records, [], _watermark(min(newest or settled, settled)), True
+
+    since_iso = _iso(since_dt)
+    records = db.session_records.changed_since(parent_no, since_iso, student_name=student_name)
+    tombstones = db.tombstones.deleted_since(parent_no, since_iso, student_name=student_name)
+    newest = _newest((r.get('updated_at') for r in records), since_dt)
+    newest = _newest((t.get('deleted_at') for t in tombstones), newest)
+    return records, [t['id'] for t in tombstones], _watermark(max(since_dt, min(newest, settled))), False
@@ -0,0 +1,509 @@
+"""
+Server-Sent Events telling parent dashboards that their sessions changed.
+
+A dashboard keeps one EventSource open on GET /api/parent/events and only
+re-fetches (a delta sync, see delta_sync.py) when an event arrives, instead of
+re-reading session_records on every refresh. update_database() publishes one
+small event per parent_no it wrote rows for:
+
+    event: sessions
+    data: {"type": "sessions", "changed": 12}
+
+Publishing and delivery are decoupled by an event bus that every process on
+the host can write to, including the ingestion pool processes:
+
+  - sqlite (default): an append-only table in EVENTS_STATE_DIR/events.sqlite3
+  - redis: a capped stream at EVENTS_REDIS_URL (requires the optional `redis`
+    package), for several hosts behind one load balancer
+  - memory: this process only (development server, memory data backend)
+
+Each gunicorn worker runs one hub thread that polls the bus every
+EVENTS_POLL_SECONDS (default 0.5) and fans events out to the streams
+subscribed to that parent_no. Under gunicorn the stream's socket is taken
+over by the hub once the response headers are out, so an idle dashboard costs
+a file descriptor and a dict entry rather than a request thread; the hub also
+sends a comment every EVENTS_HEARTBEAT_SECONDS (default 25) to keep proxies
+from closing the connection, and closes streams after EVENTS_MAX_SECONDS
+(default 1800, +-10%) so that clients reconnect and rebalance across workers.
+Elsewhere (flask run, test client) the response is an ordinary streamed
+generator that holds its thread.
+
+Settings: EVENTS_ENABLED (default true), EVENTS_BUS (sqlite, redis or
+memory), EVENTS_MAX_STREAMS per worker (default 4000; more get 503 +
+Retry-After), EVENTS_RETRY_MS (reconnect delay sent to clients, default
+5000), EVENTS_RETENTION_SECONDS (how long published events are kept, default
+600). Counted under `events.*` in the metrics registry.
+"""
+import json
+import logging
+import os
+import random
+import selectors
+import socket
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from metrics import registry
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - Windows development machines
+    resource = None
+
+logger = logging.getLogger('upload_logger')
+
+BUSES = ('sqlite', 'redis', 'memory')
+
+# gunicorn only leaves a response open-ended (no terminating chunk) when it
+# has a Content-Length; streams are ended by closing the socket long before
+STREAM_LENGTH = 1 << 40
+
+HEARTBEAT = b': ping\n\n'
+
+
+def _env_bool(name, default=False):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def format_event(event, data):
+    """One SSE frame; `data` is JSON-encoded on a single line."""
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode('utf-8')
+
+
+# ----------------------------------------------------------------------
+# Event buses
+# ----------------------------------------------------------------------
+class MemoryEventBus:
+    """Events of this process only."""
+
+    name = 'memory'
+
+    def __init__(self, retention=600.0, max_events=10000):
+        self.retention = float(retention)
+        self._lock = threading.Lock()
+        self._events = deque(maxlen=max_events)
+        self._next_id = 1
+
+    def publish_many(self, events):
+        now = time.time()
+        with self._lock:
+            for topic, data in events:
+                self._events.append((self._next_id, topic, data, now))
+                self._next_id += 1
+            while self._events and self._events[0][3] < now - self.retention:
+                self._events.popleft()
+
+    def latest_id(self):
+        with self._lock:
+            return self._next_id - 1
+
+    def read_after(self, last_id, limit=1000):
+        with self._lock:
+            return [(i, topic, data) for i, topic, data, _ in self._events if i > last_id][:limit]
+
+
+class SQLiteEventBus:
+    """Events in a SQLite file shared by all processes on the host."""
+
+    name = 'sqlite'
+
+    def __init__(self, path, retention=600.0):
+        self.path = path
+        self.retention = float(retention)
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _connection(self):
+        # One connection per process; reopened after fork
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=2.0, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # Notifications are disposable; don't pay for durable commits
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute('CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                         'topic TEXT NOT NULL, data TEXT NOT NULL, created REAL NOT NULL)')
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def publish_many(self, events):
+        now = time.time()
+        rows = [(topic, json.dumps(data, separators=(',', ':')), now) for topic, data in events]
+        with self._lock:
+            conn = self._connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.executemany('INSERT INTO events (topic, data, created) VALUES (?, ?, ?)', rows)
+                if random.random() < 0.05:
+                    conn.execute('DELETE FROM events WHERE created < ?', (now - self.retention,))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+
+    def latest_id(self):
+        with self._lock:
+            row = self._connection().execute('SELECT MAX(id) FROM events').fetchone()
+        return row[0] or 0
+
+    def read_after(self, last_id, limit=1000):
+        with self._lock:
+            rows = self._connection().execute(
+                'SELECT id, topic, data FROM events WHERE id > ? ORDER BY id LIMIT ?', (last_id, limit)).fetchall()
+        return [(i, topic, json.loads(data)) for i, topic, data in rows]
+
+
+class RedisEventBus:
+    """Events in a capped Redis stream, shared between hosts."""
+
+    name = 'redis'
+
+    def __init__(self, url, key='events:sessions', max_events=10000):
+        import redis
+
+        self._client = redis.Redis.from_url(url)
+        self.key = key
+        self.max_events = int(max_events)
+
+    def publish_many(self, events):
+        pipe = self._client.pipeline(transaction=False)
+        for topic, data in events:
+            pipe.xadd(self.key, {'topic': topic, 'data': json.dumps(data, separators=(',', ':'))},
+                      maxlen=self.max_events, approximate=True)
+        pipe.execute()
+
+    def latest_id(self):
+        entries = self._client.xrevrange(self.key, count=1)
+        return entries[0][0] if entries else b'0-0'
+
+    def read_after(self, last_id, limit=1000):
+        result = self._client.xread({self.key: last_id}, count=limit)
+        events = []
+        for _, entries in result or []:
+            for entry_id, fields in entries:
+                events.append((entry_id, fields[b'topic'].decode('utf-8'), json.loads(fields[b'data'])))
+        return events
+
+
+# ----------------------------------------------------------------------
+# Streams
+# ----------------------------------------------------------------------
+class SocketStream:
+    """A client socket owned by the hub thread (taken over from gunicorn)."""
+
+    def __init__(self, sock, topic, expires, sent=0):
+        self.sock = sock
+        self.topic = topic
+        self.expires = expires
+        self.sent = sent
+        self.closed = False
+
+    def send(self, frame):
+        """Write a frame without blocking; False if the client is gone or not reading."""
+        if self.closed:
+            return False
+        if self.sent + len(frame) >= STREAM_LENGTH:
+            return False
+        try:
+            written = self.sock.send(frame, socket.MSG_DONTWAIT)
+        except OSError:
+            return False
+        self.sent += written
+        # A frame the kernel can't take in full means the client stopped reading
+        return written == len(frame)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+
+
+class QueueStream:
+    """A streamed response generator waiting for frames on its own thread."""
+
+    def __init__(self, topic, expires, max_pending=100):
+        self.topic = topic
+        self.expires = expires
+        self.closed = False
+        self._frames = deque()
+        self._max_pending = max_pending
+        self._cond = threading.Condition()
+
+    def send(self, frame):
+        with self._cond:
+            if self.closed or len(self._frames) >= self._max_pending:
+                return False
+            self._frames.append(frame)
+            self._cond.notify()
+        return True
+
+    def get(self, timeout):
+        """Next frame, a heartbeat after `timeout` seconds, or None once closed."""
+        with self._cond:
+            if not self._frames and not self.closed:
+                self._cond.wait(timeout)
+            if self._frames:
+                return self._frames.popleft()
+            return None if self.closed else HEARTBEAT
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+
+
+# ----------------------------------------------------------------------
+# Per-worker hub
+# ----------------------------------------------------------------------
+class EventBroker:
+    """Publishes events to the bus and fans them out to this worker's streams."""
+
+    def __init__(self, bus, enabled=True, poll_interval=0.5, heartbeat=25.0, max_seconds=1800.0,
+                 max_streams=4000, retry_ms=5000):
+        self.bus = bus
+        self.enabled = enabled
+        self.poll_interval = float(poll_interval)
+        self.heartbeat = float(heartbeat)
+        self.max_seconds = float(max_seconds)
+        self.max_streams = max(1, int(max_streams))
+        self.retry_ms = int(retry_ms)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._thread = None
+        self._selector = None
+        self._topics = {}
+        self._count = 0
+        self._last_id = None
+        self._streams_gauge = registry.gauge('events.streams')
+
+    @classmethod
+    def from_env(cls, default_dir):
+        state_dir = os.getenv('EVENTS_STATE_DIR', default_dir)
+        retention = float(os.getenv('EVENTS_RETENTION_SECONDS', '600'))
+        kind = (os.getenv('EVENTS_BUS') or ('redis' if os.getenv('EVENTS_REDIS_URL') else 'sqlite')).strip().lower()
+        if kind not in BUSES:
+            raise ValueError(f"EVENTS_BUS must be one of {', '.join(BUSES)}, got {kind!r}")
+        bus = None
+        if kind == 'redis':
+            try:
+                bus = RedisEventBus(os.getenv('EVENTS_REDIS_URL', 'redis://localhost:6379/0'))
+            except ImportError:
+                logger.warning("EVENTS_BUS=redis but redis is not installed - using the local SQLite bus")
+                kind = 'sqlite'
+        if kind == 'memory':
+            bus = MemoryEventBus(retention=retention)
+        elif bus is None:
+            bus = SQLiteEventBus(os.path.join(state_dir, 'events.sqlite3'), retention=retention)
+        return cls(
+            bus,
+            enabled=_env_bool('EVENTS_ENABLED', True),
+            poll_interval=float(os.getenv('EVENTS_POLL_SECONDS', '0.5')),
+            heartbeat=float(os.getenv('EVENTS_HEARTBEAT_SECONDS', '25')),
+            max_seconds=float(os.getenv('EVENTS_MAX_SECONDS', '1800')),
+            max_streams=int(os.getenv('EVENTS_MAX_STREAMS', '4000')),
+            retry_ms=int(os.getenv('EVENTS_RETRY_MS', '5000')),
+        )
+
+    def init_app(self, app):
+        app.extensions['event_broker'] = self
+
+    def settings(self):
+        return {
+            'enabled': self.enabled,
+            'bus': self.bus.name,
+            'streams': self._count if self._pid == os.getpid() else 0,
+            'max_streams': self.max_streams,
+        }
+
+    # ------------------------------------------------------------------
+    # Publishing (any process)
+    # ------------------------------------------------------------------
+    def publish(self, events):
+        """Publish (topic, data) pairs; errors are logged, never raised."""
+        events = list(events)
+        if not self.enabled or not events:
+            return 0
+        try:
+            self.bus.publish_many(events)
+        except Exception as e:
+            registry.counter('events.publish_errors').inc()
+            logger.warning(f"Could not publish {len(events)} event(s): {str(e)}")
+            return 0
+        registry.counter('events.published').inc(len(events))
+        return len(events)
+
+    # ------------------------------------------------------------------
+    # Streams (gunicorn workers)
+    # ------------------------------------------------------------------
+    def opening(self):
+        """First bytes of every stream: the reconnect delay and a comment."""
+        return f"retry: {self.retry_ms}\n: connected\n\n".encode('utf-8')
+
+    def _expires(self):
+        return time.time() + self.max_seconds * random.uniform(0.9, 1.1)
+
+    def _ensure_hub(self):
+        # Rebuilt after fork: streams and the hub thread belong to one worker
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._topics = {}
+            self._count = 0
+            self._selector = selectors.DefaultSelector()
+            self._last_id = self.bus.latest_id()
+            _raise_fd_limit(self.max_streams + 256)
+            self._thread = threading.Thread(target=self._run, name='event-hub', daemon=True)
+            self._thread.start()
+
+    def has_capacity(self):
+        return self._pid != os.getpid() or self._count < self.max_streams
+
+    def _add(self, stream):
+        with self._lock:
+            if self._count >= self.max_streams:
+                return False
+            self._topics.setdefault(stream.topic, set()).add(stream)
+            self._count += 1
+            if isinstance(stream, SocketStream):
+                self._selector.register(stream.sock, selectors.EVENT_READ, stream)
+        self._streams_gauge.inc()
+        registry.counter('events.connects').inc()
+        return True
+
+    def _remove(self, stream):
+        with self._lock:
+            streams = self._topics.get(stream.topic)
+            if not streams or stream not in streams:
+                return
+            streams.discard(stream)
+            if not streams:
+                del self._topics[stream.topic]
+            self._count -= 1
+            if isinstance(stream, SocketStream):
+                try:
+                    self._selector.unregister(stream.sock)
+                except (KeyError, ValueError):
+                    pass
+        self._streams_gauge.dec()
+        stream.close()
+
+    def adopt(self, sock, topic, sent=0):
+        """Take over a client socket whose response headers were already sent.
+
+        The socket is duplicated, so the server can close its own descriptor
+        without ending the stream.
+        """
+        self._ensure_hub()
+        stream = SocketStream(sock.dup(), topic, self._expires(), sent=sent)
+        if not self._add(stream):
+            registry.counter('events.rejected').inc()
+            stream.close()
+            return None
+        return stream
+
+    def subscribe(self, topic):
+        self._ensure_hub()
+        stream = QueueStream(topic, self._expires())
+        if not self._add(stream):
+            registry.counter('events.rejected').inc()
+            return None
+        return stream
+
+    def unsubscribe(self, stream):
+        self._remove(stream)
+
+    def stream_frames(self, stream):
+        """Generator for a QueueStream response: frames until the stream ends."""
+        try:
+            yield self.opening()
+            while True:
+                frame = stream.get(self.heartbeat)
+                if frame is None:
+                    return
+                yield frame
+        finally:
+            self._remove(stream)
+
+    def _run(self):
+        next_poll = next_beat = 0.0
+        while True:
+            try:
+                for key, _ in self._selector.select(timeout=self.poll_interval):
+                    self._on_readable(key.data)
+                now = time.time()
+                if now >= next_poll:
+                    next_poll = now + self.poll_interval
+                    self._pump()
+                if now >= next_beat:
+                    next_beat = now + self.heartbeat
+                    self._beat(now)
+            except Exception as e:
+                registry.counter('events.hub_errors').inc()
+                logger.warning(f"Event hub error in worker {os.getpid()}: {str(e)}")
+                time.sleep(self.poll_interval)
+
+    def _on_readable(self, stream):
+        # EventSource never sends anything after the request, so this is EOF
+        try:
+            data = stream.sock.recv(1024, socket.MSG_DONTWAIT)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._remove(stream)
+
+    def _pump(self):
+        while True:
+            events = self.bus.read_after(self._last_id)
+            if not events:
+                return
+            self._last_id = events[-1][0]
+            for _, topic, data in events:
+                with self._lock:
+                    streams = list(self._topics.get(topic, ()))
+                if not streams:
+                    continue
+                frame = format_event(data.get('type', 'message'), data)
+                for stream in streams:
+                    if stream.send(frame):
+                        registry.counter('events.delivered').inc()
+                    else:
+                        registry.counter('events.dropped').inc()
+                        self._remove(stream)
+            if len(events) < 1000:
+                return
+
+    def _beat(self, now):
+        with self._lock:
+            streams = [s for topic_streams in self._topics.values() for s in topic_streams]
+        for stream in streams:
+            if stream.expires <= now:
+                self._remove(stream)
+            elif isinstance(stream, SocketStream) and not stream.send(HEARTBEAT):
+                self._remove(stream)
+
+
+def _raise_fd_limit(wanted):
+    """Let the worker hold `wanted` sockets if the hard limit allows it."""
+    if resource is None:
+        return
+    try:
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        target = wanted if hard == resource.RLIM_INFINITY else min(wanted, hard)
+        if soft != resource.RLIM_INFINITY and soft < target:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+    except (ValueError, OSError):
+        pass
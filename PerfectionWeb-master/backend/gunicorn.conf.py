@@ -0,0 +1,49 @@
+"""
+gunicorn settings shared by the Dockerfile, app.yaml and Procfile.
+
+    gunicorn -c gunicorn.conf.py app:app
+
+Environment:
+  - PORT: listen port (default 8080)
+  - WEB_CONCURRENCY / GUNICORN_THREADS: workers and threads per worker (4 / 2)
+  - GUNICORN_PRELOAD: import the app once in the master and fork workers from
+    it (default true). Workers share the imported code copy-on-write and start
+    in a few milliseconds; set to false to import the app in every worker.
+  - PRELOAD_UPLOAD_LIBS: with preload, also import pandas/openpyxl in the
+    master so uploads don't pay for the import and workers share it (default
+    false: pandas is imported on the first upload).
+  - GUNICORN_TIMEOUT: worker timeout in seconds (default 30)
+
+Each worker opens and warms its own database connection in post_worker_init.
+"""
+import gc
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '4'))
+threads = int(os.getenv('GUNICORN_THREADS', '2'))
+worker_class = 'gthread'
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '30'))
+preload_app = (os.getenv('GUNICORN_PRELOAD') or 'true').strip().lower() in ('1', 'true', 'yes', 'on')
+# Heartbeat files in RAM; a slow disk must not make the arbiter kill workers
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+
+def when_ready(server):
+    if preload_app and (os.getenv('PRELOAD_UPLOAD_LIBS') or '').strip().lower() in ('1', 'true', 'yes', 'on'):
+        import openpyxl  # noqa: F401
+        import pandas  # noqa: F401
+        server.log.info("Preloaded pandas/openpyxl in the master")
+
+
+def pre_fork(server, worker):
+    # Move everything imported so far out of the collector's reach so that GC
+    # passes in the workers don't touch (and un-share) the preloaded pages
+    if preload_app:
+        gc.freeze()
+
+
+def post_worker_init(worker):
+    from app import init_worker
+    init_worker()
@@ -0,0 +1,224 @@
+"""
+Pooled HTTP transport for database (PostgREST) calls.
+
+supabase-py creates its own httpx client with default limits and a long
+timeout. install_pooled_session() replaces that client with one whose
+transport:
+
+  - keeps up to SUPABASE_POOL_SIZE connections per worker alive for reuse
+    (idle connections expire after SUPABASE_KEEPALIVE_SECONDS),
+  - speaks HTTP/2 when the `h2` package is installed (SUPABASE_HTTP2=auto),
+  - applies SUPABASE_TIMEOUT_SECONDS / SUPABASE_CONNECT_TIMEOUT to every call,
+  - disables Nagle's algorithm so small PostgREST requests are not held
+    back by delayed ACKs on reused connections,
+  - waits at most SUPABASE_POOL_TIMEOUT seconds for a free slot; slots are
+    handed to waiting threads in arrival order, so a thread that just
+    released one can't take it again ahead of them, and
+  - records pool saturation and wait time in the metrics registry under
+    `db_pool.*`.
+
+All gthread threads of a worker share the one pooled client.
+"""
+import os
+import socket
+import threading
+import time
+from collections import deque
+
+import httpx
+from httpcore.backends.sync import SyncBackend
+
+from metrics import registry
+
+
+def _http2_available():
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class PoolConfig:
+    def __init__(self, pool_size=10, keepalive_seconds=30.0, http2=False, timeout=10.0,
+                 connect_timeout=5.0, pool_timeout=5.0):
+        self.pool_size = max(1, int(pool_size))
+        self.keepalive_seconds = float(keepalive_seconds)
+        self.http2 = bool(http2)
+        self.timeout = float(timeout)
+        self.connect_timeout = float(connect_timeout)
+        self.pool_timeout = float(pool_timeout)
+
+    @classmethod
+    def from_env(cls):
+        http2_setting = (os.getenv('SUPABASE_HTTP2') or 'auto').lower()
+        if http2_setting == 'auto':
+            http2 = _http2_available()
+        else:
+            http2 = http2_setting in ('1', 'true', 'yes', 'on') and _http2_available()
+        return cls(
+            pool_size=int(os.getenv('SUPABASE_POOL_SIZE', '10')),
+            keepalive_seconds=float(os.getenv('SUPABASE_KEEPALIVE_SECONDS', '30')),
+            http2=http2,
+            timeout=float(os.getenv('SUPABASE_TIMEOUT_SECONDS', '10')),
+            connect_timeout=float(os.getenv('SUPABASE_CONNECT_TIMEOUT', '5')),
+            pool_timeout=float(os.getenv('SUPABASE_POOL_TIMEOUT', '5')),
+        )
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+class _NoDelayBackend(SyncBackend):
+    def connect_tcp(self, host, port, timeout=None, local_address=None):
+        stream = super().connect_tcp(host, port, timeout=timeout, local_address=local_address)
+        sock = stream.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return stream
+
+
+class _ReleasingStream(httpx.SyncByteStream):
+    """Response stream that frees the pool slot once the body is closed."""
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            self._release()
+
+
+class _FairSlots:
+    """Counting semaphore that hands released slots to its waiters first come, first served."""
+
+    def __init__(self, size):
+        self._free = int(size)
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        """Take a slot if one is free and nobody is queued for it."""
+        with self._lock:
+            if self._free and not self._waiters:
+                self._free -= 1
+                return True
+            return False
+
+    def acquire(self, timeout=None):
+        with self._lock:
+            if self._free and not self._waiters:
+                self._free -= 1
+                return True
+            waiter = threading.Event()
+            self._waiters.append(waiter)
+        if waiter.wait(timeout):
+            return True
+        with self._lock:
+            # Handed a slot between the timeout and taking the lock
+            if waiter.is_set():
+                return True
+            self._waiters.remove(waiter)
+            return False
+
+    def release(self):
+        with self._lock:
+            if self._waiters:
+                # The slot goes straight to the oldest waiter; it never counts as free
+                self._waiters.popleft().set()
+            else:
+                self._free += 1
+
+
+class PooledTransport(httpx.HTTPTransport):
+    """httpx transport with a bounded, instrumented connection pool."""
+
+    def __init__(self, config, metrics_prefix='db_pool'):
+        limits = httpx.Limits(
+            max_connections=config.pool_size,
+            max_keepalive_connections=config.pool_size,
+            keepalive_expiry=config.keepalive_seconds,
+        )
+        super().__init__(limits=limits, http2=config.http2)
+        # httpx 0.23 has no socket_options; hand the pool a backend that sets them
+        self._pool._network_backend = _NoDelayBackend()
+        self.config = config
+        self._slots = _FairSlots(config.pool_size)
+        registry.gauge(f'{metrics_prefix}.size').set(config.pool_size)
+        self._in_flight = registry.gauge(f'{metrics_prefix}.in_flight')
+        self._wait = registry.timer(f'{metrics_prefix}.wait')
+        self._requests = registry.counter(f'{metrics_prefix}.requests')
+        self._saturated = registry.counter(f'{metrics_prefix}.saturated')
+        self._timeouts = registry.counter(f'{metrics_prefix}.pool_timeouts')
+        self._errors = registry.counter(f'{metrics_prefix}.errors')
+
+    def handle_request(self, request):
+        start = time.perf_counter()
+        # Fast path: a free slot and no queue means no waiting; otherwise the pool is saturated
+        acquired = self._slots.try_acquire()
+        if not acquired:
+            self._saturated.inc()
+            acquired = self._slots.acquire(timeout=self.config.pool_timeout)
+        self._wait.observe(time.perf_counter() - start)
+        if not acquired:
+            self._timeouts.inc()
+            raise httpx.PoolTimeout(f'No free database connection after {self.config.pool_timeout}s', request=request)
+
+        self._requests.inc()
+        self._in_flight.inc()
+        released = threading.Event()
+
+        def release():
+            if not released.is_set():
+                released.set()
+                self._in_flight.dec()
+                self._slots.release()
+
+        try:
+            response = super().handle_request(request)
+        except Exception:
+            self._errors.inc()
+            release()
+            raise
+        response.stream = _ReleasingStream(response.stream, release)
+        return response
+
+    def open_connections(self):
+        """Best-effort count of connections currently held by the pool."""
+        pool = getattr(self, '_pool', None)
+        return len(getattr(pool, 'connections', []) or [])
+
+
+def make_pooled_client(base_url, headers, config, client_cls=httpx.Client):
+    timeout = httpx.Timeout(config.timeout, connect=config.connect_timeout, pool=config.pool_timeout)
+    return client_cls(base_url=base_url, headers=headers, timeout=timeout, transport=PooledTransport(config))
+
+
+def install_pooled_session(supabase_client, config=None):
+    """Swap the PostgREST session of a supabase-py client for a pooled one."""
+    from postgrest.utils import SyncClient
+
+    config = config or PoolConfig.from_env()
+    postgrest = supabase_client.postgrest
+    old = postgrest.session
+    postgrest.session = make_pooled_client(str(old.base_url), dict(old.headers), config, client_cls=SyncClient)
+    try:
+        old.close()
+    except Exception:
+        pass
+    return postgrest.session
+
+
+def pool_stats(supabase_client):
+    """Current pool state for the admin metrics endpoint."""
+    session = getattr(getattr(supabase_client, 'postgrest', None), 'session', None)
+    transport = getattr(session, '_transport', None)
+    if not isinstance(transport, PooledTransport):
+        return None
+    return dict(transport.config.as_dict(), open_connections=transport.open_connections())
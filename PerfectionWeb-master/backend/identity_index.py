@@ -0,0 +1,184 @@
+"""
+Student identity resolution for uploads, decided in memory before any write.
+
+A session_records row is identified by (parent_no, student_name,
+session_number). Sheets spell the same child differently from one upload to
+the next (أحمد / احمد, "Mohamed" / "Mohammed", stray spaces) and IDs get
+renumbered, so update_database() used to find the row to overwrite by trying
+an insert and then up to three follow-up queries per row. Instead, the
+parent's existing rows are fetched once and indexed by parent_no and
+normalized name; every parsed row is then classified:
+
+  - insert: the student has no row for this session yet
+  - update: the student's row for this session exists with the same ID
+  - rename: it exists under a different student_id (the ID is replaced)
+
+Names are matched within one parent's children only, in this order:
+
+  1. exact: same normalize_name() value
+  2. folded: same after folding Arabic letter variants (أ/إ/آ -> ا, ة -> ه,
+     ى -> ي), dropping tatweel and spaces and collapsing doubled letters
+  3. student_id: a single stored name carries the row's student_id and
+     agrees with the uploaded one (same first name, or a difflib ratio of the
+     folded names >= IDENTITY_FUZZY_THRESHOLD); IDs get renumbered, so an ID
+     alone never moves one sibling's row onto another
+  4. fuzzy: difflib ratio of the folded names >= IDENTITY_FUZZY_THRESHOLD
+     (default 0.9) with the same first name, and no other name as close
+
+Siblings usually share every name but the first, which is why fuzzy matches
+never cross first names. A matched row keeps the stored spelling, so the
+dashboard keeps showing one child.
+"""
+import difflib
+import os
+import re
+
+_FOLD = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ة': 'ه', 'ى': 'ي', 'ؤ': 'و', 'ئ': 'ي',
+    'ـ': None,
+})
+_REPEATS = re.compile(r'(.)\1+')
+
+INSERT, UPDATE, RENAME = 'insert', 'update', 'rename'
+
+
+def fold_name(normalized):
+    """Looser matching key for an already normalize_name()d name."""
+    return _REPEATS.sub(r'\1', normalized.translate(_FOLD).replace(' ', ''))
+
+
+def _first_name(normalized):
+    first = normalized.split(' ', 1)[0]
+    return fold_name(first)
+
+
+class PlannedWrite:
+    """One session_records write decided before anything is sent."""
+
+    __slots__ = ('action', 'row', 'target_id', 'previous_id', 'match', 'sources')
+
+    def __init__(self, action, row, target_id=None, previous_id=None, match=None):
+        self.action = action
+        self.row = row
+        self.target_id = target_id
+        self.previous_id = previous_id
+        self.match = match
+        # Parsed rows folded into this write (the same student listed twice)
+        self.sources = 1
+
+    def __repr__(self):
+        return f"PlannedWrite({self.action}, {self.row.get('student_name')!r}, match={self.match})"
+
+
+class StudentIdentityIndex:
+    """Existing rows of the uploaded parents, indexed for classification."""
+
+    def __init__(self, rows, normalize, normalize_many=None, fuzzy_threshold=0.9):
+        self.normalize = normalize
+        # Column form of normalize (normalization.normalize_name_series), used
+        # for the stored rows and for every name passed to plan()
+        self.normalize_many = normalize_many or (lambda names: [normalize(n) for n in names])
+        self.fuzzy_threshold = float(fuzzy_threshold)
+        # parent_no -> normalized name -> stored spelling
+        self._names = {}
+        # parent_no -> folded name -> {normalized names}
+        self._folded = {}
+        # parent_no -> student_id -> {normalized names}
+        self._ids = {}
+        # (parent_no, normalized name, session_number) -> existing row
+        self._rows = {}
+        rows = list(rows)
+        for row, name in zip(rows, self._normalized(rows)):
+            self._add(row, name)
+
+    @classmethod
+    def from_env(cls, rows, normalize, normalize_many=None):
+        return cls(rows, normalize, normalize_many,
+                   fuzzy_threshold=float(os.getenv('IDENTITY_FUZZY_THRESHOLD', '0.9')))
+
+    def _normalized(self, rows):
+        return list(self.normalize_many([row.get('student_name') for row in rows]))
+
+    def _add(self, row, name):
+        parent_no = row.get('parent_no')
+        if not parent_no or not name:
+            return
+        self._names.setdefault(parent_no, {}).setdefault(name, row.get('student_name'))
+        self._folded.setdefault(parent_no, {}).setdefault(fold_name(name), set()).add(name)
+        if row.get('student_id'):
+            self._ids.setdefault(parent_no, {}).setdefault(str(row['student_id']), set()).add(name)
+        if row.get('session_number') is not None:
+            self._rows.setdefault((parent_no, name, int(row['session_number'])), row)
+
+    def resolve(self, parent_no, student_name, student_id=None):
+        """Return (normalized stored name, how it matched) or (None, None)."""
+        return self._resolve(parent_no, self.normalize(student_name), student_id)
+
+    @staticmethod
+    def _ratio(folded, other):
+        return difflib.SequenceMatcher(None, folded, fold_name(other)).ratio()
+
+    def _resolve(self, parent_no, name, student_id):
+        names = self._names.get(parent_no)
+        if not names or not name:
+            return None, None
+        if name in names:
+            return name, 'exact'
+
+        folded = fold_name(name)
+        candidates = self._folded[parent_no].get(folded, ())
+        if len(candidates) == 1:
+            return next(iter(candidates)), 'folded'
+
+        if student_id:
+            candidates = self._ids.get(parent_no, {}).get(str(student_id), ())
+            if len(candidates) == 1:
+                other = next(iter(candidates))
+                if _first_name(other) == _first_name(name) or self._ratio(folded, other) >= self.fuzzy_threshold:
+                    return other, 'student_id'
+
+        first = _first_name(name)
+        scored = []
+        for other in names:
+            if _first_name(other) != first:
+                continue
+            ratio = self._ratio(folded, other)
+            if ratio >= self.fuzzy_threshold:
+                scored.append((ratio, other))
+        if len(scored) == 1:
+            return scored[0][1], 'fuzzy'
+        return None, None
+
+    def plan(self, rows):
+        """Classify parsed rows (session_records payloads) into PlannedWrites.
+
+        Rows for the same student and session are folded into one write (the
+        last one wins, as it did when the second insert hit the unique key).
+        """
+        planned = {}
+        rows = list(rows)
+        for row, name in zip(rows, self._normalized(rows)):
+            parent_no = row['parent_no']
+            session = int(row['session_number'])
+            stored, match = self._resolve(parent_no, name, row.get('student_id'))
+            if stored is not None:
+                row['student_name'] = self._names[parent_no][stored]
+            key = (parent_no, stored or name, session)
+
+            if key in planned:
+                write = planned[key]
+                write.row = row
+                write.sources += 1
+                continue
+
+            existing = self._rows.get(key)
+            if existing is None:
+                write = PlannedWrite(INSERT, row, match=match)
+            elif str(existing.get('student_id') or '') == str(row.get('student_id') or ''):
+                write = PlannedWrite(UPDATE, row, target_id=existing['id'], match=match)
+            else:
+                write = PlannedWrite(RENAME, row, target_id=existing['id'],
+                                     previous_id=existing.get('student_id'), match=match)
+            planned[key] = write
+        return list(planned.values())
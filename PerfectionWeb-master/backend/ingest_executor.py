@@ -0,0 +1,227 @@
+"""
+Upload processing off the request-serving threads.
+
+Parsing a workbook with pandas and writing thousands of rows holds the GIL for
+seconds, so an upload running on a gthread worker stalls the parent requests
+served by the other threads of that worker. IngestExecutor runs the upload job
+(parse + update_database) in a small process pool instead:
+
+  - each gunicorn worker starts its pool lazily on its first upload and shuts
+    it down after INGEST_IDLE_SECONDS without uploads
+  - pool processes run at a lower CPU priority (INGEST_NICE), so on a busy host
+    the kernel schedules read-serving workers first
+  - at most INGEST_MAX_PER_WORKER uploads wait inside one gunicorn worker; the
+    rest get 429 + Retry-After before their body is read, so a worker always
+    keeps GUNICORN_THREADS - INGEST_MAX_PER_WORKER threads for reads
+
+The request thread only waits on the job's result, which releases the GIL.
+
+Settings: INGEST_MODE (`process`, default, or `inline` to run jobs on the
+request thread as before), INGEST_PROCESSES (default 1 per gunicorn worker),
+INGEST_MAX_PER_WORKER (default 1), INGEST_NICE (default 10),
+INGEST_IDLE_SECONDS (default 300), INGEST_RETRY_AFTER_SECONDS (default 10).
+The memory data backend always runs inline, as other processes cannot see it.
+Jobs, queue wait and job time are counted under `ingest.*` in the metrics
+registry.
+"""
+import logging
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import g, jsonify, request
+
+from metrics import registry
+
+logger = logging.getLogger('upload_logger')
+
+MODES = ('process', 'inline')
+
+
+def _init_ingest_process(nice, preload):
+    """Pool process initializer: lower the priority and import the job's module up front."""
+    if nice:
+        try:
+            os.nice(nice)
+        except OSError:
+            pass
+    for module in preload:
+        __import__(module)
+
+
+def _timed_call(fn, args, submitted):
+    started = time.time()
+    result = fn(*args)
+    return result, started - submitted, time.time() - started
+
+
+class IngestExecutor:
+    ENDPOINTS = ('upload_excel', 'commit_upload_plan', 'finalize_resumable_upload')
+
+    def __init__(self, mode='process', processes=1, max_per_worker=1, nice=10, idle_seconds=300,
+                 retry_after=10, preload=('app', 'pandas', 'openpyxl')):
+        if mode not in MODES:
+            raise ValueError(f"INGEST_MODE must be one of {', '.join(MODES)}, got {mode!r}")
+        self.mode = mode
+        self.processes = max(1, int(processes))
+        self.max_per_worker = max(1, int(max_per_worker))
+        self.nice = int(nice)
+        self.idle_seconds = float(idle_seconds)
+        self.retry_after = int(retry_after)
+        self.preload = tuple(preload)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+        self._slots = None
+        self._idle_timer = None
+        self._busy = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            mode=(os.getenv('INGEST_MODE') or 'process').strip().lower(),
+            processes=int(os.getenv('INGEST_PROCESSES', '1')),
+            max_per_worker=int(os.getenv('INGEST_MAX_PER_WORKER', '1')),
+            nice=int(os.getenv('INGEST_NICE', '10')),
+            idle_seconds=float(os.getenv('INGEST_IDLE_SECONDS', '300')),
+            retry_after=int(os.getenv('INGEST_RETRY_AFTER_SECONDS', '10')),
+        )
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+        app.extensions['ingest_executor'] = self
+
+    def settings(self):
+        return {
+            'mode': self.mode,
+            'processes': self.processes,
+            'max_per_worker': self.max_per_worker,
+            'pool_running': self._pool is not None and self._pid == os.getpid(),
+        }
+
+    def use_inline(self, backend_name=None):
+        """Memory backends live in this process only, so jobs must run here."""
+        if self.mode == 'inline':
+            return True
+        return backend_name == 'memory'
+
+    # ------------------------------------------------------------------
+    # Per-worker admission (keeps threads free for reads)
+    # ------------------------------------------------------------------
+    def _worker_slots(self):
+        # Rebuilt after fork: a semaphore copied from the master may be held
+        if self._slots is None or self._pid != os.getpid():
+            with self._lock:
+                if self._slots is None or self._pid != os.getpid():
+                    self._slots = threading.BoundedSemaphore(self.max_per_worker)
+                    self._pool = None
+                    self._idle_timer = None
+                    self._busy = 0
+                    self._pid = os.getpid()
+        return self._slots
+
+    def _before_request(self):
+        if request.endpoint not in self.ENDPOINTS or request.method != 'POST':
+            return None
+        slots = self._worker_slots()
+        if not slots.acquire(blocking=False):
+            registry.counter('ingest.rejected').inc()
+            response = jsonify({'success': False, 'retry_after': self.retry_after,
+                                'message': 'The server is busy processing another upload. Please retry in a few seconds.'})
+            response.status_code = 429
+            response.headers['Retry-After'] = str(max(1, int(math.ceil(self.retry_after))))
+            return response
+        g._ingest_slot = slots
+        return None
+
+    def _teardown_request(self, exc):
+        slots = g.pop('_ingest_slot', None)
+        if slots is not None:
+            slots.release()
+
+    # ------------------------------------------------------------------
+    # Job execution
+    # ------------------------------------------------------------------
+    def _get_pool(self):
+        self._worker_slots()
+        with self._lock:
+            if self._idle_timer is not None:
+                self._idle_timer.cancel()
+                self._idle_timer = None
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_ingest_process,
+                    initargs=(self.nice, self.preload),
+                )
+                registry.counter('ingest.pool_starts').inc()
+                logger.info(f"Worker {os.getpid()} started {self.processes} ingestion process(es)")
+            self._busy += 1
+            return self._pool
+
+    def _job_done(self, pool, broken=False):
+        with self._lock:
+            self._busy -= 1
+            if broken and self._pool is pool:
+                self._pool = None
+                pool.shutdown(wait=False, cancel_futures=True)
+                return
+            if self._busy == 0 and self._pool is pool and self.idle_seconds > 0:
+                self._idle_timer = threading.Timer(self.idle_seconds, self._shutdown_if_idle, args=(pool,))
+                self._idle_timer.daemon = True
+                self._idle_timer.start()
+
+    def _shutdown_if_idle(self, pool):
+        with self._lock:
+            if self._busy or self._pool is not pool:
+                return
+            self._pool = None
+            self._idle_timer = None
+        pool.shutdown(wait=True)
+        logger.info(f"Worker {os.getpid()} stopped idle ingestion process(es)")
+
+    def run(self, fn, *args, backend_name=None):
+        """Run fn(*args) in the ingestion pool (or inline) and return its result.
+
+        `fn` must be a module-level function and its arguments and result
+        picklable. Exceptions raised by fn are re-raised here.
+        """
+        registry.counter('ingest.jobs').inc()
+        in_flight = registry.gauge('ingest.in_flight')
+        in_flight.inc()
+        try:
+            if self.use_inline(backend_name):
+                with registry.timer('ingest.job').time():
+                    return fn(*args)
+
+            pool = self._get_pool()
+            broken = False
+            try:
+                future = pool.submit(_timed_call, fn, args, time.time())
+                result, waited, took = future.result()
+            except BrokenProcessPool:
+                broken = True
+                registry.counter('ingest.pool_errors').inc()
+                raise
+            finally:
+                self._job_done(pool, broken)
+            registry.timer('ingest.queue_wait').observe(max(0.0, waited))
+            registry.timer('ingest.job').observe(took)
+            return result
+        finally:
+            in_flight.dec()
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+            if self._idle_timer is not None:
+                self._idle_timer.cancel()
+                self._idle_timer = None
+        if pool is not None and self._pid == os.getpid():
+            pool.shutdown(wait=True)
@@ -0,0 +1,387 @@
+"""
+Write-ahead journal for upload writes, with a background retrier.
+
+When Supabase hiccups mid-upload, the rows that failed used to be reported as
+errors and the only way to recover them was to upload the whole sheet again.
+Now update_database journals its classified rows in batches of
+INGEST_JOURNAL_BATCH_ROWS before writing them:
+
+  - a batch whose rows were all written is marked done (its rows dropped)
+  - rows that failed with a transient error (connection errors, timeouts,
+    429/5xx, lock and connection-limit errors; repository.is_transient_error)
+    stay in the batch, which becomes pending with a retry time
+  - rows that failed for any other reason are reported to the admin as before
+
+One retrier thread per gunicorn worker claims due pending batches (a claim is
+a single UPDATE, so a batch goes to one worker) and replays them through the
+app's callback, which classifies the rows again against a fresh read and
+writes them; replays are idempotent, since a row that made it in before the
+failure is updated rather than inserted twice. Failed attempts back off
+exponentially with jitter: INGEST_RETRY_BASE_SECONDS (default 5) doubled per
+attempt up to INGEST_RETRY_MAX_SECONDS (default 600). After
+INGEST_RETRY_MAX_ATTEMPTS (default 8) the batch is marked failed and kept for
+the admin, who can queue it again (/api/admin/ingest-journal). A batch left
+`writing` by a process that died is taken over after INGEST_RETRY_LEASE_SECONDS
+(default 600); while a process is still writing a batch (a long upload, a
+throttled scheduler run, a slow replay) a heartbeat thread renews its lease
+every third of that (holding()), and complete() ignores a batch whose lease
+went to another process.
+
+The journal is a SQLite file in INGEST_JOURNAL_DIR (WAL, synchronous=NORMAL:
+commits survive a crashed process), shared by the workers and the ingestion
+processes on the host. Done batches are deleted after
+INGEST_JOURNAL_RETENTION_SECONDS (default 7 days). INGEST_JOURNAL_ENABLED=false
+turns it off: failed rows are then only reported, as before.
+"""
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import registry
+
+logger = logging.getLogger('upload_logger')
+
+PENDING, WRITING, DONE, FAILED = 'pending', 'writing', 'done', 'failed'
+STATES = (PENDING, WRITING, DONE, FAILED)
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS batches (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  upload_id TEXT NOT NULL,
+  state TEXT NOT NULL,
+  rows TEXT,
+  row_count INTEGER NOT NULL,
+  attempts INTEGER NOT NULL DEFAULT 0,
+  next_attempt REAL,
+  last_error TEXT,
+  owner INTEGER,
+  created REAL NOT NULL,
+  updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS batches_state ON batches (state, next_attempt);
+CREATE INDEX IF NOT EXISTS batches_upload ON batches (upload_id);
+'''
+
+
+def _env_bool(name, default=False):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+class IngestJournal:
+    """SQLite journal of upload batches and the retrier replaying the failed ones."""
+
+    def __init__(self, path, enabled=True, batch_rows=200, max_attempts=8, base_delay=5.0, max_delay=600.0,
+                 poll_seconds=10.0, lease_seconds=600.0, retention_seconds=7 * 86400):
+        self.path = path
+        self.enabled = enabled
+        self.batch_rows = max(1, int(batch_rows))
+        self.max_attempts = max(1, int(max_attempts))
+        self.base_delay = float(base_delay)
+        self.max_delay = float(max_delay)
+        self.poll_seconds = float(poll_seconds)
+        self.lease_seconds = float(lease_seconds)
+        self.retention_seconds = float(retention_seconds)
+        self.replay = None
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._thread_pid = None
+
+    @classmethod
+    def from_env(cls, default_dir):
+        return cls(
+            path=os.path.join(os.getenv('INGEST_JOURNAL_DIR', default_dir), 'journal.sqlite3'),
+            enabled=_env_bool('INGEST_JOURNAL_ENABLED', True),
+            batch_rows=int(os.getenv('INGEST_JOURNAL_BATCH_ROWS', '200')),
+            max_attempts=int(os.getenv('INGEST_RETRY_MAX_ATTEMPTS', '8')),
+            base_delay=float(os.getenv('INGEST_RETRY_BASE_SECONDS', '5')),
+            max_delay=float(os.getenv('INGEST_RETRY_MAX_SECONDS', '600')),
+            poll_seconds=float(os.getenv('INGEST_RETRY_POLL_SECONDS', '10')),
+            lease_seconds=float(os.getenv('INGEST_RETRY_LEASE_SECONDS', '600')),
+            retention_seconds=float(os.getenv('INGEST_JOURNAL_RETENTION_SECONDS', str(7 * 86400))),
+        )
+
+    def init_app(self, app, replay):
+        """`replay(rows)` writes journaled rows and returns (rows to retry, rejected rows, error text)."""
+        self.replay = replay
+        app.extensions['ingest_journal'] = self
+        if self.enabled:
+            app.before_request(self.ensure_retrier)
+
+    def settings(self):
+        return {
+            'enabled': self.enabled,
+            'batch_rows': self.batch_rows,
+            'max_attempts': self.max_attempts,
+            'retrier_running': self._thread is not None and self._thread_pid == os.getpid(),
+        }
+
+    def _connection(self):
+        # One connection per process; reopened after fork
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # Unlike rate-limit buckets, journaled rows must survive a crash
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(_SCHEMA)
+            self._conn, self._pid, self._lock = conn, os.getpid(), threading.Lock()
+        return self._conn
+
+    def _backoff(self, attempts):
+        delay = min(self.max_delay, self.base_delay * (2 ** max(0, attempts - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+    # ------------------------------------------------------------------
+    # Write path
+    # ------------------------------------------------------------------
+    def split(self, items):
+        """Cut an upload's planned writes into journal batches."""
+        return [items[i:i + self.batch_rows] for i in range(0, len(items), self.batch_rows)]
+
+    def begin(self, upload_id, batches):
+        """Journal an upload's batches (lists of rows) as being written by this process; returns their ids."""
+        if not self.enabled:
+            return [None] * len(batches)
+        now = time.time()
+        conn = self._connection()
+        ids = []
+        with self._lock:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                for rows in batches:
+                    cursor = conn.execute(
+                        'INSERT INTO batches (upload_id, state, rows, row_count, attempts, owner, created, updated) '
+                        'VALUES (?, ?, ?, ?, 1, ?, ?, ?)',
+                        (upload_id, WRITING, json.dumps(rows, ensure_ascii=False), len(rows), os.getpid(), now, now))
+                    ids.append(cursor.lastrowid)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        registry.counter('journal.batches').inc(len(ids))
+        return ids
+
+    def complete(self, batch_id, retry_rows=(), rejected_rows=(), error=None):
+        """Record a batch attempt: done, pending again with `retry_rows`, or failed after the last attempt.
+
+        Rejected rows (permanent errors during a replay) are kept as a separate failed batch.
+        """
+        if batch_id is None:
+            return
+        now = time.time()
+        conn = self._connection()
+        with self._lock:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute('SELECT upload_id, attempts, state, owner FROM batches WHERE id = ?',
+                                   (batch_id,)).fetchone()
+                if row is None:
+                    conn.execute('ROLLBACK')
+                    return
+                upload_id, attempts, state, owner = row
+                if state != WRITING or owner != os.getpid():
+                    # The lease ran out and another process took the batch over; its outcome counts
+                    conn.execute('ROLLBACK')
+                    registry.counter('journal.lease_lost').inc()
+                    logger.warning(f"Journal batch {batch_id} of upload {upload_id} was taken over "
+                                   f"(now {state}); not recording this attempt")
+                    return
+                if not retry_rows:
+                    conn.execute('UPDATE batches SET state = ?, rows = NULL, owner = NULL, last_error = ?, updated = ? '
+                                 'WHERE id = ?', (DONE, error, now, batch_id))
+                elif attempts >= self.max_attempts:
+                    conn.execute('UPDATE batches SET state = ?, rows = ?, row_count = ?, owner = NULL, last_error = ?, '
+                                 'updated = ? WHERE id = ?',
+                                 (FAILED, json.dumps(list(retry_rows), ensure_ascii=False), len(retry_rows), error, now,
+                                  batch_id))
+                    registry.counter('journal.failed').inc()
+                    logger.error(f"Journal batch {batch_id} of upload {upload_id} failed after {attempts} attempts: {error}")
+                else:
+                    conn.execute('UPDATE batches SET state = ?, rows = ?, row_count = ?, owner = NULL, last_error = ?, '
+                                 'next_attempt = ?, updated = ? WHERE id = ?',
+                                 (PENDING, json.dumps(list(retry_rows), ensure_ascii=False), len(retry_rows), error,
+                                  now + self._backoff(attempts), now, batch_id))
+                    registry.counter('journal.retries_scheduled').inc()
+                if rejected_rows:
+                    conn.execute('INSERT INTO batches (upload_id, state, rows, row_count, attempts, last_error, created, '
+                                 'updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                 (upload_id, FAILED, json.dumps(list(rejected_rows), ensure_ascii=False),
+                                  len(rejected_rows), attempts, error, now, now))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+
+    def renew(self, batch_ids):
+        """Extend the lease on the batches this process is still writing."""
+        batch_ids = [batch_id for batch_id in batch_ids if batch_id is not None]
+        if not batch_ids:
+            return
+        conn = self._connection()
+        with self._lock:
+            conn.execute(f"UPDATE batches SET updated = ? WHERE id IN ({', '.join('?' * len(batch_ids))}) "
+                         'AND state = ? AND owner = ?', [time.time()] + batch_ids + [WRITING, os.getpid()])
+
+    @contextmanager
+    def holding(self, batch_ids):
+        """Renew the lease on `batch_ids` from a heartbeat thread until the block exits."""
+        batch_ids = [batch_id for batch_id in batch_ids if batch_id is not None]
+        if not batch_ids:
+            yield
+            return
+        stop = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(self.lease_seconds / 3):
+                try:
+                    self.renew(batch_ids)
+                except Exception as e:
+                    logger.warning(f"Journal lease renewal failed: {str(e)}")
+
+        thread = threading.Thread(target=heartbeat, name='journal-lease', daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    # ------------------------------------------------------------------
+    # Retrier
+    # ------------------------------------------------------------------
+    def ensure_retrier(self):
+        # One thread per worker process; started again after fork
+        if not self.enabled or self.replay is None:
+            return
+        if self._thread is not None and self._thread_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread_pid == os.getpid():
+                return
+            self._thread_pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='ingest-retrier', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.poll_seconds * random.uniform(0.8, 1.2))
+            try:
+                self.retry_due()
+            except Exception as e:
+                logger.warning(f"Journal retrier error: {str(e)}")
+
+    def claim_due(self, limit=1):
+        """Take up to `limit` due pending batches (or abandoned writing ones); returns [(id, upload id, rows)]."""
+        now = time.time()
+        conn = self._connection()
+        with self._lock:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                rows = conn.execute(
+                    'SELECT id, upload_id, rows FROM batches '
+                    'WHERE (state = ? AND next_attempt <= ?) OR (state = ? AND updated < ?) '
+                    'ORDER BY id LIMIT ?',
+                    (PENDING, now, WRITING, now - self.lease_seconds, limit)).fetchall()
+                for batch_id, _, _ in rows:
+                    conn.execute('UPDATE batches SET state = ?, attempts = attempts + 1, owner = ?, updated = ? '
+                                 'WHERE id = ?', (WRITING, os.getpid(), now, batch_id))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        return [(batch_id, upload_id, json.loads(data or '[]')) for batch_id, upload_id, data in rows]
+
+    def retry_due(self, limit=10):
+        """Replay due batches one at a time; returns how many were replayed."""
+        replayed = 0
+        while replayed < limit:
+            claimed = self.claim_due(1)
+            if not claimed:
+                break
+            batch_id, upload_id, rows = claimed[0]
+            registry.counter('journal.replays').inc()
+            try:
+                with self.holding([batch_id]):
+                    retry_rows, rejected_rows, error = self.replay(rows)
+            except Exception as e:
+                retry_rows, rejected_rows, error = rows, [], str(e)
+            self.complete(batch_id, retry_rows, rejected_rows, error)
+            logger.info(f"Journal replay of batch {batch_id} (upload {upload_id}): "
+                        f"{len(rows) - len(retry_rows) - len(rejected_rows)} written, {len(retry_rows)} to retry, "
+                        f"{len(rejected_rows)} rejected")
+            replayed += 1
+        self.prune()
+        return replayed
+
+    # ------------------------------------------------------------------
+    # Admin
+    # ------------------------------------------------------------------
+    def summary(self, upload_id=None, recent=20):
+        """Batch and row counts per state, plus the most recent failed and pending batches."""
+        conn = self._connection()
+        where, params = ('WHERE upload_id = ?', [upload_id]) if upload_id else ('', [])
+        with self._lock:
+            counts = conn.execute(f'SELECT state, COUNT(*), COALESCE(SUM(row_count), 0) FROM batches {where} '
+                                  'GROUP BY state', params).fetchall()
+            batches = conn.execute(
+                'SELECT id, upload_id, state, row_count, attempts, next_attempt, last_error, updated FROM batches '
+                f"WHERE state IN (?, ?, ?){' AND upload_id = ?' if upload_id else ''} ORDER BY id DESC LIMIT ?",
+                [PENDING, WRITING, FAILED] + params + [int(recent)]).fetchall()
+        by_state = {state: {'batches': 0, 'rows': 0} for state in STATES}
+        for state, batch_count, row_count in counts:
+            by_state[state] = {'batches': batch_count, 'rows': row_count}
+        return {
+            **by_state,
+            'batches': [{
+                'id': batch_id,
+                'upload_id': upload,
+                'state': state,
+                'rows': row_count,
+                'attempts': attempts,
+                'next_attempt': next_attempt if state == PENDING else None,
+                'last_error': last_error,
+                'updated': updated,
+            } for batch_id, upload, state, row_count, attempts, next_attempt, last_error, updated in batches],
+        }
+
+    def pending_rows(self, upload_id):
+        """Rows of an upload still waiting for a retry."""
+        if not self.enabled:
+            return 0
+        conn = self._connection()
+        with self._lock:
+            row = conn.execute('SELECT COALESCE(SUM(row_count), 0) FROM batches WHERE upload_id = ? AND state IN (?, ?)',
+                               (upload_id, PENDING, WRITING)).fetchone()
+        return row[0]
+
+    def requeue(self, batch_ids=None):
+        """Queue failed batches (all, or the given ids) for another round of attempts; returns the count."""
+        now = time.time()
+        conn = self._connection()
+        query = 'UPDATE batches SET state = ?, attempts = 0, next_attempt = ?, updated = ? WHERE state = ?'
+        params = [PENDING, now, now, FAILED]
+        if batch_ids is not None:
+            ids = [int(i) for i in batch_ids]
+            if not ids:
+                return 0
+            query += f" AND id IN ({','.join('?' * len(ids))})"
+            params += ids
+        with self._lock:
+            return conn.execute(query, params).rowcount
+
+    def prune(self):
+        conn = self._connection()
+        with self._lock:
+            conn.execute('DELETE FROM batches WHERE state = ? AND updated < ?',
+                         (DONE, time.time() - self.retention_seconds))
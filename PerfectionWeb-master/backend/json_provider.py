@@ -0,0 +1,68 @@
+"""
+JSON provider using orjson when it is installed.
+
+Flask's default provider goes through the stdlib json module and escapes
+every Arabic character as \\uXXXX. FastJSONProvider serializes with orjson
+(sorted keys, UTF-8 output) and hands the bytes straight to the response.
+Types orjson does not handle natively, and datetimes (which Flask renders as
+HTTP dates), go through Flask's usual `default` hook, so responses carry the
+same values as before.
+
+JSON_ENCODER=auto (default) uses orjson if importable, `stdlib` forces the
+stdlib encoder.
+"""
+import os
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+_ORJSON_OPTIONS = 0
+if orjson is not None:
+    _ORJSON_OPTIONS = (orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+                       | orjson.OPT_PASSTHROUGH_DATETIME)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    # stdlib fallback output is UTF-8 too, so the engines only differ in speed
+    ensure_ascii = False
+
+    def __init__(self, app):
+        super().__init__(app)
+        setting = (os.getenv('JSON_ENCODER') or 'auto').lower()
+        self.engine = 'orjson' if (orjson is not None and setting != 'stdlib') else 'stdlib'
+
+    def _orjson_dumps(self, obj, indent=False):
+        option = _ORJSON_OPTIONS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, default=self.default, option=option)
+
+    def dumps(self, obj, **kwargs):
+        # Custom encoders/separators are only understood by the stdlib
+        if self.engine == 'orjson' and set(kwargs) <= {'indent'}:
+            try:
+                return self._orjson_dumps(obj, indent=bool(kwargs.get('indent'))).decode('utf-8')
+            except TypeError:
+                pass  # e.g. integers over 64 bits
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if self.engine == 'orjson' and not kwargs:
+            try:
+                return orjson.loads(s)
+            except orjson.JSONDecodeError:
+                pass  # let the stdlib raise its usual error (or accept NaN/Infinity)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        if self.engine != 'orjson':
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        try:
+            body = self._orjson_dumps(obj, indent=indent)
+        except TypeError:
+            return super().response(*args, **kwargs)
+        return self._app.response_class(body + b'\n', mimetype=self.mimetype)
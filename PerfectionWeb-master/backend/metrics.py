@@ -0,0 +1,118 @@
+"""
+Minimal in-process metrics registry.
+
+Counters, gauges and timers are kept per gunicorn worker and exposed as JSON by
+GET /api/admin/metrics (admin token; each response carries the worker pid, so scrape
+several times or aggregate per pid).
+"""
+import os
+import threading
+import time
+
+
+class Counter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+        self.max = 0
+
+    def set(self, value):
+        with self._lock:
+            self.value = value
+            self.max = max(self.max, value)
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+            self.max = max(self.max, self.value)
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def snapshot(self):
+        return {'value': self.value, 'max': self.max}
+
+
+class Timer:
+    """Count, total, mean and max of observed durations in milliseconds."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, seconds):
+        ms = seconds * 1000.0
+        with self._lock:
+            self.count += 1
+            self.total_ms += ms
+            self.max_ms = max(self.max_ms, ms)
+
+    def time(self):
+        return _TimerContext(self)
+
+    def snapshot(self):
+        mean = self.total_ms / self.count if self.count else 0.0
+        return {'count': self.count, 'total_ms': round(self.total_ms, 3),
+                'mean_ms': round(mean, 3), 'max_ms': round(self.max_ms, 3)}
+
+
+class _TimerContext:
+    def __init__(self, timer):
+        self.timer = timer
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.observe(time.perf_counter() - self.start)
+        return False
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _get(self, name, cls):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls()
+            return metric
+
+    def counter(self, name):
+        return self._get(name, Counter)
+
+    def gauge(self, name):
+        return self._get(name, Gauge)
+
+    def timer(self, name):
+        return self._get(name, Timer)
+
+    def snapshot(self):
+        with self._lock:
+            items = list(self._metrics.items())
+        return {
+            'pid': os.getpid(),
+            'metrics': {name: metric.snapshot() for name, metric in sorted(items)},
+        }
+
+
+registry = Registry()
@@ -0,0 +1,54 @@
+-- Migration: persisted month column for session_records
+-- /api/parent/sessions/months calls parent_session_months() below instead of
+-- downloading every record of a parent and parsing its timestamps.
+--
+-- Run the steps in order in the Supabase SQL editor. Step 3 can also be done in
+-- batches from the backend with `python month_backfill.py`.
+
+-- 1. Column (already present on most installations)
+ALTER TABLE session_records
+ADD COLUMN IF NOT EXISTS month INTEGER;
+
+-- 2. Fill in month on every insert/update that leaves it empty
+--    (same rule as the backend: finish_time, else start_time)
+CREATE OR REPLACE FUNCTION set_session_records_month()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.month IS NULL THEN
+        NEW.month = EXTRACT(MONTH FROM COALESCE(NEW.finish_time, NEW.start_time) AT TIME ZONE 'UTC')::INTEGER;
+    END IF;
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+DROP TRIGGER IF EXISTS set_session_records_month ON session_records;
+CREATE TRIGGER set_session_records_month
+BEFORE INSERT OR UPDATE ON session_records
+FOR EACH ROW
+EXECUTE FUNCTION set_session_records_month();
+
+-- 3. Backfill existing rows
+UPDATE session_records
+SET month = EXTRACT(MONTH FROM COALESCE(finish_time, start_time) AT TIME ZONE 'UTC')::INTEGER
+WHERE month IS NULL
+  AND COALESCE(finish_time, start_time) IS NOT NULL;
+
+-- 4. Index covering the months lookup (parent, optionally student)
+CREATE INDEX IF NOT EXISTS idx_session_records_parent_student_month
+ON session_records(parent_no, student_name, month);
+
+-- 5. Distinct months of a parent's records, called through PostgREST RPC
+CREATE OR REPLACE FUNCTION parent_session_months(p_parent_no TEXT, p_student_name TEXT DEFAULT NULL)
+RETURNS TABLE (month INTEGER) AS $$
+    SELECT DISTINCT s.month
+    FROM session_records s
+    WHERE s.parent_no = p_parent_no
+      AND (p_student_name IS NULL OR s.student_name = p_student_name)
+      AND s.month IS NOT NULL
+    ORDER BY 1;
+$$ LANGUAGE sql STABLE;
+
+GRANT EXECUTE ON FUNCTION parent_session_months(TEXT, TEXT) TO anon, authenticated, service_role;
+
+-- Make the new function visible to PostgREST right away
+NOTIFY pgrst, 'reload schema';
@@ -0,0 +1,19 @@
+-- Migration: indexes for ordered, paginated /api/parent/sessions
+-- The endpoint reads a parent's records newest upload first:
+--   ORDER BY created_at DESC, session_number DESC, id DESC
+-- optionally filtered by student_name, with keyset pagination on the same
+-- three columns. These indexes return the rows in that order without a sort.
+--
+-- On a busy database run each statement by itself with CREATE INDEX CONCURRENTLY
+-- (not inside a transaction).
+
+-- One student of a parent (the dashboard's default view)
+CREATE INDEX IF NOT EXISTS idx_session_records_parent_student_created
+ON session_records(parent_no, student_name, created_at DESC, session_number DESC, id DESC);
+
+-- All students of a parent
+CREATE INDEX IF NOT EXISTS idx_session_records_parent_created
+ON session_records(parent_no, created_at DESC, session_number DESC, id DESC);
+
+-- Superseded by the two indexes above for these queries; keep it if other tools filter on parent_no alone
+-- DROP INDEX IF EXISTS idx_session_records_parent_no;
@@ -0,0 +1,40 @@
+-- Migration: delta sync support for /api/parent/sessions/changes
+-- The endpoint returns a parent's rows with updated_at after the client's
+-- watermark, plus the ids of rows deleted after it. Deleted ids are kept here
+-- by a trigger, whatever deletes the row (dashboard, SQL editor, backend).
+
+-- 1. Tombstones of deleted session_records
+CREATE TABLE IF NOT EXISTS session_records_tombstones (
+    id UUID PRIMARY KEY,
+    parent_no TEXT NOT NULL,
+    student_name TEXT,
+    deleted_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_session_records_tombstones_parent_deleted
+ON session_records_tombstones(parent_no, deleted_at);
+
+CREATE OR REPLACE FUNCTION record_session_records_tombstone()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO session_records_tombstones (id, parent_no, student_name, deleted_at)
+    VALUES (OLD.id, COALESCE(OLD.parent_no, ''), OLD.student_name, NOW())
+    ON CONFLICT (id) DO UPDATE SET deleted_at = EXCLUDED.deleted_at;
+    RETURN OLD;
+END;
+$$ language 'plpgsql';
+
+DROP TRIGGER IF EXISTS record_session_records_tombstone ON session_records;
+CREATE TRIGGER record_session_records_tombstone
+AFTER DELETE ON session_records
+FOR EACH ROW
+EXECUTE FUNCTION record_session_records_tombstone();
+
+-- 2. Changed rows of a parent in updated_at order
+CREATE INDEX IF NOT EXISTS idx_session_records_parent_updated
+ON session_records(parent_no, updated_at);
+
+-- 3. Housekeeping: tombstones only need to outlive SYNC_TOMBSTONE_RETENTION_DAYS
+--    (default 30); older watermarks get the full list. With pg_cron:
+-- SELECT cron.schedule('prune-session-tombstones', '0 3 * * *',
+--   $$DELETE FROM session_records_tombstones WHERE deleted_at < NOW() - INTERVAL '30 days'$$);
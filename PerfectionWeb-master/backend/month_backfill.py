@@ -0,0 +1,95 @@
+"""
+Populate session_records.month for rows stored without it.
+
+/api/parent/sessions/months reads the distinct `month` values of a parent's
+records instead of parsing every row's timestamps, so `month` has to be set on
+every row that has a finish or start time. Uploads set it (month_from_timestamps
+below); on Supabase the trigger from migration_session_records_month.sql also
+sets it for any other writer. This job fills in rows written before that:
+
+    python month_backfill.py                 # all rows without a month
+    python month_backfill.py --dry-run       # count what would change
+    python month_backfill.py --batch-size 1000
+
+It only reads rows whose month is NULL, in id order, so it can be re-run at any
+time (e.g. from cron) and resumes where the previous run left off. Rows with
+neither timestamp keep a NULL month and are reported as unresolved.
+"""
+import argparse
+import logging
+import sys
+
+from dateutil import parser as date_parser
+
+logger = logging.getLogger('upload_logger')
+
+
+def month_from_timestamps(*values):
+    """Month (1-12) of the first parseable timestamp, or None.
+
+    Callers pass finish_time then start_time; created_at is deliberately not
+    used (the upload date can be in an unrelated month).
+    """
+    for value in values:
+        if not value:
+            continue
+        try:
+            return int(date_parser.parse(str(value)).month)
+        except (ValueError, OverflowError, TypeError):
+            continue
+    return None
+
+
+def backfill_months(repo, batch_size=500, dry_run=False):
+    """Set `month` on session_records rows that lack it; returns counts."""
+    stats = {'scanned': 0, 'updated': 0, 'unresolved': 0, 'batches': 0}
+    after_id = None
+    while True:
+        rows = repo.without_month(['id', 'finish_time', 'start_time'], after_id=after_id, limit=batch_size)
+        if not rows:
+            break
+        stats['batches'] += 1
+        stats['scanned'] += len(rows)
+        after_id = rows[-1]['id']
+
+        by_month = {}
+        for r in rows:
+            month = month_from_timestamps(r.get('finish_time'), r.get('start_time'))
+            if month is None:
+                stats['unresolved'] += 1
+            else:
+                by_month.setdefault(month, []).append(r['id'])
+        # One UPDATE per month present in the batch
+        for month, ids in sorted(by_month.items()):
+            if not dry_run:
+                repo.set_month(ids, month)
+            stats['updated'] += len(ids)
+        if len(rows) < batch_size:
+            break
+    return stats
+
+
+def main(argv=None):
+    from dotenv import load_dotenv
+    from repository import create_repositories
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--dry-run', action='store_true', help='count the rows that would be updated')
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    db = create_repositories()
+    if not db:
+        print('SUPABASE_URL or SUPABASE_KEY not set', file=sys.stderr)
+        return 1
+    stats = backfill_months(db.session_records, batch_size=args.batch_size, dry_run=args.dry_run)
+    verb = 'would update' if args.dry_run else 'updated'
+    print(f"{db.backend_name}: scanned {stats['scanned']} rows without a month, {verb} {stats['updated']}, "
+          f"{stats['unresolved']} have no finish/start time")
+    logger.info(f"Month backfill ({'dry run' if args.dry_run else 'applied'}): {stats}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
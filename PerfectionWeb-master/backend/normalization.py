@@ -0,0 +1,177 @@
+"""
+Phone number and student name normalization.
+
+normalize_phone / normalize_name take one value; the *_series kernels apply
+the same rules to a whole pandas Series (a parsed column) at once, with a
+precompiled str.translate table and regexes run over the joined column
+instead of a Python call per cell. For every input the two give identical results
+(names: any value; phones: strings or None), which
+benchmarks/bench_normalize.py checks on generated data before timing them.
+
+The Unicode tables (combining marks, digit characters) are built on first
+use, so importing this module stays cheap for the web workers.
+"""
+import functools
+import re
+import sys
+import unicodedata
+
+_HARAKAT_RE = re.compile(r'[\u064B-\u0652]')
+_SPACES_RE = re.compile(r'\s+')
+
+
+def normalize_phone(phone: str) -> str:
+    """Normalize phone numbers to local format starting with '01' and 11 digits when possible.
+    Examples:
+      +201012345678 -> 01012345678
+      201012345678 -> 01012345678
+      01012345678 -> 01012345678
+      1012345678   -> 01012345678
+    """
+    if not phone:
+        return ''
+
+    # Keep only digits
+    cleaned = ''.join(ch for ch in phone if ch.isdigit())
+    if cleaned.startswith('00'):
+        cleaned = cleaned[2:]
+
+    # If it has country code 20 (Egypt), convert to local starting with 0
+    if cleaned.startswith('20') and len(cleaned) >= 11:
+        candidate = '0' + cleaned[2:]
+        if candidate.startswith('01') and len(candidate) == 11:
+            return candidate
+
+    # If it's already local 11-digit starting with 01
+    if len(cleaned) == 11 and cleaned.startswith('01'):
+        return cleaned
+
+    # If it's 10 digits starting with 1 (missing leading zero)
+    if len(cleaned) == 10 and cleaned.startswith('1'):
+        return '0' + cleaned
+
+    # As a last resort, if cleaned ends with 10 digits starting with '1', use that
+    if len(cleaned) > 11 and cleaned[-10].isdigit():
+        last10 = cleaned[-10:]
+        if last10.startswith('1'):
+            return '0' + last10
+
+    return cleaned
+
+
+def normalize_name(name: str) -> str:
+    """Normalize a person name for matching: lower-case, collapse whitespace,
+    remove common Arabic diacritics and Unicode combining marks to improve matching
+    across uploads."""
+    if not name:
+        return ''
+    try:
+        s = str(name).strip().lower()
+        # remove Arabic diacritics (harakat)
+        s = _HARAKAT_RE.sub('', s)
+        # normalize and remove combining marks
+        nfkd = unicodedata.normalize('NFKD', s)
+        s = ''.join(ch for ch in nfkd if not unicodedata.combining(ch))
+        # collapse whitespace
+        s = _SPACES_RE.sub(' ', s).strip()
+        return s
+    except Exception:
+        try:
+            return _SPACES_RE.sub(' ', str(name).strip().lower())
+        except Exception:
+            return str(name).strip().lower()
+
+
+# ----------------------------------------------------------------------
+# Series kernels
+# ----------------------------------------------------------------------
+# A column is joined into one string with NUL between cells, so lower(),
+# NFKD, translate() and the regexes each make a single pass in C over the
+# whole column instead of one Python call per cell, then it is split back.
+# NUL is not whitespace, not a digit, has no case and no decomposition and
+# is never combined with, so no rule can cross from one cell into the next.
+_SEP = '\x00'
+_SEP_SPACES_RE = re.compile(' ?\x00 ?')
+
+
+def _char_class(codepoints):
+    """Regex character class body for a sorted list of code points, as ranges."""
+    parts = []
+    start = prev = None
+    for cp in codepoints:
+        if start is None:
+            start = prev = cp
+        elif cp == prev + 1:
+            prev = cp
+        else:
+            parts.append((start, prev))
+            start = prev = cp
+    if start is not None:
+        parts.append((start, prev))
+    return ''.join(re.escape(chr(a)) if a == b else f'{re.escape(chr(a))}-{re.escape(chr(b))}' for a, b in parts)
+
+
+@functools.lru_cache(maxsize=None)
+def _combining_table():
+    # Harakat (U+064B-U+0652) are combining marks too, so one table drops both;
+    # removing them before or after NFKD leaves the same base characters
+    return {cp: None for cp in range(sys.maxunicode + 1) if unicodedata.combining(chr(cp))}
+
+
+@functools.lru_cache(maxsize=None)
+def _non_digits_re():
+    # str.isdigit() characters (Arabic-Indic digits, superscripts, ...), not just \d;
+    # the cell separator is kept
+    digits = _char_class(cp for cp in range(sys.maxunicode + 1) if chr(cp).isdigit())
+    return re.compile(f'[^{digits}{_SEP}]+')
+
+
+def _joined(cells):
+    """Join cells with the separator, or None if a cell already contains it."""
+    joined = _SEP.join(cells)
+    if joined.count(_SEP) != max(len(cells) - 1, 0):
+        return None
+    return joined
+
+
+def normalize_name_series(series):
+    """normalize_name() over a Series (or any sequence); returns a Series of str."""
+    import pandas as pd
+
+    series = pd.Series(series, dtype=object)
+    cells = [str(v) if v else '' for v in series.tolist()]
+    joined = _joined(cells)
+    if joined is None:
+        return series.map(normalize_name)
+    joined = unicodedata.normalize('NFKD', joined.lower()).translate(_combining_table())
+    # Collapse whitespace, then strip it at every cell boundary
+    joined = _SEP_SPACES_RE.sub(_SEP, _SPACES_RE.sub(' ', joined)).strip()
+    return pd.Series(joined.split(_SEP) if cells else [], index=series.index, dtype=object)
+
+
+def normalize_phone_series(series):
+    """normalize_phone() over a Series (or any sequence) of strings; returns a Series of str."""
+    import pandas as pd
+
+    series = pd.Series(series, dtype=object)
+    cells = [v or '' for v in series.tolist()]
+    joined = _joined(cells)
+    if joined is None:
+        return series.map(normalize_phone)
+    result = []
+    for cleaned in (_non_digits_re().sub('', joined).split(_SEP) if cells else []):
+        # Only digits are left, so the scalar's branches reduce to prefix and length checks
+        if cleaned[:2] == '00':
+            cleaned = cleaned[2:]
+        length = len(cleaned)
+        if length == 12 and cleaned[:3] == '201':
+            result.append('0' + cleaned[2:])
+        elif length == 11 and cleaned[:2] == '01':
+            result.append(cleaned)
+        elif length == 10 and cleaned[:1] == '1':
+            result.append('0' + cleaned)
+        elif length > 11 and cleaned[-10] == '1':
+            result.append('0' + cleaned[-10:])
+        else:
+            result.append(cleaned)
+    return pd.Series(result, index=series.index, dtype=object)
@@ -0,0 +1,263 @@
+"""
+Opt-in request profiling for slow requests.
+
+A request is profiled when either:
+  - it is picked by the sampler (PROFILE_SAMPLE_RATE) while profiling is
+    enabled; the profile is kept only if the request took longer than
+    PROFILE_THRESHOLD_MS, or
+  - an admin asks for it explicitly with the `X-Profile` header or the
+    `profile` query parameter set to PROFILE_ADMIN_KEY.
+
+Kept profiles are written to a bounded on-disk ring (PROFILE_DIR, at most
+PROFILE_MAX_FILES profiles). The ring is shared by all gunicorn workers on the
+same host; the oldest profiles are removed first.
+
+Listing and downloading profiles needs an admin token or PROFILE_ADMIN_KEY
+(see app.py). The saved request metadata leaves out PRIVATE_QUERY_PARAMS.
+
+pyinstrument is used when installed (PROFILE_ENGINE=auto/pyinstrument),
+otherwise the stdlib cProfile is used.
+"""
+import hmac
+import io
+import json
+import logging
+import os
+import random
+import re
+import time
+import uuid
+from datetime import datetime
+
+from flask import g, request
+
+logger = logging.getLogger('upload_logger')
+
+PROFILE_ID_RE = re.compile(r'^[0-9]{8}T[0-9]{6}-[0-9a-f]{8}$')
+
+# Query parameters never written to profile metadata: the admin key, parents'
+# phone numbers and bearer tokens (EventSource sends ?access_token=)
+PRIVATE_QUERY_PARAMS = ('profile', 'phone_number', 'access_token')
+
+
+def _public_query(query):
+    return {k: v for k, v in (query or {}).items() if k not in PRIVATE_QUERY_PARAMS}
+
+
+def _env_bool(name, default=False):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+class RequestProfiler:
+    """Flask hook that captures per-request profiles into a bounded ring."""
+
+    def __init__(self, directory, max_files=50, threshold_ms=1000.0, sample_rate=0.1,
+                 admin_key=None, engine='auto', enabled=False):
+        self.directory = directory
+        self.max_files = max(1, int(max_files))
+        self.threshold_ms = float(threshold_ms)
+        self.sample_rate = min(1.0, max(0.0, float(sample_rate)))
+        self.admin_key = admin_key or None
+        self.enabled = enabled
+        self.engine = self._resolve_engine(engine)
+
+    @classmethod
+    def from_env(cls, default_dir):
+        return cls(
+            directory=os.getenv('PROFILE_DIR', default_dir),
+            max_files=int(os.getenv('PROFILE_MAX_FILES', '50')),
+            threshold_ms=float(os.getenv('PROFILE_THRESHOLD_MS', '1000')),
+            sample_rate=float(os.getenv('PROFILE_SAMPLE_RATE', '0.1')),
+            admin_key=os.getenv('PROFILE_ADMIN_KEY'),
+            engine=os.getenv('PROFILE_ENGINE', 'auto'),
+            enabled=_env_bool('PROFILE_ENABLED'),
+        )
+
+    @staticmethod
+    def _resolve_engine(engine):
+        engine = (engine or 'auto').lower()
+        if engine in ('auto', 'pyinstrument'):
+            try:
+                import pyinstrument  # noqa: F401
+                return 'pyinstrument'
+            except ImportError:
+                if engine == 'pyinstrument':
+                    logger.warning("pyinstrument not installed - falling back to cProfile")
+        return 'cprofile'
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        app.extensions['request_profiler'] = self
+
+    # ------------------------------------------------------------------
+    # Request hooks
+    # ------------------------------------------------------------------
+    def key_matches(self):
+        """Whether the request carries PROFILE_ADMIN_KEY (`X-Profile` header or `?profile=`)."""
+        if not self.admin_key:
+            return False
+        flag = request.headers.get('X-Profile') or request.args.get('profile')
+        return bool(flag) and hmac.compare_digest(flag.encode(), self.admin_key.encode())
+
+    def _before_request(self):
+        forced = self.key_matches()
+        if not forced and not (self.enabled and random.random() < self.sample_rate):
+            return None
+
+        profiler = self._start()
+        if profiler is None:
+            return None
+        g._profiler = profiler
+        g._profiler_forced = forced
+        g._profiler_started = time.perf_counter()
+        return None
+
+    def _after_request(self, response):
+        profiler = g.pop('_profiler', None)
+        if profiler is None:
+            return response
+
+        elapsed_ms = (time.perf_counter() - g.pop('_profiler_started')) * 1000.0
+        forced = g.pop('_profiler_forced', False)
+        self._stop(profiler)
+
+        if forced or elapsed_ms >= self.threshold_ms:
+            try:
+                profile_id = self._save(profiler, {
+                    'method': request.method,
+                    'path': request.path,
+                    'query': _public_query(request.args),
+                    'status': response.status_code,
+                    'duration_ms': round(elapsed_ms, 2),
+                    'trigger': 'flag' if forced else 'threshold',
+                })
+                response.headers['X-Profile-Id'] = profile_id
+            except Exception as e:
+                logger.warning(f"Could not save request profile: {str(e)}")
+        return response
+
+    def _teardown_request(self, exc):
+        # Request failed before after_request ran - make sure the profiler is off
+        profiler = g.pop('_profiler', None)
+        if profiler is not None:
+            self._stop(profiler)
+
+    # ------------------------------------------------------------------
+    # Profiler engines
+    # ------------------------------------------------------------------
+    def _start(self):
+        try:
+            if self.engine == 'pyinstrument':
+                from pyinstrument import Profiler
+                profiler = Profiler(interval=0.001)
+                profiler.start()
+                return profiler
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+            return profiler
+        except (ValueError, RuntimeError) as e:
+            # Another profiler is already active in this process (e.g. on
+            # interpreters where profiling is process-wide) - skip this request.
+            logger.info(f"Request profiler not started: {str(e)}")
+            return None
+
+    def _stop(self, profiler):
+        try:
+            if self.engine == 'pyinstrument':
+                if profiler.is_running:
+                    profiler.stop()
+            else:
+                profiler.disable()
+        except Exception:
+            pass
+
+    # ------------------------------------------------------------------
+    # On-disk ring
+    # ------------------------------------------------------------------
+    def _save(self, profiler, meta):
+        os.makedirs(self.directory, exist_ok=True)
+        profile_id = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+        if self.engine == 'pyinstrument':
+            fmt = 'html'
+            with open(self._data_path(profile_id, fmt), 'w', encoding='utf-8') as f:
+                f.write(profiler.output_html())
+        else:
+            fmt = 'pstats'
+            profiler.dump_stats(self._data_path(profile_id, fmt))
+
+        meta = dict(meta, id=profile_id, format=fmt, engine=self.engine,
+                    created_at=datetime.utcnow().isoformat() + 'Z', pid=os.getpid())
+        # Metadata is written last so listings never see a half-written profile
+        with open(os.path.join(self.directory, f'{profile_id}.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+
+        self._prune()
+        logger.info(f"Captured profile {profile_id} for {meta['method']} {meta['path']} ({meta['duration_ms']}ms)")
+        return profile_id
+
+    def _data_path(self, profile_id, fmt):
+        ext = 'html' if fmt == 'html' else 'prof'
+        return os.path.join(self.directory, f'{profile_id}.{ext}')
+
+    def _prune(self):
+        metas = sorted(self._meta_files())
+        for name in metas[:-self.max_files]:
+            profile_id = name[:-len('.json')]
+            for ext in ('json', 'prof', 'html'):
+                try:
+                    os.remove(os.path.join(self.directory, f'{profile_id}.{ext}'))
+                except FileNotFoundError:
+                    pass
+
+    def _meta_files(self):
+        try:
+            return [n for n in os.listdir(self.directory) if n.endswith('.json')]
+        except FileNotFoundError:
+            return []
+
+    def list_profiles(self, limit=None):
+        """Return profile metadata, newest first."""
+        profiles = []
+        for name in sorted(self._meta_files(), reverse=True):
+            try:
+                with open(os.path.join(self.directory, name), 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                # Pruned by another worker between listdir and open
+                continue
+            # Profiles saved before PRIVATE_QUERY_PARAMS was extended may still hold them
+            meta['query'] = _public_query(meta.get('query'))
+            profiles.append(meta)
+            if limit and len(profiles) >= limit:
+                break
+        return profiles
+
+    def get_profile(self, profile_id):
+        """Return (metadata, data_path) for a stored profile, or None."""
+        if not PROFILE_ID_RE.match(profile_id or ''):
+            return None
+        try:
+            with open(os.path.join(self.directory, f'{profile_id}.json'), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        path = self._data_path(profile_id, meta.get('format'))
+        if not os.path.exists(path):
+            return None
+        return meta, path
+
+    @staticmethod
+    def render_text(path, limit=50):
+        """Render a pstats dump as text sorted by cumulative time."""
+        import pstats
+        out = io.StringIO()
+        stats = pstats.Stats(path, stream=out)
+        stats.sort_stats('cumulative').print_stats(limit)
+        return out.getvalue()
@@ -0,0 +1,359 @@
+"""
+Rate limiting and admission control shared by all gunicorn workers.
+
+Login bursts and concurrent uploads can otherwise take every gthread slot
+(4 workers x 2 threads) and starve the parent dashboard. Two mechanisms:
+
+  - Token buckets for the auth endpoints, keyed per phone number / username
+    and per client IP. Each bucket holds up to `capacity` requests and refills
+    at `capacity / period` per second.
+  - A host-wide concurrency cap for /api/upload-excel, upload plan commits and
+    resumable upload finalization (UPLOAD_MAX_CONCURRENT),
+    implemented with flock()ed slot files so a crashed worker never leaks a
+    slot.
+
+Bucket state lives in a small SQLite file under RATE_LIMIT_STATE_DIR, shared
+by the workers on one host; set RATE_LIMIT_REDIS_URL (requires the optional
+`redis` package) to share it between hosts instead.
+
+Rejected requests get 429 with a Retry-After header. Decisions are counted in
+the metrics registry under `ratelimit.*` and `uploads.*`. If the state store
+fails, requests are let through (and `ratelimit.store_errors` is counted).
+"""
+import logging
+import math
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+
+from flask import g, jsonify, request
+
+from metrics import registry
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows development machines
+    fcntl = None
+
+logger = logging.getLogger('upload_logger')
+
+_RULE_RE = re.compile(r'^\s*(\d+)\s*/\s*(\d+(?:\.\d+)?)\s*$')
+
+
+def _env_bool(name, default=False):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+class Rule:
+    """`capacity` requests per `period` seconds, written as "5/60"."""
+
+    def __init__(self, capacity, period):
+        self.capacity = int(capacity)
+        self.period = float(period)
+
+    @property
+    def rate(self):
+        return self.capacity / self.period
+
+    @classmethod
+    def parse(cls, text):
+        match = _RULE_RE.match(text or '')
+        if not match:
+            raise ValueError(f"Invalid rate limit rule: {text!r} (expected e.g. '5/60')")
+        return cls(int(match.group(1)), float(match.group(2)))
+
+    def __repr__(self):
+        return f"{self.capacity}/{self.period:g}"
+
+
+# ----------------------------------------------------------------------
+# Bucket stores
+# ----------------------------------------------------------------------
+class MemoryBucketStore:
+    """Per-process buckets (single worker, development)."""
+
+    name = 'memory'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def take(self, key, rule, cost=1.0, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (rule.capacity, now))
+            allowed, tokens, retry_after = _refill_and_take(tokens, updated, now, rule, cost)
+            self._buckets[key] = (tokens, now)
+        return allowed, retry_after
+
+
+class SQLiteBucketStore:
+    """Buckets in a SQLite file shared by all worker processes on the host."""
+
+    name = 'sqlite'
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _connection(self):
+        # One connection per process; reopened after fork
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=2.0, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # Bucket state is disposable; don't pay for durable commits
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute('CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)')
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def take(self, key, rule, cost=1.0, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            conn = self._connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+                tokens, updated = row if row else (rule.capacity, now)
+                allowed, tokens, retry_after = _refill_and_take(tokens, updated, now, rule, cost)
+                conn.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)', (key, tokens, now))
+                if random.random() < 0.01:
+                    # Buckets idle for an hour are full again; drop them
+                    conn.execute('DELETE FROM buckets WHERE updated < ?', (now - 3600,))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        return allowed, retry_after
+
+
+class RedisBucketStore:
+    """Buckets in Redis (or a Redis-compatible server), shared between hosts."""
+
+    name = 'redis'
+
+    _SCRIPT = """
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+    local capacity = tonumber(ARGV[1])
+    local rate = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local cost = tonumber(ARGV[4])
+    local tokens = tonumber(state[1]) or capacity
+    local updated = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+    local allowed = 0
+    if tokens >= cost then
+      tokens = tokens - cost
+      allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+    return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, url):
+        import redis
+
+        self._client = redis.Redis.from_url(url)
+        self._take = self._client.register_script(self._SCRIPT)
+
+    def take(self, key, rule, cost=1.0, now=None):
+        now = time.time() if now is None else now
+        allowed, tokens = self._take(keys=[f'ratelimit:{key}'], args=[rule.capacity, rule.rate, now, cost])
+        retry_after = 0.0 if allowed else (cost - float(tokens)) / rule.rate
+        return bool(allowed), retry_after
+
+
+def _refill_and_take(tokens, updated, now, rule, cost):
+    tokens = min(rule.capacity, tokens + max(0.0, now - updated) * rule.rate)
+    if tokens >= cost:
+        return True, tokens - cost, 0.0
+    return False, tokens, (cost - tokens) / rule.rate
+
+
+# ----------------------------------------------------------------------
+# Concurrency slots
+# ----------------------------------------------------------------------
+class SlotPool:
+    """At most `limit` holders across all processes on the host.
+
+    Each slot is a lock file; a holder keeps it flock()ed until release, and
+    the OS drops the lock if the process dies. Falls back to a per-process
+    semaphore where fcntl is unavailable.
+    """
+
+    def __init__(self, directory, name, limit):
+        self.directory = directory
+        self.name = name
+        self.limit = max(1, int(limit))
+        self._local = threading.BoundedSemaphore(self.limit) if fcntl is None else None
+
+    def try_acquire(self):
+        """Return a slot handle or None when all slots are taken."""
+        if self._local is not None:
+            return 'local' if self._local.acquire(blocking=False) else None
+        os.makedirs(self.directory, exist_ok=True)
+        for i in random.sample(range(self.limit), self.limit):
+            fd = os.open(os.path.join(self.directory, f'{self.name}-{i}.lock'), os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except OSError:
+                os.close(fd)
+        return None
+
+    def release(self, handle):
+        if handle == 'local':
+            self._local.release()
+            return
+        try:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+        finally:
+            os.close(handle)
+
+
+# ----------------------------------------------------------------------
+# Flask integration
+# ----------------------------------------------------------------------
+def _phone_key(value):
+    digits = re.sub(r'\D', '', str(value or ''))
+    # Last 10 digits identify an Egyptian mobile regardless of 0 / 20 / +20 prefixes
+    return digits[-10:] if digits else None
+
+
+class RateLimiter:
+    """before/teardown request hooks applying the auth buckets and the upload cap."""
+
+    # endpoint -> (identity field in the JSON body, how to normalize it)
+    AUTH_ENDPOINTS = {
+        'login': ('phone_number', _phone_key),
+        'reset_password': ('phone_number', _phone_key),
+        'change_password': ('phone_number', _phone_key),
+        'admin_login': ('username', lambda v: (str(v or '').strip().lower() or None)),
+        'admin_change_password': ('username', lambda v: (str(v or '').strip().lower() or None)),
+    }
+    UPLOAD_ENDPOINTS = ('upload_excel', 'commit_upload_plan', 'finalize_resumable_upload')
+
+    def __init__(self, store, identity_rule, ip_rule, upload_slots=None, upload_retry_after=10,
+                 enabled=True, trust_forwarded=False, proxy_hops=1):
+        self.store = store
+        self.identity_rule = identity_rule
+        self.ip_rule = ip_rule
+        self.upload_slots = upload_slots
+        self.upload_retry_after = int(upload_retry_after)
+        self.enabled = enabled
+        self.trust_forwarded = trust_forwarded
+        # Proxies in front of the app that append to X-Forwarded-For; entries
+        # left of theirs are sent by the client and can't be trusted
+        self.proxy_hops = max(1, int(proxy_hops))
+
+    @classmethod
+    def from_env(cls, default_dir):
+        state_dir = os.getenv('RATE_LIMIT_STATE_DIR', default_dir)
+        redis_url = os.getenv('RATE_LIMIT_REDIS_URL')
+        store = None
+        if redis_url:
+            try:
+                store = RedisBucketStore(redis_url)
+            except ImportError:
+                logger.warning("RATE_LIMIT_REDIS_URL set but redis is not installed - using the local SQLite store")
+        if store is None:
+            store = SQLiteBucketStore(os.path.join(state_dir, 'buckets.sqlite3'))
+        return cls(
+            store,
+            identity_rule=Rule.parse(os.getenv('RATE_LIMIT_LOGIN_PER_ACCOUNT', '10/60')),
+            ip_rule=Rule.parse(os.getenv('RATE_LIMIT_LOGIN_PER_IP', '60/60')),
+            upload_slots=SlotPool(state_dir, 'upload', int(os.getenv('UPLOAD_MAX_CONCURRENT', '2'))),
+            upload_retry_after=int(os.getenv('UPLOAD_RETRY_AFTER_SECONDS', '10')),
+            enabled=_env_bool('RATE_LIMIT_ENABLED', True),
+            trust_forwarded=_env_bool('RATE_LIMIT_TRUST_FORWARDED', False),
+            proxy_hops=int(os.getenv('RATE_LIMIT_PROXY_HOPS', '1')),
+        )
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+        app.extensions['rate_limiter'] = self
+
+    def settings(self):
+        return {
+            'enabled': self.enabled,
+            'store': self.store.name,
+            'per_account': repr(self.identity_rule),
+            'per_ip': repr(self.ip_rule),
+            'upload_max_concurrent': self.upload_slots.limit if self.upload_slots else None,
+        }
+
+    def _client_ip(self):
+        if self.trust_forwarded:
+            # The address the outermost trusted proxy saw, like werkzeug's ProxyFix(x_for=proxy_hops)
+            forwarded = [ip.strip() for ip in request.headers.get('X-Forwarded-For', '').split(',') if ip.strip()]
+            if len(forwarded) >= self.proxy_hops:
+                return forwarded[-self.proxy_hops]
+        return request.remote_addr or 'unknown'
+
+    def _reject(self, rule_name, retry_after, message):
+        registry.counter(f'ratelimit.{rule_name}.rejected').inc()
+        retry_after = max(1, int(math.ceil(retry_after)))
+        response = jsonify({'success': False, 'message': message, 'retry_after': retry_after})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(retry_after)
+        return response
+
+    def _check(self, rule_name, key, rule):
+        try:
+            allowed, retry_after = self.store.take(key, rule)
+        except Exception as e:
+            registry.counter('ratelimit.store_errors').inc()
+            logger.warning(f"Rate limit store error, letting request through: {str(e)}")
+            return True, 0.0
+        if allowed:
+            registry.counter(f'ratelimit.{rule_name}.allowed').inc()
+        return allowed, retry_after
+
+    def _before_request(self):
+        if not self.enabled or request.method == 'OPTIONS':
+            return None
+        endpoint = request.endpoint
+
+        if endpoint in self.AUTH_ENDPOINTS:
+            field, normalize = self.AUTH_ENDPOINTS[endpoint]
+            ip = self._client_ip()
+            allowed, retry_after = self._check('ip', f'ip:{ip}', self.ip_rule)
+            if not allowed:
+                return self._reject('ip', retry_after, 'Too many attempts from this network. Please try again later.')
+            data = request.get_json(silent=True) or {}
+            identity = normalize(data.get(field))
+            if identity:
+                allowed, retry_after = self._check('account', f'{endpoint}:{identity}', self.identity_rule)
+                if not allowed:
+                    return self._reject('account', retry_after, 'Too many attempts. Please try again later.')
+            return None
+
+        if endpoint in self.UPLOAD_ENDPOINTS and self.upload_slots and request.method == 'POST':
+            handle = self.upload_slots.try_acquire()
+            if handle is None:
+                return self._reject('upload', self.upload_retry_after,
+                                    'Another upload is in progress. Please retry in a few seconds.')
+            registry.counter('uploads.admitted').inc()
+            registry.gauge('uploads.in_flight').inc()
+            g._upload_slot = handle
+        return None
+
+    def _teardown_request(self, exc):
+        handle = g.pop('_upload_slot', None)
+        if handle is not None:
+            registry.gauge('uploads.in_flight').dec()
+            try:
+                self.upload_slots.release(handle)
+            except Exception as e:
+                logger.warning(f"Could not release upload slot: {str(e)}")
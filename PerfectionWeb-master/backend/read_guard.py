@@ -0,0 +1,271 @@
+"""
+Circuit breaker, per-call budgets and last-known-good data for dashboard reads.
+
+Every parent dashboard request queries Supabase. When Supabase gets slow,
+each gthread thread waits up to SUPABASE_TIMEOUT_SECONDS for its query, the
+threads of every worker pile up behind it and the whole site times out, even
+for pages that were fine a minute ago. ReadGuard runs the read queries of the
+parent endpoints and the admin student list through:
+
+  - a small thread pool (READ_THREADS per worker, default 8) with one call in
+    flight per query key; concurrent requests for the same parent share it
+  - a budget per call (READ_BUDGET_MS, default 1500; READ_ADMIN_BUDGET_MS,
+    default 5000, for the admin queries over all rows): when it runs out and the
+    query has answered before, the request gets that last-known-good answer,
+    flagged as stale, while the call keeps going in the background and
+    refreshes the stored answer when it returns
+  - a circuit breaker: READ_BREAKER_FAILURES (default 5) failed or over-budget
+    calls in a row open it for READ_BREAKER_OPEN_SECONDS (default 30). While
+    it is open no query is sent; requests get stale data, or 503 with
+    Retry-After when there is none. Then one request probes the database, and
+    the breaker closes again if that call succeeds within its budget
+
+Without a stored answer a request waits up to READ_TIMEOUT_SECONDS (default
+SUPABASE_TIMEOUT_SECONDS) for the call. Errors other than transient ones
+(repository.is_transient_error) are raised as before and don't count against
+the breaker.
+
+Last-known-good answers are the query results (not the formatted responses),
+kept in memory per worker for up to READ_STALE_MAX_AGE_SECONDS (default
+86400), at most READ_STALE_MAX_ENTRIES (default 5000, least recently used
+dropped first). Reads from a cold worker have no stale answer to fall back on.
+
+READ_GUARD_ENABLED=false sends every query on the request thread, as before.
+Counters are under `read_guard.*` in the metrics registry.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from http_pool import PoolConfig
+from metrics import registry
+from repository import is_transient_error
+
+logger = logging.getLogger('upload_logger')
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+def _env_bool(name, default=False):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+class ReadUnavailable(Exception):
+    """The database can't be read right now and there is no stored answer to serve."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker: closed -> open for open_seconds -> one probe (half open) -> closed."""
+
+    def __init__(self, failure_threshold=5, open_seconds=30.0):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.open_seconds = float(open_seconds)
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether a call may be sent now; in half open state only one caller gets True."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def retry_after(self):
+        with self._lock:
+            if self.state != OPEN:
+                return 1
+            return max(1, int(self.open_seconds - (time.monotonic() - self.opened_at)) + 1)
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info("Read circuit breaker closed")
+            self.state, self.failures, self._probing = CLOSED, 0, False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                if self.state == CLOSED:
+                    logger.warning(f"Read circuit breaker opened after {self.failures} failed or slow reads")
+                self.state, self.opened_at, self._probing = OPEN, time.monotonic(), False
+                registry.counter('read_guard.breaker_opened').inc()
+
+    def snapshot(self):
+        with self._lock:
+            return {'state': self.state, 'failures': self.failures}
+
+
+class ReadGuard:
+    """Budgeted, single-flight reads with a circuit breaker and a last-known-good store."""
+
+    def __init__(self, enabled=True, budget=1.5, admin_budget=5.0, timeout=10.0, threads=8, failure_threshold=5,
+                 open_seconds=30.0, max_entries=5000, max_age=86400.0):
+        self.enabled = enabled
+        self.budget = float(budget)
+        self.admin_budget = float(admin_budget)
+        self.timeout = float(timeout)
+        self.threads = max(1, int(threads))
+        self.max_entries = max(1, int(max_entries))
+        self.max_age = float(max_age)
+        self.breaker = CircuitBreaker(failure_threshold, open_seconds)
+        # key -> (stored at, value), least recently used first
+        self._store = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pool_pid = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            enabled=_env_bool('READ_GUARD_ENABLED', True),
+            budget=float(os.getenv('READ_BUDGET_MS', '1500')) / 1000.0,
+            admin_budget=float(os.getenv('READ_ADMIN_BUDGET_MS', '5000')) / 1000.0,
+            timeout=float(os.getenv('READ_TIMEOUT_SECONDS', str(PoolConfig.from_env().timeout))),
+            threads=int(os.getenv('READ_THREADS', '8')),
+            failure_threshold=int(os.getenv('READ_BREAKER_FAILURES', '5')),
+            open_seconds=float(os.getenv('READ_BREAKER_OPEN_SECONDS', '30')),
+            max_entries=int(os.getenv('READ_STALE_MAX_ENTRIES', '5000')),
+            max_age=float(os.getenv('READ_STALE_MAX_AGE_SECONDS', '86400')),
+        )
+
+    def settings(self):
+        with self._lock:
+            entries, in_flight = len(self._store), len(self._in_flight)
+        return dict(self.breaker.snapshot(), enabled=self.enabled, budget_ms=round(self.budget * 1000),
+                    admin_budget_ms=round(self.admin_budget * 1000), stored_answers=entries, in_flight=in_flight)
+
+    def _executor(self):
+        # One pool per process; a new one after fork
+        if self._pool is None or self._pool_pid != os.getpid():
+            with self._lock:
+                if self._pool is None or self._pool_pid != os.getpid():
+                    self._pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='db-read')
+                    self._pool_pid = os.getpid()
+                    self._in_flight = {}
+        return self._pool
+
+    # ------------------------------------------------------------------
+    # Last-known-good store
+    # ------------------------------------------------------------------
+    def _stored(self, key):
+        with self._lock:
+            entry = self._store.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry[0] > self.max_age:
+                del self._store[key]
+                return None
+            self._store.move_to_end(key)
+            return entry
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._store[key] = (time.time(), value)
+            self._store.move_to_end(key)
+            while len(self._store) > self.max_entries:
+                self._store.popitem(last=False)
+
+    def _serve_stale(self, key, entry, reason):
+        registry.counter(f'read_guard.stale_{reason}').inc()
+        logger.warning(f"Serving stale {key[0]} data ({reason}, {int(time.time() - entry[0])}s old)")
+        return entry[1], int(time.time() - entry[0])
+
+    # ------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------
+    def _call(self, key, loader, budget):
+        """The in-flight call for key, started if there is none; returns (future, started here)."""
+        pool = self._executor()
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                return future, False
+            started = time.monotonic()
+            future = self._in_flight[key] = pool.submit(loader)
+
+        def finished(done):
+            with self._lock:
+                if self._in_flight.get(key) is done:
+                    del self._in_flight[key]
+            error = done.exception()
+            if error is None:
+                # Also the background refresh of a request that was served stale data
+                self._remember(key, done.result())
+            if time.monotonic() - started > budget:
+                # Counted by the request when its budget ran out
+                return
+            if error is not None and is_transient_error(error):
+                self.breaker.record_failure()
+            else:
+                # Answered in time (an error like a bad filter still means the database is up)
+                self.breaker.record_success()
+
+        future.add_done_callback(finished)
+        return future, True
+
+    def read(self, key, loader, budget=None):
+        """
+        loader() through the guard; returns (value, stale age in seconds or None).
+        `key` is a tuple starting with the query name; `budget` defaults to
+        READ_BUDGET_MS. Raises ReadUnavailable when the database can't answer
+        and no earlier answer is stored.
+        """
+        if not self.enabled:
+            return loader(), None
+        budget = self.budget if budget is None else float(budget)
+
+        entry = self._stored(key)
+        with self._lock:
+            joining = key in self._in_flight
+        if not joining and not self.breaker.allow():
+            if entry is not None:
+                return self._serve_stale(key, entry, 'breaker_open')
+            registry.counter('read_guard.rejected').inc()
+            raise ReadUnavailable('The database is not responding. Please try again shortly.',
+                                  retry_after=self.breaker.retry_after())
+
+        future, started = self._call(key, loader, budget)
+        if not started:
+            registry.counter('read_guard.joined').inc()
+        try:
+            return future.result(timeout=budget), None
+        except FutureTimeout:
+            registry.counter('read_guard.over_budget').inc()
+            if started:
+                # Slow calls count against the breaker even when they get through later
+                self.breaker.record_failure()
+            if entry is not None:
+                return self._serve_stale(key, entry, 'over_budget')
+        except Exception as e:
+            if entry is None or not is_transient_error(e):
+                raise
+            return self._serve_stale(key, entry, 'error')
+
+        try:
+            return future.result(timeout=max(0.0, self.timeout - budget)), None
+        except FutureTimeout:
+            registry.counter('read_guard.timeouts').inc()
+            raise ReadUnavailable('The database took too long to answer. Please try again shortly.',
+                                  retry_after=max(1, int(budget)))
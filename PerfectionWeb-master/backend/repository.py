@@ -0,0 +1,705 @@
+"""
+Data-access layer for the PerfectionWeb backend.
+
+Handlers in app.py talk to the tables (`session_records`, `parents`,
+`admins`, `lectures`, `session_records_tombstones`) through the repositories
+defined here instead of calling the Supabase client directly. Two storage backends implement the same small
+table interface:
+
+  - SupabaseBackend: the production backend (PostgREST via supabase-py)
+  - SQLiteBackend:   a local file or in-memory database with the same columns,
+                     filters and unique constraints, used for offline load
+                     testing and benchmarks
+
+The backend is picked with DATA_BACKEND (supabase | sqlite | memory); the
+SQLite file location comes from SQLITE_PATH.
+
+Filters are (column, op, value) tuples with op one of: eq, neq, gt, gte, lt,
+lte, in, is (value None only), or (columns, 'row_lt', values) comparing a tuple
+of columns as a row value, used for keyset pagination. Orderings are (column,
+descending) tuples.
+"""
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import uuid
+
+logger = logging.getLogger('upload_logger')
+
+FILTER_OPS = ('eq', 'neq', 'gt', 'gte', 'lt', 'lte', 'in', 'is', 'row_lt')
+_IDENTIFIER_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+class RepositoryError(Exception):
+    """Storage error carrying the PostgREST/Postgres style code when known."""
+
+    def __init__(self, message, code=None, details=None):
+        super().__init__(message)
+        self.message = message
+        self.code = code
+        self.details = details
+
+    def __str__(self):
+        if self.code:
+            return f"{self.message} (code {self.code})"
+        return self.message
+
+
+class DuplicateKeyError(RepositoryError):
+    """Raised when a write violates a unique constraint (Postgres 23505)."""
+
+
+# Postgres/PostgREST codes a later attempt may not hit: serialization failure,
+# deadlock, lock and statement timeouts, too many connections, connection
+# failures, database shutting down, PostgREST unable to reach the database
+TRANSIENT_CODES = {
+    '40001', '40P01', '55P03', '57014', '53300', '53400', '57P01', '57P03',
+    '08000', '08001', '08003', '08004', '08006',
+    'PGRST000', 'PGRST001', 'PGRST002', 'PGRST003',
+}
+
+
+def is_transient_error(error):
+    """True when a failed call is worth retrying later: timeouts, dropped
+    connections, HTTP 429/5xx and the TRANSIENT_CODES above."""
+    if isinstance(error, RepositoryError):
+        code = '' if error.code is None else str(error.code)
+        if code in TRANSIENT_CODES:
+            return True
+        # Non-JSON error pages (proxy 502/503/504, rate limiting) carry the HTTP status as the code
+        if code == '429' or (len(code) == 3 and code.startswith('5') and code.isdigit()):
+            return True
+        return 'rate limit' in str(error.message).lower()
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    try:
+        import httpx
+    except ImportError:
+        return False
+    return isinstance(error, httpx.TransportError)
+
+
+def _normalize_filters(where=None, filters=()):
+    result = [(col, 'eq', val) for col, val in (where or {}).items()]
+    for flt in filters or ():
+        col, op, val = flt
+        if op not in FILTER_OPS:
+            raise ValueError(f"Unsupported filter operator: {op}")
+        result.append((col, op, val))
+    return result
+
+
+# ----------------------------------------------------------------------
+# Supabase backend
+# ----------------------------------------------------------------------
+class SupabaseBackend:
+    """Table operations over a supabase-py client."""
+
+    name = 'supabase'
+
+    def __init__(self, client):
+        self.client = client
+
+    def after_fork(self):
+        """Give a forked worker its own connection pool instead of the preloaded parent's."""
+        from http_pool import PooledTransport, install_pooled_session
+        transport = getattr(self.client.postgrest.session, '_transport', None)
+        if isinstance(transport, PooledTransport):
+            install_pooled_session(self.client, transport.config)
+
+    def warm(self):
+        """Open a connection (DNS, TCP, TLS) before the first real request needs it."""
+        self.select('parents', 'phone_number', [], limit=1)
+
+    @staticmethod
+    def _wrap_error(e):
+        code = getattr(e, 'code', None)
+        message = getattr(e, 'message', None) or str(e)
+        details = getattr(e, 'details', None)
+        if code == '23505' or 'duplicate key' in str(message).lower():
+            return DuplicateKeyError(message, code or '23505', details)
+        return RepositoryError(message, code, details)
+
+    @staticmethod
+    def _quote(value):
+        # Values inside or=(...) must be quoted when they contain , . : ( ) or "
+        text = str(value)
+        if any(c in text for c in ',.:()" '):
+            return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+        return text
+
+    @classmethod
+    def _row_lt(cls, columns, values):
+        # (a, b, c) < (x, y, z)  ==  a < x OR (a = x AND b < y) OR (a = x AND b = y AND c < z)
+        terms = []
+        for i, col in enumerate(columns):
+            parts = [f'{c}.eq.{cls._quote(v)}' for c, v in zip(columns[:i], values[:i])]
+            parts.append(f'{col}.lt.{cls._quote(values[i])}')
+            terms.append(parts[0] if len(parts) == 1 else f"and({','.join(parts)})")
+        return f"({','.join(terms)})"
+
+    @classmethod
+    def _apply_filters(cls, query, filters):
+        for col, op, val in filters:
+            if op == 'row_lt':
+                query.params = query.params.add('or', cls._row_lt(col, val))
+            elif op == 'in':
+                query = query.in_(col, list(val))
+            elif op == 'is':
+                query = query.is_(col, 'null')
+            else:
+                query = getattr(query, op)(col, val)
+        return query
+
+    def _execute(self, query):
+        from postgrest.exceptions import APIError
+        try:
+            return query.execute().data or []
+        except APIError as e:
+            raise self._wrap_error(e)
+
+    def select(self, table, columns='*', filters=(), order=(), limit=None):
+        cols = [columns] if isinstance(columns, str) else list(columns)
+        query = self._apply_filters(self.client.table(table).select(*cols), filters)
+        if order:
+            # One order=a.desc,b.desc parameter; PostgREST ignores repeated ones
+            query.params = query.params.add('order', ','.join(f"{col}{'.desc' if desc else ''}" for col, desc in order))
+        if limit is not None:
+            query = query.limit(int(limit))
+        return self._execute(query)
+
+    def insert(self, table, rows):
+        return self._execute(self.client.table(table).insert(rows))
+
+    def update(self, table, values, filters):
+        return self._execute(self._apply_filters(self.client.table(table).update(values), filters))
+
+    def delete(self, table, filters):
+        return self._execute(self._apply_filters(self.client.table(table).delete(), filters))
+
+    def distinct(self, table, column, filters=()):
+        # PostgREST has no DISTINCT; only used when the database function is missing
+        rows = self.select(table, column, filters)
+        return sorted({r[column] for r in rows if r.get(column) is not None})
+
+    def rpc(self, function, params):
+        return self._execute(self.client.rpc(function, params))
+
+
+# ----------------------------------------------------------------------
+# SQLite backend
+# ----------------------------------------------------------------------
+_NOW_SQL = "(strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))"
+
+SQLITE_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS parents (
+  id TEXT PRIMARY KEY,
+  phone_number TEXT NOT NULL UNIQUE,
+  password_hash TEXT NOT NULL,
+  needs_password_reset INTEGER DEFAULT 1,
+  name TEXT,
+  created_at TEXT DEFAULT {_NOW_SQL},
+  updated_at TEXT DEFAULT {_NOW_SQL},
+  last_login TEXT
+);
+
+CREATE TABLE IF NOT EXISTS admins (
+  id TEXT PRIMARY KEY,
+  username TEXT NOT NULL UNIQUE,
+  password_hash TEXT NOT NULL,
+  name TEXT,
+  role TEXT DEFAULT 'admin',
+  created_at TEXT DEFAULT {_NOW_SQL},
+  updated_at TEXT DEFAULT {_NOW_SQL}
+);
+
+CREATE TABLE IF NOT EXISTS lectures (
+  id TEXT PRIMARY KEY,
+  unique_key TEXT NOT NULL UNIQUE,
+  lecture_name TEXT NOT NULL,
+  metadata TEXT DEFAULT '{{}}',
+  created_at TEXT DEFAULT {_NOW_SQL}
+);
+
+CREATE TABLE IF NOT EXISTS session_records (
+  id TEXT PRIMARY KEY,
+  student_id TEXT NOT NULL,
+  student_name TEXT NOT NULL,
+  parent_no TEXT NOT NULL,
+  session_number INTEGER NOT NULL CHECK (session_number >= 1 AND session_number <= 8),
+  group_name TEXT NOT NULL CHECK (group_name IN ('cam1','maimi','cam2','west','station1','station2','station3','online')),
+  is_general_exam INTEGER DEFAULT 0,
+  lecture_name TEXT,
+  exam_name TEXT,
+  quiz_mark REAL,
+  admin_quiz_mark REAL,
+  start_time TEXT,
+  finish_time TEXT,
+  month INTEGER,
+  has_exam_grade INTEGER DEFAULT 1,
+  has_payment INTEGER DEFAULT 1,
+  has_time INTEGER DEFAULT 1,
+  attendance INTEGER DEFAULT 0 CHECK (attendance IN (0,1)),
+  payment REAL DEFAULT 0,
+  homework_status INTEGER CHECK (homework_status IN (0,1,2,3)),
+  pokin REAL,
+  student_no TEXT,
+  created_at TEXT DEFAULT {_NOW_SQL},
+  updated_at TEXT DEFAULT {_NOW_SQL},
+  UNIQUE (student_name, session_number, parent_no)
+);
+
+CREATE TABLE IF NOT EXISTS session_records_tombstones (
+  id TEXT PRIMARY KEY,
+  parent_no TEXT NOT NULL,
+  student_name TEXT,
+  deleted_at TEXT DEFAULT {_NOW_SQL}
+);
+
+CREATE INDEX IF NOT EXISTS idx_parents_phone_number ON parents(phone_number);
+CREATE INDEX IF NOT EXISTS idx_admins_username ON admins(username);
+CREATE INDEX IF NOT EXISTS idx_session_records_student_name ON session_records(student_name);
+CREATE INDEX IF NOT EXISTS idx_session_records_session_group ON session_records(session_number, group_name, is_general_exam);
+CREATE INDEX IF NOT EXISTS idx_session_records_parent_no ON session_records(parent_no);
+CREATE INDEX IF NOT EXISTS idx_session_records_parent_student_month ON session_records(parent_no, student_name, month);
+CREATE INDEX IF NOT EXISTS idx_session_records_parent_student_created ON session_records(parent_no, student_name, created_at DESC, session_number DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_session_records_parent_created ON session_records(parent_no, created_at DESC, session_number DESC, id DESC);
+
+CREATE TRIGGER IF NOT EXISTS update_parents_updated_at AFTER UPDATE ON parents
+BEGIN UPDATE parents SET updated_at = {_NOW_SQL} WHERE rowid = NEW.rowid; END;
+
+CREATE TRIGGER IF NOT EXISTS update_admins_updated_at AFTER UPDATE ON admins
+BEGIN UPDATE admins SET updated_at = {_NOW_SQL} WHERE rowid = NEW.rowid; END;
+
+CREATE TRIGGER IF NOT EXISTS update_session_records_updated_at AFTER UPDATE ON session_records
+BEGIN UPDATE session_records SET updated_at = {_NOW_SQL} WHERE rowid = NEW.rowid; END;
+
+CREATE INDEX IF NOT EXISTS idx_session_records_parent_updated ON session_records(parent_no, updated_at);
+CREATE INDEX IF NOT EXISTS idx_session_records_tombstones_parent_deleted ON session_records_tombstones(parent_no, deleted_at);
+
+CREATE TRIGGER IF NOT EXISTS record_session_records_tombstone AFTER DELETE ON session_records
+BEGIN
+  INSERT OR REPLACE INTO session_records_tombstones (id, parent_no, student_name, deleted_at)
+  VALUES (OLD.id, OLD.parent_no, OLD.student_name, {_NOW_SQL});
+END;
+"""
+
+# Columns stored as INTEGER 0/1 or JSON text that must be converted back on read
+SQLITE_BOOLEAN_COLUMNS = {
+    'parents': {'needs_password_reset'},
+    'session_records': {'is_general_exam', 'has_exam_grade', 'has_payment', 'has_time'},
+}
+SQLITE_JSON_COLUMNS = {
+    'lectures': {'metadata'},
+}
+
+
+class SQLiteBackend:
+    """Table operations over a local SQLite database.
+
+    A single connection guarded by a lock is shared by all threads, so
+    `:memory:` databases are visible to every request thread of the worker.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self._lock = threading.RLock()
+        self._connect()
+        self._conn.executescript(SQLITE_SCHEMA)
+        self._columns = {}
+        for table in ('parents', 'admins', 'lectures', 'session_records', 'session_records_tombstones'):
+            self._columns[table] = [r['name'] for r in self._conn.execute(f'PRAGMA table_info({table})')]
+
+    def _connect(self):
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        if self.path != ':memory:':
+            # Several gunicorn workers may share one file during load tests
+            self._conn.execute('PRAGMA busy_timeout=10000')
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+
+    def after_fork(self):
+        """Reopen file databases in a forked worker; SQLite connections must not cross fork()."""
+        self._lock = threading.RLock()
+        if self.path != ':memory:':
+            self._connect()
+
+    def warm(self):
+        self.select('parents', 'phone_number', [], limit=1)
+
+    # -- helpers --------------------------------------------------------
+    def _check_table(self, table):
+        if table not in self._columns:
+            raise RepositoryError(f"relation \"{table}\" does not exist", '42P01')
+
+    def _check_column(self, table, col):
+        if not _IDENTIFIER_RE.match(col) or col not in self._columns[table]:
+            raise RepositoryError(f"Could not find the '{col}' column of '{table}' in the schema cache", 'PGRST204')
+
+    def _encode(self, table, col, val):
+        if col in SQLITE_JSON_COLUMNS.get(table, ()) and not isinstance(val, str) and val is not None:
+            return json.dumps(val)
+        if isinstance(val, bool):
+            return int(val)
+        return val
+
+    def _decode(self, table, row):
+        data = dict(row)
+        for col in SQLITE_BOOLEAN_COLUMNS.get(table, ()):
+            if col in data and data[col] is not None:
+                data[col] = bool(data[col])
+        for col in SQLITE_JSON_COLUMNS.get(table, ()):
+            if isinstance(data.get(col), str):
+                try:
+                    data[col] = json.loads(data[col])
+                except ValueError:
+                    pass
+        return data
+
+    def _where(self, table, filters):
+        clauses, params = [], []
+        for col, op, val in filters:
+            if op == 'row_lt':
+                for c in col:
+                    self._check_column(table, c)
+                clauses.append(f"({', '.join(col)}) < ({', '.join('?' * len(col))})")
+                params.extend(self._encode(table, c, v) for c, v in zip(col, val))
+                continue
+            self._check_column(table, col)
+            if op == 'in':
+                values = [self._encode(table, col, v) for v in val]
+                if not values:
+                    clauses.append('0')
+                    continue
+                clauses.append(f"{col} IN ({', '.join('?' * len(values))})")
+                params.extend(values)
+            elif op == 'is':
+                clauses.append(f'{col} IS NULL')
+            else:
+                sql_op = {'eq': '=', 'neq': '!=', 'gt': '>', 'gte': '>=', 'lt': '<', 'lte': '<='}[op]
+                clauses.append(f'{col} {sql_op} ?')
+                params.append(self._encode(table, col, val))
+        sql = (' WHERE ' + ' AND '.join(clauses)) if clauses else ''
+        return sql, params
+
+    def _run(self, table, sql, params, many=None):
+        with self._lock:
+            try:
+                if many is not None:
+                    rows = []
+                    self._conn.execute('BEGIN')
+                    try:
+                        for p in many:
+                            rows.extend(self._conn.execute(sql, p).fetchall())
+                        self._conn.execute('COMMIT')
+                    except Exception:
+                        self._conn.execute('ROLLBACK')
+                        raise
+                else:
+                    rows = self._conn.execute(sql, params).fetchall()
+            except sqlite3.IntegrityError as e:
+                text = str(e)
+                if 'UNIQUE' in text:
+                    raise DuplicateKeyError(f'duplicate key value violates unique constraint on "{table}": {text}', '23505')
+                if 'NOT NULL' in text:
+                    raise RepositoryError(f'null value violates not-null constraint: {text}', '23502')
+                raise RepositoryError(f'new row violates check constraint: {text}', '23514')
+            except sqlite3.OperationalError as e:
+                raise RepositoryError(str(e))
+        return [self._decode(table, r) for r in rows]
+
+    # -- table interface ------------------------------------------------
+    def select(self, table, columns='*', filters=(), order=(), limit=None):
+        self._check_table(table)
+        cols = [columns] if isinstance(columns, str) else list(columns)
+        if cols == ['*']:
+            col_sql = '*'
+        else:
+            for col in cols:
+                self._check_column(table, col)
+            col_sql = ', '.join(cols)
+        where_sql, params = self._where(table, filters)
+        order_parts = []
+        for col, desc in order or ():
+            self._check_column(table, col)
+            # Postgres puts NULLs first for DESC and last for ASC
+            order_parts.append(f"{col} IS {'NOT ' if desc else ''}NULL, {col} {'DESC' if desc else 'ASC'}")
+        order_sql = (' ORDER BY ' + ', '.join(order_parts)) if order_parts else ''
+        limit_sql = f' LIMIT {int(limit)}' if limit is not None else ''
+        return self._run(table, f'SELECT {col_sql} FROM {table}{where_sql}{order_sql}{limit_sql}', params)
+
+    def insert(self, table, rows):
+        self._check_table(table)
+        rows = [rows] if isinstance(rows, dict) else list(rows)
+        if not rows:
+            return []
+        result = []
+        # Group rows by column set so each group is one prepared statement
+        groups = {}
+        for row in rows:
+            row = dict(row)
+            row.setdefault('id', str(uuid.uuid4()))
+            groups.setdefault(tuple(row.keys()), []).append(row)
+        for cols, group in groups.items():
+            for col in cols:
+                self._check_column(table, col)
+            sql = f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))}) RETURNING *"
+            params = [[self._encode(table, c, r[c]) for c in cols] for r in group]
+            result.extend(self._run(table, sql, None, many=params))
+        return result
+
+    def update(self, table, values, filters):
+        self._check_table(table)
+        if not values:
+            return []
+        for col in values:
+            self._check_column(table, col)
+        set_sql = ', '.join(f'{col} = ?' for col in values)
+        where_sql, params = self._where(table, filters)
+        set_params = [self._encode(table, c, v) for c, v in values.items()]
+        return self._run(table, f'UPDATE {table} SET {set_sql}{where_sql} RETURNING *', set_params + params)
+
+    def delete(self, table, filters):
+        self._check_table(table)
+        where_sql, params = self._where(table, filters)
+        return self._run(table, f'DELETE FROM {table}{where_sql} RETURNING *', params)
+
+    def distinct(self, table, column, filters=()):
+        self._check_table(table)
+        self._check_column(table, column)
+        where_sql, params = self._where(table, list(filters))
+        where_sql = (where_sql + ' AND' if where_sql else ' WHERE') + f' {column} IS NOT NULL'
+        rows = self._run(table, f'SELECT DISTINCT {column} FROM {table}{where_sql} ORDER BY {column}', params)
+        return [r[column] for r in rows]
+
+
+# ----------------------------------------------------------------------
+# Repositories
+# ----------------------------------------------------------------------
+class TableRepository:
+    """Generic access to one table through a backend."""
+
+    table = None
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def select(self, columns='*', where=None, filters=(), order=(), limit=None):
+        return self.backend.select(self.table, columns, _normalize_filters(where, filters), order, limit)
+
+    def select_one(self, columns='*', where=None, filters=(), order=()):
+        rows = self.select(columns, where, filters, order, limit=1)
+        return rows[0] if rows else None
+
+    def insert(self, row):
+        rows = self.backend.insert(self.table, row)
+        return rows[0] if rows else None
+
+    def insert_many(self, rows):
+        return self.backend.insert(self.table, rows)
+
+    def update(self, values, where=None, filters=()):
+        return self.backend.update(self.table, values, _normalize_filters(where, filters))
+
+    def delete(self, where=None, filters=()):
+        return self.backend.delete(self.table, _normalize_filters(where, filters))
+
+
+class ParentsRepository(TableRepository):
+    table = 'parents'
+
+    def get_by_phone(self, phone_number):
+        return self.select_one(where={'phone_number': phone_number})
+
+    def update_by_phone(self, phone_number, values):
+        return self.update(values, where={'phone_number': phone_number})
+
+    def set_last_login(self, phone_numbers, timestamp):
+        return self.update({'last_login': timestamp}, filters=[('phone_number', 'in', list(phone_numbers))])
+
+
+class AdminsRepository(TableRepository):
+    table = 'admins'
+
+    def get_by_username(self, username):
+        return self.select_one(where={'username': username})
+
+    def update_by_username(self, username, values):
+        return self.update(values, where={'username': username})
+
+
+class LecturesRepository(TableRepository):
+    table = 'lectures'
+
+    def lecture_name_for_key(self, unique_key):
+        row = self.select_one('lecture_name', where={'unique_key': unique_key})
+        return (row or {}).get('lecture_name')
+
+
+class SessionRecordsRepository(TableRepository):
+    table = 'session_records'
+    _months_rpc_missing = False
+
+    def for_parent(self, parent_no, columns='*', student_name=None, month=None):
+        where = {'parent_no': parent_no}
+        if student_name:
+            where['student_name'] = student_name
+        if month is not None:
+            where['month'] = month
+        return self.select(columns, where=where)
+
+    def for_parents(self, parent_nos, columns='*', chunk_size=100, page_size=1000):
+        """Records of several parents, fetched with `parent_no IN (...)` in id order.
+
+        Parents are sent `chunk_size` at a time (URL length) and each chunk is
+        read in pages of `page_size` rows, below PostgREST's max-rows cap.
+        """
+        columns = [columns] if isinstance(columns, str) else list(columns)
+        if columns != ['*'] and 'id' not in columns:
+            columns.append('id')
+        parent_nos = sorted(set(parent_nos))
+        rows = []
+        for i in range(0, len(parent_nos), chunk_size):
+            chunk = parent_nos[i:i + chunk_size]
+            after_id = None
+            while True:
+                filters = [('parent_no', 'in', chunk)]
+                if after_id is not None:
+                    filters.append(('id', 'gt', after_id))
+                page = self.select(columns, filters=filters, order=[('id', False)], limit=page_size)
+                rows.extend(page)
+                if len(page) < page_size:
+                    break
+                after_id = page[-1]['id']
+        return rows
+
+    def all(self, columns='*', month=None):
+        return self.select(columns, where={'month': month} if month is not None else None)
+
+    # Newest upload first; session number and id break ties within one upload
+    NEWEST_FIRST = (('created_at', True), ('session_number', True), ('id', True))
+
+    def page_for_parent(self, parent_no, columns='*', student_name=None, month=None, limit=None, after=None):
+        """A parent's records in NEWEST_FIRST order.
+
+        `after` is the (created_at, session_number, id) of the last row of the
+        previous page; rows strictly after it are returned (keyset pagination,
+        stable while new uploads arrive).
+        """
+        where = {'parent_no': parent_no}
+        if student_name:
+            where['student_name'] = student_name
+        if month is not None:
+            where['month'] = month
+        filters = []
+        if after is not None:
+            filters.append((tuple(col for col, _ in self.NEWEST_FIRST), 'row_lt', tuple(after)))
+        return self.select(columns, where=where, filters=filters, order=self.NEWEST_FIRST, limit=limit)
+
+    def changed_since(self, parent_no, since, columns='*', student_name=None):
+        """A parent's records created or updated after `since` (ISO timestamp), oldest change first."""
+        where = {'parent_no': parent_no}
+        if student_name:
+            where['student_name'] = student_name
+        return self.select(columns, where=where, filters=[('updated_at', 'gt', since)], order=[('updated_at', False)])
+
+    def months_for_parent(self, parent_no, student_name=None):
+        """Distinct months of a parent's records (one student's if given), ascending.
+
+        On Supabase this calls the parent_session_months() database function
+        (migration_session_records_month.sql), an index-only DISTINCT; without
+        it the month column is fetched and de-duplicated here.
+        """
+        rpc = getattr(self.backend, 'rpc', None)
+        if rpc is not None and not self._months_rpc_missing:
+            try:
+                rows = rpc('parent_session_months', {'p_parent_no': parent_no, 'p_student_name': student_name or None})
+                return sorted({int(r['month']) for r in rows if r.get('month') is not None})
+            except RepositoryError as e:
+                if e.code not in ('PGRST202', '42883'):
+                    raise
+                logger.warning("parent_session_months() is not installed; run migration_session_records_month.sql")
+                self._months_rpc_missing = True
+        where = {'parent_no': parent_no}
+        if student_name:
+            where['student_name'] = student_name
+        return [int(m) for m in self.backend.distinct(self.table, 'month', _normalize_filters(where))]
+
+    def without_month(self, columns='*', after_id=None, limit=500):
+        """Records whose month is not set, in id order starting after `after_id`."""
+        filters = [('month', 'is', None)]
+        if after_id is not None:
+            filters.append(('id', 'gt', after_id))
+        return self.select(columns, filters=filters, order=[('id', False)], limit=limit)
+
+    def set_month(self, ids, month):
+        return self.update({'month': month}, filters=[('id', 'in', list(ids))])
+
+
+class TombstonesRepository(TableRepository):
+    """Ids of deleted session_records, written by a trigger on delete."""
+
+    table = 'session_records_tombstones'
+
+    def deleted_since(self, parent_no, since, student_name=None):
+        where = {'parent_no': parent_no}
+        if student_name:
+            where['student_name'] = student_name
+        return self.select(['id', 'deleted_at'], where=where, filters=[('deleted_at', 'gt', since)],
+                           order=[('deleted_at', False)])
+
+
+class Repositories:
+    """All table repositories over one backend."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.session_records = SessionRecordsRepository(backend)
+        self.parents = ParentsRepository(backend)
+        self.admins = AdminsRepository(backend)
+        self.lectures = LecturesRepository(backend)
+        self.tombstones = TombstonesRepository(backend)
+
+    @property
+    def backend_name(self):
+        return self.backend.name
+
+    def after_fork(self):
+        self.backend.after_fork()
+
+    def warm(self):
+        self.backend.warm()
+
+
+def create_repositories(backend_name=None, supabase_url=None, supabase_key=None, sqlite_path=None):
+    """Build repositories from arguments or environment.
+
+    Returns None when the Supabase backend is selected but not configured, so
+    callers can keep failing gracefully as before.
+    """
+    backend_name = (backend_name or os.getenv('DATA_BACKEND') or 'supabase').lower()
+
+    if backend_name == 'memory':
+        return Repositories(SQLiteBackend(':memory:'))
+    if backend_name == 'sqlite':
+        path = sqlite_path or os.getenv('SQLITE_PATH') or os.path.join(os.path.dirname(__file__), 'local.sqlite3')
+        return Repositories(SQLiteBackend(path))
+    if backend_name != 'supabase':
+        raise ValueError(f"Unknown DATA_BACKEND: {backend_name}")
+
+    supabase_url = supabase_url or os.getenv('SUPABASE_URL')
+    supabase_key = supabase_key or os.getenv('SUPABASE_KEY')
+    if not (supabase_url and supabase_key):
+        return None
+    from supabase import create_client
+    from http_pool import install_pooled_session
+    client = create_client(supabase_url, supabase_key)
+    # Bounded keep-alive pool with per-call timeouts shared by all threads of the worker
+    install_pooled_session(client)
+    return Repositories(SupabaseBackend(client))
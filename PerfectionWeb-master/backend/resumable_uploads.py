@@ -0,0 +1,253 @@
+"""
+Resumable uploads: a sheet sent in chunks that survive dropped connections.
+
+A single multipart POST to /api/upload-excel is limited by MAX_CONTENT_LENGTH
+and starts over when the connection drops near the end. Instead a client can
+
+  1. POST /api/uploads with the file name, size, SHA-256 and the same fields
+     as /api/upload-excel; gets an upload id and the chunk size to use
+  2. PUT /api/uploads/<id>?offset=N with raw bytes, chunk after chunk; after
+     a failure GET /api/uploads/<id> says how many bytes arrived, and the
+     client continues from that offset
+  3. POST /api/uploads/<id>/finalize once every byte is there; the file is
+     checked against the declared size and SHA-256 and handed to the same
+     ingestion job as /api/upload-excel
+
+Parts are assembled in UPLOAD_CHUNK_DIR (default uploads/chunks) on local
+disk, one `<id>.part` file with a `<id>.json` sidecar holding the upload's
+settings, so any worker on the host can take the next chunk. A chunk may
+start at any offset up to the bytes received so far (resending a chunk
+whose answer was lost is harmless); a gap is refused with 409 and the
+current offset. Chunks are streamed to disk, never held in memory, and
+writes to one upload are serialized with flock().
+
+Limits: UPLOAD_CHUNK_MAX_BYTES per chunk (default 8 MB, must stay under
+MAX_CONTENT_LENGTH), UPLOAD_RESUMABLE_MAX_BYTES per file (default 200 MB),
+UPLOAD_RESUMABLE_MAX_ACTIVE unfinished uploads on the host (default 20), and
+UPLOAD_RESUMABLE_MIN_FREE_BYTES of disk left after reserving the file
+(default 512 MB). Unfinished uploads are removed after
+UPLOAD_RESUMABLE_TTL_SECONDS without a chunk (default 86400).
+"""
+import fcntl
+import hashlib
+import json
+import os
+import re
+import secrets
+import shutil
+import time
+
+UPLOAD_ID_RE = re.compile(r'^[A-Za-z0-9_-]{22}$')
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+_COPY_BLOCK = 64 * 1024
+
+
+class ResumableUploadError(Exception):
+    """A request the upload can't accept; carries the HTTP status for the response."""
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+class ResumableUploadStore:
+    """Unfinished chunked uploads on local disk."""
+
+    def __init__(self, directory, chunk_max_bytes=8 * 1024 * 1024, max_bytes=200 * 1024 * 1024,
+                 max_active=20, min_free_bytes=512 * 1024 * 1024, ttl_seconds=86400):
+        self.directory = directory
+        self.chunk_max_bytes = int(chunk_max_bytes)
+        self.max_bytes = int(max_bytes)
+        self.max_active = int(max_active)
+        self.min_free_bytes = int(min_free_bytes)
+        self.ttl_seconds = float(ttl_seconds)
+
+    @classmethod
+    def from_env(cls, default_dir):
+        return cls(
+            directory=os.getenv('UPLOAD_CHUNK_DIR', default_dir),
+            chunk_max_bytes=int(os.getenv('UPLOAD_CHUNK_MAX_BYTES', str(8 * 1024 * 1024))),
+            max_bytes=int(os.getenv('UPLOAD_RESUMABLE_MAX_BYTES', str(200 * 1024 * 1024))),
+            max_active=int(os.getenv('UPLOAD_RESUMABLE_MAX_ACTIVE', '20')),
+            min_free_bytes=int(os.getenv('UPLOAD_RESUMABLE_MIN_FREE_BYTES', str(512 * 1024 * 1024))),
+            ttl_seconds=float(os.getenv('UPLOAD_RESUMABLE_TTL_SECONDS', '86400')),
+        )
+
+    def settings(self):
+        return {
+            'chunk_max_bytes': self.chunk_max_bytes,
+            'max_bytes': self.max_bytes,
+            'max_active': self.max_active,
+            'ttl_seconds': self.ttl_seconds,
+        }
+
+    def _paths(self, upload_id):
+        if not UPLOAD_ID_RE.match(upload_id or ''):
+            raise ResumableUploadError('Upload not found', 404)
+        base = os.path.join(self.directory, upload_id)
+        return base + '.part', base + '.json'
+
+    def _meta(self, upload_id):
+        part_path, meta_path = self._paths(upload_id)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            raise ResumableUploadError('Upload not found. It may have expired or been finished already.', 404)
+        return meta, part_path
+
+    # ------------------------------------------------------------------
+    # Protocol steps
+    # ------------------------------------------------------------------
+    def create(self, filename, size, sha256, upload):
+        """Start an upload of `size` bytes; `upload` is stored and returned by finish()."""
+        try:
+            size = int(size)
+        except (TypeError, ValueError):
+            raise ResumableUploadError('size must be the file size in bytes')
+        if size <= 0:
+            raise ResumableUploadError('size must be the file size in bytes')
+        if size > self.max_bytes:
+            raise ResumableUploadError(f'File too large: {size} bytes (limit {self.max_bytes})', 413)
+        sha256 = (sha256 or '').strip().lower()
+        if not SHA256_RE.match(sha256):
+            raise ResumableUploadError('sha256 must be the hex SHA-256 of the whole file')
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.prune()
+        if self.active_count() >= self.max_active:
+            raise ResumableUploadError('Too many unfinished uploads. Please retry later.', 429)
+        if shutil.disk_usage(self.directory).free - size < self.min_free_bytes:
+            raise ResumableUploadError('Not enough disk space for this upload. Please retry later.', 507)
+
+        upload_id = secrets.token_urlsafe(16)
+        part_path, meta_path = self._paths(upload_id)
+        meta = {'upload_id': upload_id, 'filename': filename, 'size': size, 'sha256': sha256,
+                'upload': upload, 'created': time.time()}
+        open(part_path, 'wb').close()
+        tmp = meta_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp, meta_path)
+        return self.status(upload_id)
+
+    def status(self, upload_id):
+        meta, part_path = self._meta(upload_id)
+        try:
+            received = os.path.getsize(part_path)
+        except OSError:
+            raise ResumableUploadError('Upload not found. It may have expired or been finished already.', 404)
+        return {
+            'upload_id': upload_id,
+            'filename': meta['filename'],
+            'size': meta['size'],
+            'offset': received,
+            'complete': received == meta['size'],
+            'chunk_size': self.chunk_max_bytes,
+        }
+
+    def write_chunk(self, upload_id, offset, stream, length):
+        """Copy `length` bytes from `stream` into the upload at `offset`; returns status()."""
+        meta, part_path = self._meta(upload_id)
+        try:
+            offset = int(offset)
+        except (TypeError, ValueError):
+            raise ResumableUploadError('offset must be a byte position')
+        if length is None:
+            raise ResumableUploadError('Content-Length is required', 411)
+        if length > self.chunk_max_bytes:
+            raise ResumableUploadError(f'Chunk too large: {length} bytes (limit {self.chunk_max_bytes})', 413)
+        if offset < 0 or offset + length > meta['size']:
+            raise ResumableUploadError(f"Chunk outside the file (size {meta['size']})", 416)
+
+        try:
+            f = open(part_path, 'r+b')
+        except OSError:
+            raise ResumableUploadError('Upload not found. It may have expired or been finished already.', 404)
+        with f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            received = os.fstat(f.fileno()).st_size
+            if offset > received:
+                raise ResumableUploadError(f'Chunk starts after the {received} bytes received so far', 409,
+                                           offset=received)
+            f.seek(offset)
+            remaining = length
+            while remaining:
+                block = stream.read(min(_COPY_BLOCK, remaining))
+                if not block:
+                    # The connection dropped: keep what arrived, the client resumes from status()
+                    break
+                f.write(block)
+                remaining -= len(block)
+        return self.status(upload_id)
+
+    def finish(self, upload_id, destination):
+        """Verify size and SHA-256 and move the file to `destination`; returns the stored upload settings."""
+        meta, part_path = self._meta(upload_id)
+        with open(part_path, 'rb') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            received = os.fstat(f.fileno()).st_size
+            if received != meta['size']:
+                raise ResumableUploadError(f"Upload incomplete: {received} of {meta['size']} bytes received", 409,
+                                           offset=received)
+            digest = hashlib.sha256()
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+            if digest.hexdigest() != meta['sha256']:
+                # The bytes on disk are wrong somewhere; the client has to send the file again
+                self.abort(upload_id)
+                raise ResumableUploadError('Checksum mismatch: the upload was discarded, please upload the file again',
+                                           422)
+            try:
+                # Moving the part claims the upload, so it is processed once
+                os.rename(part_path, destination)
+            except FileNotFoundError:
+                raise ResumableUploadError('Upload not found. It may have expired or been finished already.', 404)
+        _remove(part_path[:-len('.part')] + '.json')
+        return meta['upload']
+
+    def abort(self, upload_id):
+        for path in self._paths(upload_id):
+            _remove(path)
+
+    # ------------------------------------------------------------------
+    # Housekeeping
+    # ------------------------------------------------------------------
+    def active_count(self):
+        try:
+            return sum(1 for name in os.listdir(self.directory) if name.endswith('.json'))
+        except OSError:
+            return 0
+
+    def prune(self):
+        """Remove uploads that received nothing for ttl_seconds, and leftovers of interrupted writes."""
+        cutoff = time.time() - self.ttl_seconds
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.directory, name)
+            if name.endswith('.json'):
+                # An upload is as old as its last chunk
+                part_path = path[:-len('.json')] + '.part'
+                if os.path.exists(part_path):
+                    path = part_path
+            elif name.endswith('.part'):
+                continue
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    upload_id = name.split('.', 1)[0]
+                    base = os.path.join(self.directory, upload_id)
+                    for leftover in (base + '.part', base + '.json', base + '.json.tmp'):
+                        _remove(leftover)
+            except OSError:
+                continue
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
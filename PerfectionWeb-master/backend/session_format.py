@@ -0,0 +1,126 @@
+"""
+Compact (v2) response format for /api/parent/sessions.
+
+The v1 format emits several keys twice (`is_general_exam`/`isGeneralExam`,
+`start_time`/`startTime`, `name`/`lectureName`, `date`/`endTime`) and repeats
+the same constants on every session. v2 is opt-in and negotiated per request:
+
+  - `?v=2`, or `Accept: application/vnd.perfection.sessions.v2+json`
+  - `?layout=columns` (or `; layout=columns` on that media type) returns
+    column-oriented arrays instead of one object per session
+
+v2, layout "rows":
+
+    {"version": 2, "layout": "rows",
+     "defaults": {"generalExam": false, "homework": "completed", "quizTotal": 15, "timed": true},
+     "sessions": [{"id": ..., "chapter": 3, "name": "...", "date": "...", "createdAt": "...",
+                   "startTime": "...", "attendance": "attended", "quizCorrect": 12, "payment": 140.0}]}
+
+A key missing from a session has the value in "defaults" (or is empty when it
+has no default). `endTime` is not sent: it equals `date` unless the session
+has `"timed": false`. Sessions without a grade or payment column simply omit
+`quizCorrect` / `payment`.
+
+v2, layout "columns":
+
+    {"version": 2, "layout": "columns", "count": 2,
+     "constants": {"generalExam": false, ...},
+     "columns": {"id": [...], "chapter": [...], ...}}
+
+Every column has `count` entries (null where a session has no value); a column
+whose value is the same for every session is sent once in "constants".
+
+Both versions are ordered newest upload first. With `?limit=N` only the first N
+sessions are returned together with a cursor for the next page (`next_cursor`
+in v1, `nextCursor` in v2; null on the last page), which is passed back as
+`?cursor=...`.
+"""
+import base64
+import json
+
+from flask import request
+
+V2_MEDIA_TYPE = 'application/vnd.perfection.sessions.v2+json'
+
+DEFAULTS = {'generalExam': False, 'homework': 'completed', 'quizTotal': 15, 'timed': True}
+COLUMNS = ('id', 'chapter', 'name', 'date', 'createdAt', 'startTime', 'attendance', 'homework',
+           'generalExam', 'quizCorrect', 'quizTotal', 'payment', 'timed')
+
+
+def negotiate():
+    """Return (version, layout) requested by the current request."""
+    accept = request.headers.get('Accept') or ''
+    version = 1
+    layout = 'rows'
+    if request.args.get('v') == '2' or V2_MEDIA_TYPE in accept:
+        version = 2
+    if V2_MEDIA_TYPE in accept and 'layout=columns' in accept.replace(' ', ''):
+        layout = 'columns'
+    if request.args.get('layout') in ('rows', 'columns'):
+        layout = request.args['layout']
+    return version, layout
+
+
+def encode_cursor(record):
+    """Opaque cursor pointing after `record` (see SessionRecordsRepository.page_for_parent)."""
+    key = [record.get('created_at'), record.get('session_number'), record.get('id')]
+    return base64.urlsafe_b64encode(json.dumps(key, separators=(',', ':')).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(created_at, session_number, id) from encode_cursor(); ValueError if malformed."""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f'Invalid cursor: {e}')
+    if not isinstance(key, list) or len(key) != 3 or None in key:
+        raise ValueError('Invalid cursor')
+    return tuple(key)
+
+
+def _is_true(value):
+    return value is True or (isinstance(value, str) and value.lower() == 'true') or (isinstance(value, int) and value == 1)
+
+
+def compact_session(r, format_start_time):
+    """Full v2 field set for one session_records row (defaults not yet removed)."""
+    session = {
+        'id': r.get('id') or r.get('student_no') or r.get('student_id'),
+        'chapter': r.get('session_number'),
+        'name': r.get('lecture_name') or r.get('exam_name') or f"Session {r.get('session_number')}",
+        'date': r.get('finish_time') or '',
+        'createdAt': r.get('created_at'),
+        'startTime': format_start_time(r.get('start_time')),
+        'attendance': 'attended' if int(r.get('attendance') or 0) == 1 else 'missed',
+        'homework': 'completed' if (r.get('homework_status') in (0, None)) else 'pending',
+        'generalExam': _is_true(r.get('is_general_exam')),
+        'timed': bool(r.get('has_time', True)),
+    }
+    if r.get('has_exam_grade', True):
+        session['quizCorrect'] = int(r.get('quiz_mark') or 0)
+        admin_quiz_mark = r.get('admin_quiz_mark')
+        session['quizTotal'] = int(admin_quiz_mark) if admin_quiz_mark is not None else 15
+    if r.get('has_payment', True):
+        session['payment'] = float(r.get('payment') or 0)
+    return session
+
+
+def build_v2(records, layout, format_start_time):
+    # Records arrive newest upload first (ordered by the query)
+    sessions = [compact_session(r, format_start_time) for r in records]
+
+    if layout == 'columns':
+        columns = {name: [s.get(name) for s in sessions] for name in COLUMNS}
+        constants = {}
+        for name, values in list(columns.items()):
+            if values and all(v == values[0] for v in values):
+                constants[name] = values[0]
+                del columns[name]
+        return {'version': 2, 'layout': 'columns', 'count': len(sessions),
+                'constants': constants, 'columns': columns}
+
+    rows = []
+    for s in sessions:
+        rows.append({k: v for k, v in s.items()
+                     if v is not None and v != '' and not (k in DEFAULTS and DEFAULTS[k] == v)})
+    return {'version': 2, 'layout': 'rows', 'defaults': DEFAULTS, 'sessions': rows}
@@ -0,0 +1,125 @@
+"""
+Reading an uploaded sheet into a DataFrame: Excel, CSV or Parquet.
+
+parse_normal_lecture_sheet / parse_general_exam_sheet call read_sheet() and
+then apply the same column detection to whatever format was uploaded.
+
+  - xlsx / xls: pandas.read_excel (openpyxl), the slowest of the three
+  - csv: the attendance machines' export. The encoding is detected from the
+    BOM (UTF-8, UTF-16) or by decoding the file as UTF-8 block by block,
+    falling back to CSV_FALLBACK_ENCODING (default cp1256, what Arabic Windows
+    Excel writes for "CSV"). The delimiter (, ; tab |) is sniffed from the
+    first block. Cells are read as text, so leading zeros in phone numbers
+    and IDs survive, and pandas' C parser streams the file from disk.
+  - parquet: only when pyarrow or fastparquet is installed (optional, not in
+    requirements.txt); otherwise .parquet uploads are rejected as an
+    unsupported type.
+
+pandas is imported on first use, like in the parsers.
+"""
+import codecs
+import csv
+import importlib.util
+import os
+
+EXCEL_EXTENSIONS = ('xlsx', 'xls')
+CSV_EXTENSIONS = ('csv',)
+PARQUET_EXTENSIONS = ('parquet',)
+
+CSV_DELIMITERS = ',;\t|'
+_BLOCK_SIZE = 64 * 1024
+
+
+def parquet_available():
+    return any(importlib.util.find_spec(engine) for engine in ('pyarrow', 'fastparquet'))
+
+
+def supported_extensions():
+    """File extensions read_sheet() can read in this environment."""
+    extensions = set(EXCEL_EXTENSIONS) | set(CSV_EXTENSIONS)
+    if parquet_available():
+        extensions |= set(PARQUET_EXTENSIONS)
+    return extensions
+
+
+def extension(path):
+    return path.rsplit('.', 1)[1].lower() if '.' in path else ''
+
+
+def detect_csv_encoding(path):
+    """Encoding of a CSV file: from its BOM, else UTF-8 if all of it decodes, else the fallback."""
+    with open(path, 'rb') as f:
+        head = f.read(4)
+        if head.startswith(codecs.BOM_UTF8):
+            return 'utf-8-sig'
+        if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+            return 'utf-16'
+        f.seek(0)
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        try:
+            for block in iter(lambda: f.read(_BLOCK_SIZE), b''):
+                decoder.decode(block)
+            decoder.decode(b'', final=True)
+        except UnicodeDecodeError:
+            return os.getenv('CSV_FALLBACK_ENCODING', 'cp1256')
+    return 'utf-8'
+
+
+def sniff_delimiter(path, encoding):
+    with open(path, 'r', encoding=encoding, newline='') as f:
+        sample = f.read(_BLOCK_SIZE)
+    # Sniff whole lines only
+    if len(sample) == _BLOCK_SIZE and '\n' in sample:
+        sample = sample[:sample.rindex('\n')]
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=CSV_DELIMITERS).delimiter
+    except csv.Error:
+        return ','
+
+
+def read_excel(path):
+    import pandas as pd
+    try:
+        return pd.read_excel(path, header=0)
+    except AttributeError as ae:
+        # Workaround for openpyxl returning ReadOnlyWorksheet without
+        # `defined_names` when pandas/openpyxl open the file in
+        # read-only mode. Fall back to loading with openpyxl directly
+        # and build a DataFrame from the sheet values.
+        if 'defined_names' in str(ae) or 'ReadOnlyWorksheet' in str(ae):
+            from openpyxl import load_workbook
+            wb = load_workbook(path, data_only=True)
+            ws = wb.active
+            data = list(ws.values)
+            if not data:
+                raise
+            header = [str(h).strip() if h is not None else '' for h in data[0]]
+            rows = data[1:]
+            return pd.DataFrame(rows, columns=header)
+        raise
+
+
+def read_csv(path):
+    import pandas as pd
+    encoding = detect_csv_encoding(path)
+    return pd.read_csv(path, header=0, encoding=encoding, sep=sniff_delimiter(path, encoding),
+                       dtype=str, skip_blank_lines=True)
+
+
+def read_parquet(path):
+    import pandas as pd
+    if not parquet_available():
+        raise ValueError('Parquet files need pyarrow or fastparquet installed on the server')
+    return pd.read_parquet(path)
+
+
+def read_sheet(path):
+    """DataFrame of an uploaded sheet, picked by file extension; the first row is the header."""
+    ext = extension(path)
+    if ext in EXCEL_EXTENSIONS:
+        return read_excel(path)
+    if ext in CSV_EXTENSIONS:
+        return read_csv(path)
+    if ext in PARQUET_EXTENSIONS:
+        return read_parquet(path)
+    raise ValueError(f'Unsupported file type: .{ext}')
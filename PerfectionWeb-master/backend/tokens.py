@@ -0,0 +1,149 @@
+"""
+Signed, expiring session tokens.
+
+`/api/auth/login` and `/api/admin/login` return a compact token (itsdangerous:
+a base64 payload of role, subject, expiry and password version plus an HMAC
+signature). Clients send it back as `Authorization: Bearer <token>`; it is
+verified in-process, so the parent data endpoints derive the caller's phone
+number without a database query on every request.
+
+The password version is an HMAC of the password the account had when the token
+was issued. When `password_lookup(role, subject)` is set (app.py), verify()
+compares it with the account's current password, fetched at most once per
+AUTH_PASSWORD_CHECK_SECONDS per account and worker, so changing or resetting a
+password revokes the tokens issued before. forget() drops the cached version
+after a change made by this worker.
+
+Settings:
+  - AUTH_SECRET_KEY: signing key shared by all workers (falls back to
+    SECRET_KEY, then a key derived from SUPABASE_KEY)
+  - AUTH_PARENT_TOKEN_TTL_SECONDS: parent token lifetime (default 30 days)
+  - AUTH_ADMIN_TOKEN_TTL_SECONDS: admin token lifetime (default 12 hours)
+  - AUTH_PASSWORD_CHECK_SECONDS: how long a worker trusts the password version
+    it last read for an account (default 60)
+"""
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import time
+
+from itsdangerous import BadSignature, URLSafeSerializer
+
+logger = logging.getLogger('upload_logger')
+
+ROLE_PARENT = 'parent'
+ROLE_ADMIN = 'admin'
+# One-letter role codes keep tokens short
+_ROLE_CODES = {ROLE_PARENT: 'p', ROLE_ADMIN: 'a'}
+_CODE_ROLES = {v: k for k, v in _ROLE_CODES.items()}
+
+
+class InvalidToken(Exception):
+    """Token is malformed, tampered with or expired."""
+
+    def __init__(self, message, expired=False):
+        super().__init__(message)
+        self.expired = expired
+
+
+class TokenService:
+    def __init__(self, secret, parent_ttl=30 * 24 * 3600, admin_ttl=12 * 3600, password_check_seconds=60):
+        self._serializer = URLSafeSerializer(secret, salt='perfection-session')
+        self._version_key = hashlib.sha256(b'perfection-password-version:' + secret.encode('utf-8')).digest()
+        self.ttls = {ROLE_PARENT: int(parent_ttl), ROLE_ADMIN: int(admin_ttl)}
+        self.password_check_seconds = float(password_check_seconds)
+        # password_lookup(role, subject) -> current password, or None when the account is gone
+        self.password_lookup = None
+        self._versions = {}
+
+    @classmethod
+    def from_env(cls):
+        secret = os.getenv('AUTH_SECRET_KEY') or os.getenv('SECRET_KEY')
+        if not secret and os.getenv('SUPABASE_KEY'):
+            # Stable across workers and restarts without extra configuration
+            secret = hmac.new(os.getenv('SUPABASE_KEY').encode('utf-8'), b'perfection-session-tokens',
+                              hashlib.sha256).hexdigest()
+        if not secret:
+            logger.warning("AUTH_SECRET_KEY not set - using a per-process key; tokens will not be valid across workers or restarts")
+            secret = secrets.token_hex(32)
+        return cls(
+            secret,
+            parent_ttl=int(os.getenv('AUTH_PARENT_TOKEN_TTL_SECONDS', str(30 * 24 * 3600))),
+            admin_ttl=int(os.getenv('AUTH_ADMIN_TOKEN_TTL_SECONDS', str(12 * 3600))),
+            password_check_seconds=float(os.getenv('AUTH_PASSWORD_CHECK_SECONDS', '60')),
+        )
+
+    def password_version(self, password):
+        """Short keyed digest of a stored password; the token carries it instead of the password."""
+        return hmac.new(self._version_key, (password or '').encode('utf-8'), hashlib.sha256).hexdigest()[:16]
+
+    def issue(self, role, subject, password=''):
+        """Return (token, expires_in_seconds) for a parent phone number or admin username.
+
+        `password` is the account's stored password; the token stops being
+        valid once it changes.
+        """
+        ttl = self.ttls[role]
+        version = self.password_version(password)
+        self._versions[(role, subject)] = (version, time.monotonic())
+        return self._serializer.dumps([_ROLE_CODES[role], subject, int(time.time()) + ttl, version]), ttl
+
+    def forget(self, role, subject):
+        """Drop the cached password version of an account (its password just changed)."""
+        self._versions.pop((role, subject), None)
+
+    def _current_version(self, role, subject, max_age):
+        """Password version the account has now, '' when it is gone, None when it cannot be read."""
+        key = (role, subject)
+        cached = self._versions.get(key)
+        now = time.monotonic()
+        if cached and now - cached[1] < max_age:
+            return cached[0]
+        try:
+            password = self.password_lookup(role, subject)
+        except Exception as e:
+            # Database unreachable: keep the last version read (or accept the token)
+            logger.warning("Could not read the password version of %s %s: %s", role, subject, e)
+            return cached[0] if cached else None
+        version = '' if password is None else self.password_version(password)
+        if len(self._versions) >= 50000:
+            self._versions.clear()
+        self._versions[key] = (version, now)
+        return version
+
+    def verify(self, token, role=None):
+        """Return {'role', 'sub', 'exp'} for a valid token; raise InvalidToken otherwise.
+
+        With `role`, tokens of any other role are rejected.
+        """
+        try:
+            code, subject, expires, version = self._serializer.loads(token)
+        except (BadSignature, ValueError, TypeError):
+            raise InvalidToken('Invalid token')
+
+        token_role = _CODE_ROLES.get(code)
+        if token_role is None or not isinstance(expires, int):
+            raise InvalidToken('Invalid token')
+        if expires < time.time():
+            raise InvalidToken('Token expired', expired=True)
+        if role and token_role != role:
+            raise InvalidToken('Token not valid for this endpoint')
+        if self.password_lookup is not None:
+            current = self._current_version(token_role, subject, self.password_check_seconds)
+            if current is not None and current != version:
+                # The password may have changed through another worker since it was cached
+                current = self._current_version(token_role, subject, min(1.0, self.password_check_seconds))
+            if current is not None and current != version:
+                raise InvalidToken('Token revoked')
+        return {'role': token_role, 'sub': subject, 'exp': expires}
+
+
+def bearer_token(headers):
+    """Token from an `Authorization: Bearer ...` header, or None."""
+    auth = headers.get('Authorization') or ''
+    scheme, _, token = auth.partition(' ')
+    if scheme.lower() != 'bearer' or not token.strip():
+        return None
+    return token.strip()
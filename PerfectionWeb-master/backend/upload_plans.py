@@ -0,0 +1,116 @@
+"""
+Dry-run upload plans kept on disk until an admin commits them.
+
+POST /api/upload-excel with dry_run=true parses the sheet, builds the
+session_records payloads and classifies every row (insert / update / rename /
+reject, see identity_index.py) without writing anything. The payloads are
+saved here under a random plan id, so that
+
+    POST /api/upload-excel/plans/<plan_id>/commit
+
+writes them without uploading, parsing or normalizing the file again. The
+rows are classified once more at commit time against a fresh read (one
+query), because another upload may have written the same students since
+the dry run.
+
+Plans are JSON files in UPLOAD_PLAN_DIR (default uploads/plans), shared by
+all workers and ingestion processes on the host, and expire after
+UPLOAD_PLAN_TTL_SECONDS (default 3600). A plan is claimed by renaming its
+file, so it is committed at most once even when two commits race.
+"""
+import json
+import os
+import re
+import secrets
+import time
+
+PLAN_ID_RE = re.compile(r'^[A-Za-z0-9_-]{16}$')
+
+
+class UploadPlanStore:
+    """Saved dry-run plans, one JSON file per plan id."""
+
+    def __init__(self, directory, ttl_seconds=3600, preview_rows=2000):
+        self.directory = directory
+        self.ttl_seconds = float(ttl_seconds)
+        # Planned rows listed in a dry-run response (renames and inexact matches first)
+        self.preview_rows = max(0, int(preview_rows))
+
+    @classmethod
+    def from_env(cls, default_dir):
+        return cls(
+            directory=os.getenv('UPLOAD_PLAN_DIR', default_dir),
+            ttl_seconds=float(os.getenv('UPLOAD_PLAN_TTL_SECONDS', '3600')),
+            preview_rows=int(os.getenv('UPLOAD_PLAN_PREVIEW_ROWS', '2000')),
+        )
+
+    def settings(self):
+        return {'directory': self.directory, 'ttl_seconds': self.ttl_seconds, 'preview_rows': self.preview_rows}
+
+    def _path(self, plan_id, suffix='.json'):
+        return os.path.join(self.directory, f'{plan_id}{suffix}')
+
+    def save(self, plan):
+        """Store a plan (a JSON-serializable dict) and return its id."""
+        os.makedirs(self.directory, exist_ok=True)
+        self.prune()
+        plan_id = secrets.token_urlsafe(12)
+        plan = dict(plan, plan_id=plan_id, created=time.time())
+        tmp = self._path(plan_id, '.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(plan, f, ensure_ascii=False)
+        os.replace(tmp, self._path(plan_id))
+        return plan_id
+
+    def _read(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                plan = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - plan.get('created', 0) > self.ttl_seconds:
+            self._remove(path)
+            return None
+        return plan
+
+    def get(self, plan_id):
+        """The saved plan, or None if it is unknown, expired or already committed."""
+        if not PLAN_ID_RE.match(plan_id or ''):
+            return None
+        return self._read(self._path(plan_id))
+
+    def claim(self, plan_id):
+        """Take a plan for committing: return it and remove it from the store, or None."""
+        if not PLAN_ID_RE.match(plan_id or ''):
+            return None
+        claimed = self._path(plan_id, f'.commit-{os.getpid()}')
+        try:
+            os.rename(self._path(plan_id), claimed)
+        except OSError:
+            return None
+        try:
+            return self._read(claimed)
+        finally:
+            self._remove(claimed)
+
+    def prune(self):
+        """Remove expired plans and leftovers of interrupted writes."""
+        cutoff = time.time() - self.ttl_seconds
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    self._remove(path)
+            except OSError:
+                continue
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
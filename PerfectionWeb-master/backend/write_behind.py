@@ -0,0 +1,154 @@
+"""
+Write-behind buffering for low-priority updates.
+
+Login only needs one `parents` lookup; the `last_login` timestamp nobody reads
+in real time is queued here and written in batches instead of costing a second
+database round trip per login.
+
+Pending values are kept per key (the newest value wins) and flushed by a
+background thread every LAST_LOGIN_FLUSH_SECONDS, as soon as
+LAST_LOGIN_BATCH_SIZE keys are pending, and once more when the worker exits.
+Set LAST_LOGIN_WRITE_BEHIND=false to write synchronously again.
+
+Values are flushed grouped by value, so logins within the same second share
+one `UPDATE ... WHERE phone_number IN (...)` statement.
+"""
+import atexit
+import logging
+import os
+import threading
+
+from metrics import registry
+
+logger = logging.getLogger('upload_logger')
+
+
+class WriteBehindBuffer:
+    """Coalesce per-key writes and hand them to `flush_fn(value, keys)` in batches.
+
+    A batch whose flush raises is put back (unless newer values arrived for the
+    same keys) and retried on the next flush, up to `max_pending` keys.
+    """
+
+    def __init__(self, flush_fn, name, interval=5.0, batch_size=200, max_pending=10000, chunk_size=100):
+        self.flush_fn = flush_fn
+        self.name = name
+        self.interval = float(interval)
+        self.batch_size = max(1, int(batch_size))
+        self.max_pending = max(self.batch_size, int(max_pending))
+        self.chunk_size = max(1, int(chunk_size))
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._queued = registry.counter(f'{name}.queued')
+        self._written = registry.counter(f'{name}.written')
+        self._dropped = registry.counter(f'{name}.dropped')
+        self._errors = registry.counter(f'{name}.flush_errors')
+        self._flush_timer = registry.timer(f'{name}.flush')
+        self._size = registry.gauge(f'{name}.pending')
+        atexit.register(self.flush)
+
+    def put(self, key, value):
+        self._ensure_thread()
+        with self._lock:
+            self._pending[key] = value
+            pending = len(self._pending)
+        self._queued.inc()
+        self._size.set(pending)
+        if pending >= self.batch_size:
+            self._wake.set()
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self):
+        """Write everything pending now; returns the number of keys written."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            self._size.set(0)
+            if not batch:
+                return 0
+
+            groups = {}
+            for key, value in batch.items():
+                groups.setdefault(value, []).append(key)
+
+            written = 0
+            failed = {}
+            with self._flush_timer.time():
+                for value, keys in groups.items():
+                    for i in range(0, len(keys), self.chunk_size):
+                        chunk = keys[i:i + self.chunk_size]
+                        try:
+                            self.flush_fn(value, chunk)
+                            written += len(chunk)
+                        except Exception as e:
+                            self._errors.inc()
+                            logger.warning(f"{self.name}: flush of {len(chunk)} keys failed: {str(e)}")
+                            failed.update((key, value) for key in chunk)
+
+            self._written.inc(written)
+            if failed:
+                self._requeue(failed)
+            return written
+
+    def _requeue(self, failed):
+        with self._lock:
+            for key, value in failed.items():
+                # A newer value queued during the flush wins over the failed one
+                if key not in self._pending and len(self._pending) < self.max_pending:
+                    self._pending[key] = value
+                elif key not in self._pending:
+                    self._dropped.inc()
+            pending = len(self._pending)
+        self._size.set(pending)
+
+    def _ensure_thread(self):
+        # Started lazily (and again after a fork) so preloaded gunicorn workers each get their own thread
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._wake = threading.Event()
+            self._thread = threading.Thread(target=self._run, name=f'{self.name}-flusher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception(f"{self.name}: unexpected flush error")
+
+
+def last_login_buffer(parents_repository_getter):
+    """Buffer for parents.last_login built from LAST_LOGIN_* settings, or None when disabled.
+
+    `parents_repository_getter` is called at flush time so a swapped data
+    backend (benchmarks, tests) is picked up.
+    """
+    enabled = (os.getenv('LAST_LOGIN_WRITE_BEHIND') or 'true').strip().lower() in ('1', 'true', 'yes', 'on')
+    if not enabled:
+        return None
+
+    def flush(timestamp, phones):
+        parents = parents_repository_getter()
+        if parents is None:
+            raise RuntimeError('data backend not configured')
+        parents.set_last_login(phones, timestamp)
+
+    return WriteBehindBuffer(
+        flush,
+        name='last_login',
+        interval=float(os.getenv('LAST_LOGIN_FLUSH_SECONDS', '5')),
+        batch_size=int(os.getenv('LAST_LOGIN_BATCH_SIZE', '200')),
+    )
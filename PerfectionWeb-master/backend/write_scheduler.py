@@ -0,0 +1,347 @@
+"""
+Adaptive concurrency and batch size for upload writes (AIMD).
+
+update_database used to send its session_records writes one after another,
+so a large sheet took one database round trip per row, and any fixed amount
+of parallelism would either leave Supabase idle or run into PostgREST's rate
+limits and connection caps on a busy night. WriteScheduler sends the writes
+in batches from a small thread pool and adjusts both the number of batches in
+flight and the rows per batch to what the database is taking right now:
+
+  - additive increase: a batch that completes without a transient error and
+    without a latency rise grows the concurrency by about one batch per round
+    (1/concurrency per batch) and the batch size by WRITE_BATCH_STEP rows per
+    round
+  - multiplicative decrease: a batch that hit a transient error (429, 5xx,
+    timeout, dropped connection; repository.is_transient_error) or whose time
+    per request rose above WRITE_LATENCY_TOLERANCE (default 2) times the
+    baseline multiplies both by WRITE_DECREASE_FACTOR (default 0.5). Batches sent
+    before the last decrease don't decrease again, so one burst of 429s
+    counts once
+  - rows that failed with a transient error are sent again after a jittered
+    backoff, up to WRITE_RETRY_ATTEMPTS sends in all; what still fails is
+    returned to the caller, which leaves it to the journal (ingest_journal.py)
+
+A batch's time is divided by the database requests it sends (run()'s
+`cost`; update_database counts one per update and one per bulk insert), and
+the baseline is a slow moving average of that time per request over the
+batches seen so far, like the long-term RTT of a gradient limiter. A database
+that slows down as more is sent to it pushes the window back before it
+starts answering 429, whatever the batch size, while a lasting change in
+latency becomes the new baseline. Batches faster than WRITE_LATENCY_FLOOR_MS
+(default 50) are never counted as slow, so jitter on fast batches doesn't
+shrink the window.
+
+Writes with the same key (update_database uses parent_no) go in the same
+batch, in their original order, so two writes of one student never race.
+
+The learned concurrency and batch size are kept between runs in the same
+process. Bounds: WRITE_CONCURRENCY_MIN / _MAX / _INITIAL (default 1 / 8 / 2)
+and WRITE_BATCH_MIN / _MAX / _INITIAL (default 1 / 500 / 20).
+WRITE_SCHEDULER_ENABLED=false sends one row at a time in order, as before.
+
+Metrics (`write_scheduler.*`): rows_per_second over the last
+WRITE_RATE_WINDOW_SECONDS (default 10), concurrency and batch_size as
+currently set, counters of rows, retries and throttled batches (`throttled`),
+and a timer per batch. Uploads are written in the ingestion processes
+(ingest_executor.py), whose metrics the workers don't see, so each upload
+response carries its `write_stats` and the worker records them as
+upload_rows_per_second and under `write_scheduler.last_upload`.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from metrics import registry
+from repository import is_transient_error
+
+logger = logging.getLogger('upload_logger')
+
+
+def _env_bool(name, default=False):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+class _Batch:
+    __slots__ = ('indexes', 'attempt', 'epoch', 'started', 'cost')
+
+    def __init__(self, indexes, attempt=1):
+        self.indexes = indexes
+        self.attempt = attempt
+        self.epoch = 0
+        self.started = 0.0
+        self.cost = len(indexes)
+
+
+class WriteScheduler:
+    """Sends items in batches, with AIMD on the batches in flight and the batch size."""
+
+    def __init__(self, enabled=True, min_concurrency=1, max_concurrency=8, initial_concurrency=2,
+                 min_batch=1, max_batch=500, initial_batch=20, batch_step=10, latency_tolerance=2.0,
+                 latency_floor=0.05, latency_smoothing=0.05, decrease_factor=0.5, retry_attempts=3, retry_base_delay=0.25, retry_max_delay=5.0,
+                 rate_window=10.0):
+        self.enabled = enabled
+        self.min_concurrency = max(1, int(min_concurrency))
+        self.max_concurrency = max(self.min_concurrency, int(max_concurrency))
+        self.min_batch = max(1, int(min_batch))
+        self.max_batch = max(self.min_batch, int(max_batch))
+        self.batch_step = max(0.0, float(batch_step))
+        # A batch whose seconds per request exceed latency_tolerance x the baseline
+        # (and that took at least latency_floor seconds) is a congestion signal
+        self.latency_tolerance = max(1.0, float(latency_tolerance))
+        self.latency_floor = float(latency_floor)
+        self.latency_smoothing = min(1.0, max(0.01, float(latency_smoothing)))
+        self.decrease_factor = min(0.95, max(0.05, float(decrease_factor)))
+        self.retry_attempts = max(1, int(retry_attempts))
+        self.retry_base_delay = float(retry_base_delay)
+        self.retry_max_delay = float(retry_max_delay)
+        self.rate_window = float(rate_window)
+        self._lock = threading.Lock()
+        self._concurrency = float(min(self.max_concurrency, max(self.min_concurrency, int(initial_concurrency))))
+        self._batch = float(min(self.max_batch, max(self.min_batch, int(initial_batch))))
+        self._epoch = 0
+        # Moving average of seconds per request over the batches seen so far
+        self._request_latency = None
+        # (time, rows) written in the last rate_window seconds, and their sum
+        self._completed = deque()
+        self._completed_rows = 0
+        self._local = threading.local()
+        self.last_upload = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            enabled=_env_bool('WRITE_SCHEDULER_ENABLED', True),
+            min_concurrency=int(os.getenv('WRITE_CONCURRENCY_MIN', '1')),
+            max_concurrency=int(os.getenv('WRITE_CONCURRENCY_MAX', '8')),
+            initial_concurrency=int(os.getenv('WRITE_CONCURRENCY_INITIAL', '2')),
+            min_batch=int(os.getenv('WRITE_BATCH_MIN', '1')),
+            max_batch=int(os.getenv('WRITE_BATCH_MAX', '500')),
+            initial_batch=int(os.getenv('WRITE_BATCH_INITIAL', '20')),
+            batch_step=float(os.getenv('WRITE_BATCH_STEP', '10')),
+            latency_tolerance=float(os.getenv('WRITE_LATENCY_TOLERANCE', '2')),
+            latency_floor=float(os.getenv('WRITE_LATENCY_FLOOR_MS', '50')) / 1000.0,
+            decrease_factor=float(os.getenv('WRITE_DECREASE_FACTOR', '0.5')),
+            retry_attempts=int(os.getenv('WRITE_RETRY_ATTEMPTS', '3')),
+            rate_window=float(os.getenv('WRITE_RATE_WINDOW_SECONDS', '10')),
+        )
+
+    def settings(self):
+        with self._lock:
+            concurrency, batch_size = int(self._concurrency), int(self._batch)
+            request_latency = self._request_latency
+        return {
+            'enabled': self.enabled,
+            'concurrency': concurrency,
+            'batch_size': batch_size,
+            'max_concurrency': self.max_concurrency,
+            'max_batch': self.max_batch,
+            'latency_tolerance': self.latency_tolerance,
+            'request_latency_ms': round(request_latency * 1000, 1) if request_latency is not None else None,
+            'rows_per_second': self.rows_per_second(),
+            'last_upload': self.last_upload,
+        }
+
+    @property
+    def last_run(self):
+        """Rows, time, rate and final settings of the last run() on this thread."""
+        return getattr(self._local, 'last_run', None)
+
+    def record_upload(self, stats):
+        """Keep the last_run of an upload, which may have been written in an ingestion process."""
+        if not stats:
+            return
+        self.last_upload = stats
+        registry.gauge('write_scheduler.upload_rows_per_second').set(stats['rows_per_second'])
+
+    # ------------------------------------------------------------------
+    # Control
+    # ------------------------------------------------------------------
+    def _increase(self):
+        with self._lock:
+            # Until the first decrease (slow start) the concurrency doubles per round
+            step = 1.0 if self._epoch == 0 else 1.0 / self._concurrency
+            self._concurrency = min(self.max_concurrency, self._concurrency + step)
+            self._batch = min(self.max_batch, self._batch + self.batch_step / self._concurrency)
+            self._publish()
+
+    def _decrease(self, epoch):
+        with self._lock:
+            if epoch != self._epoch:
+                # Sent before the last decrease; that one already accounted for it
+                return
+            self._epoch += 1
+            self._concurrency = max(self.min_concurrency, self._concurrency * self.decrease_factor)
+            self._batch = max(self.min_batch, self._batch * self.decrease_factor)
+            self._publish()
+        registry.counter('write_scheduler.decreases').inc()
+
+    def _publish(self):
+        registry.gauge('write_scheduler.concurrency').set(int(self._concurrency))
+        registry.gauge('write_scheduler.batch_size').set(int(self._batch))
+
+    def _slow(self, took, requests):
+        """Whether a batch's time per request rose above the baseline; updates the baseline."""
+        per_request = took / max(1, requests)
+        with self._lock:
+            baseline = self._request_latency
+            if baseline is None:
+                self._request_latency = per_request
+                return False
+            self._request_latency = baseline + self.latency_smoothing * (per_request - baseline)
+        return took >= self.latency_floor and per_request > baseline * self.latency_tolerance
+
+    def _record_rows(self, count):
+        now = time.monotonic()
+        with self._lock:
+            self._completed.append((now, count))
+            self._completed_rows += count
+        registry.counter('write_scheduler.rows').inc(count)
+        registry.gauge('write_scheduler.rows_per_second').set(self.rows_per_second())
+
+    def rows_per_second(self):
+        """Rows written by this process over the last rate_window seconds."""
+        cutoff = time.monotonic() - self.rate_window
+        with self._lock:
+            while self._completed and self._completed[0][0] < cutoff:
+                self._completed_rows -= self._completed.popleft()[1]
+            rows = self._completed_rows
+        return round(rows / self.rate_window, 1)
+
+    def _retry_delay(self, attempt):
+        return min(self.retry_max_delay, self.retry_base_delay * (2 ** (attempt - 1))) * random.uniform(0.5, 1.0)
+
+    # ------------------------------------------------------------------
+    # Running
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _groups(items, key):
+        groups = {}
+        for index, item in enumerate(items):
+            groups.setdefault(key(item) if key else index, []).append(index)
+        return deque(groups.values())
+
+    def _next_batch(self, groups):
+        size = int(self._batch)
+        indexes = []
+        while groups and (not indexes or len(indexes) + len(groups[0]) <= size):
+            indexes.extend(groups.popleft())
+        return _Batch(indexes)
+
+    def run(self, items, send, key=None, on_result=None, cost=None):
+        """
+        Send `items` with send(batch) -> a list with None or the exception for each
+        item of the batch; returns that list for all items, in their order.
+        on_result(index, error) is called on this thread as each item settles.
+        Items with the same key(item) are sent in one batch, in order.
+        cost(batch) is the number of database requests send(batch) makes (default:
+        one per item); batch latency is compared per request.
+        """
+        items = list(items)
+        results = [None] * len(items)
+        started = time.monotonic()
+        stats = {'rows': len(items), 'throttled': 0, 'retries': 0}
+
+        def settle(index, error):
+            results[index] = error
+            if on_result is not None:
+                on_result(index, error)
+
+        if not self.enabled:
+            for index, item in enumerate(items):
+                error = self._send(send, [item])[0]
+                if error is None:
+                    self._record_rows(1)
+                settle(index, error)
+            self._finish(stats, started)
+            return results
+
+        groups = self._groups(items, key)
+        # (ready at, batch) waiting for their backoff to pass
+        retries = []
+        in_flight = {}
+        with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='db-writer') as pool:
+            while groups or retries or in_flight:
+                now = time.monotonic()
+                while len(in_flight) < int(self._concurrency):
+                    ready = [entry for entry in retries if entry[0] <= now]
+                    if ready:
+                        retries.remove(ready[0])
+                        batch = ready[0][1]
+                    elif groups:
+                        batch = self._next_batch(groups)
+                    else:
+                        break
+                    batch_items = [items[i] for i in batch.indexes]
+                    if cost is not None:
+                        batch.cost = max(1, int(cost(batch_items)))
+                    batch.epoch, batch.started = self._epoch, time.monotonic()
+                    future = pool.submit(self._send, send, batch_items)
+                    in_flight[future] = batch
+
+                timeout = None
+                if retries:
+                    timeout = max(0.0, min(ready_at for ready_at, _ in retries) - time.monotonic())
+                if not in_flight:
+                    time.sleep(timeout or 0)
+                    continue
+                done, _ = wait(list(in_flight), timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch = in_flight.pop(future)
+                    self._settle_batch(batch, future.result(), retries, settle, stats)
+
+        self._finish(stats, started)
+        return results
+
+    @staticmethod
+    def _send(send, batch_items):
+        try:
+            errors = list(send(batch_items))
+        except Exception as e:
+            errors = [e] * len(batch_items)
+        return errors
+
+    def _settle_batch(self, batch, errors, retries, settle, stats):
+        took = time.monotonic() - batch.started
+        registry.timer('write_scheduler.batch').observe(took)
+        transient = {i for i, error in zip(batch.indexes, errors) if error is not None and is_transient_error(error)}
+        written = sum(1 for error in errors if error is None)
+        if written:
+            self._record_rows(written)
+
+        if transient:
+            stats['throttled'] += 1
+            registry.counter('write_scheduler.throttled').inc()
+            self._decrease(batch.epoch)
+        elif self._slow(took, batch.cost):
+            registry.counter('write_scheduler.slow').inc()
+            self._decrease(batch.epoch)
+        else:
+            self._increase()
+
+        retry_indexes = []
+        for index, error in zip(batch.indexes, errors):
+            if index in transient and batch.attempt < self.retry_attempts:
+                retry_indexes.append(index)
+            else:
+                settle(index, error)
+        if retry_indexes:
+            stats['retries'] += len(retry_indexes)
+            registry.counter('write_scheduler.retries').inc(len(retry_indexes))
+            retries.append((time.monotonic() + self._retry_delay(batch.attempt),
+                            _Batch(retry_indexes, batch.attempt + 1)))
+
+    def _finish(self, stats, started):
+        took = time.monotonic() - started
+        with self._lock:
+            concurrency, batch_size = int(self._concurrency), int(self._batch)
+        self._local.last_run = dict(stats, seconds=round(took, 3),
+                                    rows_per_second=round(stats['rows'] / took, 1) if took > 0 else 0.0,
+                                    concurrency=concurrency, batch_size=batch_size)
@@ -0,0 +1,30 @@
+import { inject } from '@angular/core';
+import { HttpErrorResponse, HttpInterceptorFn } from '@angular/common/http';
+import { Router } from '@angular/router';
+import { catchError, throwError } from 'rxjs';
+import { environment } from '../../../environments/environment';
+import { AuthService } from '../services/auth.service';
+
+// Sends the session token issued at login with every backend API call
+export const authInterceptor: HttpInterceptorFn = (req, next) => {
+  if (!req.url.startsWith(environment.apiUrl) || req.headers.has('Authorization')) {
+    return next(req);
+  }
+  const authService = inject(AuthService);
+  const router = inject(Router);
+  const token = authService.getToken();
+  if (!token) {
+    return next(req);
+  }
+  return next(req.clone({ setHeaders: { Authorization: `Bearer ${token}` } })).pipe(
+    catchError((error: HttpErrorResponse) => {
+      // The token itself was refused (expired, or revoked by a password change): sign in again.
+      // Other 401s, such as a wrong current password, carry no token_expired flag.
+      if (error.status === 401 && typeof error.error?.token_expired === 'boolean' && authService.getToken() === token) {
+        authService.logout();
+        router.navigate(['/login'], { replaceUrl: true });
+      }
+      return throwError(() => error);
+    })
+  );
+};
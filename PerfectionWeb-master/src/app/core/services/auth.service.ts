@@ -27,6 +27,16 @@ export interface User {
   type: 'parent' | 'admin';
   needsPasswordReset?: boolean;
   students?: number[];
+  token?: string;
+  tokenExpiresAt?: number;
+}
+
+// A password change revokes the old session token; the response carries a new one
+interface PasswordChangeResponse {
+  success: boolean;
+  message?: string;
+  token?: string;
+  expires_in?: number;
 }
 
 @Injectable({
@@ -69,6 +79,8 @@ export class AuthService {
           user?: { phone_number: string; name: string; needs_password_reset: boolean };
           needs_password_reset?: boolean;
           message?: string;
+          token?: string;
+          expires_in?: number;
         }>(`${environment.apiUrl}/auth/login`, {
           phone_number: phone,
           password: credentials.password
@@ -80,7 +92,9 @@ export class AuthService {
                 identifier: userPhone,
                 name: response.user.name || '',
                 type: 'parent',
-                needsPasswordReset: response.needs_password_reset || response.user.needs_password_reset || false
+                needsPasswordReset: response.needs_password_reset || response.user.needs_password_reset || false,
+                token: response.token,
+                tokenExpiresAt: response.expires_in ? Date.now() + response.expires_in * 1000 : undefined
               };
 
               this.currentUser.set(user);
@@ -115,7 +129,7 @@ export class AuthService {
       });
     } else {
       return new Observable(observer => {
-        this.http.post<{ success: boolean; user?: { username: string; name?: string }; message?: string }>(
+        this.http.post<{ success: boolean; user?: { username: string; name?: string }; message?: string; token?: string; expires_in?: number }>(
           `${environment.apiUrl}/admin/login`,
           {
             username: credentials.identifier,
@@ -127,7 +141,9 @@ export class AuthService {
               const user: User = {
                 identifier: response.user.username,
                 name: response.user.name || '',
-                type: 'admin'
+                type: 'admin',
+                token: response.token,
+                tokenExpiresAt: response.expires_in ? Date.now() + response.expires_in * 1000 : undefined
               };
 
               this.currentUser.set(user);
@@ -173,17 +189,14 @@ export class AuthService {
     if (user.type === 'parent') {
       return new Observable(observer => {
         const phone = this.normalizePhone(user.identifier || '');
-        this.http.post<{ success: boolean; message?: string }>(`${environment.apiUrl}/auth/reset-password`, {
+        this.http.post<PasswordChangeResponse>(`${environment.apiUrl}/auth/reset-password`, {
           phone_number: phone,
           new_password: newPassword
         }).subscribe({
           next: (response) => {
             if (response.success) {
-              const updatedUser = { ...user, needsPasswordReset: false };
-              this.currentUser.set(updatedUser);
-
-              const rememberMe = this.isRememberMeEnabled();
-              this.saveUserToStorage(updatedUser, rememberMe);
+              this.saveUserToStorage(this.withNewToken({ ...user, needsPasswordReset: false }, response),
+                this.isRememberMeEnabled());
             }
             observer.next(response);
             observer.complete();
@@ -199,16 +212,14 @@ export class AuthService {
       });
     } else {
       return new Observable(observer => {
-        this.http.post<{ success: boolean; message?: string }>(`${environment.apiUrl}/admin/reset-password`, {
+        this.http.post<PasswordChangeResponse>(`${environment.apiUrl}/admin/reset-password`, {
           username: user.identifier,
           new_password: newPassword
         }).subscribe({
           next: (response) => {
             if (response.success) {
-              const updatedUser = { ...user, needsPasswordReset: false };
-              this.currentUser.set(updatedUser);
-              const rememberMe = this.isRememberMeEnabled();
-              this.saveUserToStorage(updatedUser, rememberMe);
+              this.saveUserToStorage(this.withNewToken({ ...user, needsPasswordReset: false }, response),
+                this.isRememberMeEnabled());
             }
             observer.next(response);
             observer.complete();
@@ -235,12 +246,15 @@ export class AuthService {
     if (user.type === 'parent') {
       return new Observable(observer => {
         const phone = this.normalizePhone(user.identifier || '');
-        this.http.post<{ success: boolean; message?: string }>(`${environment.apiUrl}/auth/change-password`, {
+        this.http.post<PasswordChangeResponse>(`${environment.apiUrl}/auth/change-password`, {
           phone_number: phone,
           current_password: currentPassword,
           new_password: newPassword
         }).subscribe({
           next: (response) => {
+            if (response.success) {
+              this.saveUserToStorage(this.withNewToken(user, response), this.isRememberMeEnabled());
+            }
             observer.next(response);
             observer.complete();
           },
@@ -252,12 +266,15 @@ export class AuthService {
       });
     } else {
       return new Observable(observer => {
-        this.http.post<{ success: boolean; message?: string }>(`${environment.apiUrl}/admin/change-password`, {
+        this.http.post<PasswordChangeResponse>(`${environment.apiUrl}/admin/change-password`, {
           username: user.identifier,
           current_password: currentPassword,
           new_password: newPassword
         }).subscribe({
           next: (response) => {
+            if (response.success) {
+              this.saveUserToStorage(this.withNewToken(user, response), this.isRememberMeEnabled());
+            }
             observer.next(response);
             observer.complete();
           },
@@ -276,6 +293,10 @@ export class AuthService {
       localStorage.removeItem(this.STORAGE_KEY);
       localStorage.removeItem(this.REMEMBER_ME_KEY);
       localStorage.removeItem(this.PASSWORD_STORAGE_KEY);
+      // Locally synced session lists (see StudentService)
+      Object.keys(localStorage)
+        .filter(key => key.startsWith('perfection.sessions:'))
+        .forEach(key => localStorage.removeItem(key));
       sessionStorage.clear();
     } catch (e) {
       // Silent fail
@@ -294,6 +315,21 @@ export class AuthService {
     return this.currentUser();
   }
 
+  getToken(): string | null {
+    const user = this.currentUser();
+    if (!user?.token) return null;
+    if (user.tokenExpiresAt && user.tokenExpiresAt <= Date.now()) return null;
+    return user.token;
+  }
+
+  private withNewToken(user: User, response: PasswordChangeResponse): User {
+    const updatedUser = response.token
+      ? { ...user, token: response.token, tokenExpiresAt: response.expires_in ? Date.now() + response.expires_in * 1000 : undefined }
+      : user;
+    this.currentUser.set(updatedUser);
+    return updatedUser;
+  }
+
   getUserType(): 'parent' | 'admin' | null {
     const user = this.currentUser();
     return user ? user.type : null;
@@ -326,6 +362,11 @@ export class AuthService {
     if (stored) {
       try {
         const user = JSON.parse(stored) as User;
+        // Sessions saved without a token (or with an expired one) cannot read any data; sign in again
+        if (!user.token || (user.tokenExpiresAt && user.tokenExpiresAt <= Date.now())) {
+          this.logout();
+          return;
+        }
         this.currentUser.set(user);
       } catch (error) {
         localStorage.removeItem(this.STORAGE_KEY);
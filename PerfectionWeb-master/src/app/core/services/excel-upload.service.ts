@@ -1,6 +1,6 @@
 import { Injectable } from '@angular/core';
 import { HttpClient, HttpEvent, HttpEventType } from '@angular/common/http';
-import { Observable } from 'rxjs';
+import { Observable, firstValueFrom, from } from 'rxjs';
 import { map } from 'rxjs/operators';
 import { environment } from '../../../environments/environment';
 
@@ -19,6 +19,19 @@ export interface UploadProgress {
   percentage: number;
 }
 
+interface ResumableUploadStatus {
+  upload_id: string;
+  size: number;
+  offset: number;
+  complete: boolean;
+  chunk_size: number;
+}
+
+// Files larger than this are sent in chunks through /api/uploads, which
+// resumes after a dropped connection instead of starting over
+const RESUMABLE_THRESHOLD_BYTES = 2 * 1024 * 1024;
+const CHUNK_RETRIES = 5;
+
 export interface GroupsResponse {
   groups: string[];
 }
@@ -84,12 +97,65 @@ export class ExcelUploadService {
       formData.append('month', String(month));
     }
 
+    if (file.size > RESUMABLE_THRESHOLD_BYTES) {
+      const fields: Record<string, string> = {};
+      formData.forEach((value, key) => {
+        if (key !== 'file') {
+          fields[key] = value as string;
+        }
+      });
+      return from(this.uploadResumable(file, fields));
+    }
+
     return this.http.post<UploadResponse>(`${this.apiUrl}/upload-excel`, formData, {
       reportProgress: true,
       responseType: 'json'
     });
   }
 
+  /**
+   * Chunked upload: initiate, send chunks from the offset the server reports
+   * (retrying after failures), then finalize with the file's SHA-256
+   */
+  private async uploadResumable(file: File, fields: Record<string, string>): Promise<UploadResponse> {
+    const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+    const sha256 = Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+
+    let status = await firstValueFrom(this.http.post<ResumableUploadStatus>(`${this.apiUrl}/uploads`, {
+      ...fields,
+      filename: file.name,
+      size: file.size,
+      sha256
+    }));
+    const uploadUrl = `${this.apiUrl}/uploads/${status.upload_id}`;
+
+    let failures = 0;
+    while (!status.complete) {
+      const chunk = file.slice(status.offset, status.offset + status.chunk_size);
+      try {
+        status = await firstValueFrom(this.http.put<ResumableUploadStatus>(uploadUrl, chunk, {
+          params: { offset: status.offset },
+          headers: { 'Content-Type': 'application/octet-stream' }
+        }));
+        failures = 0;
+      } catch (error) {
+        if (++failures > CHUNK_RETRIES) {
+          throw error;
+        }
+        await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** failures));
+        // Continue from whatever part of the chunk reached the server; if the
+        // server can't be asked, resending from the old offset is safe too
+        try {
+          status = await firstValueFrom(this.http.get<ResumableUploadStatus>(uploadUrl));
+        } catch {
+          // retried on the next pass
+        }
+      }
+    }
+
+    return firstValueFrom(this.http.post<UploadResponse>(`${uploadUrl}/finalize`, {}));
+  }
+
   /**
    * Upload Excel file with progress tracking
    */
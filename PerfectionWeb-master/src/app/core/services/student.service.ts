@@ -21,6 +21,20 @@ export interface Student {
   };
 }
 
+export interface SessionsPage {
+  sessions: any[];
+  nextCursor: string | null;
+}
+
+interface SessionChanges {
+  sessions: any[];
+  deleted: string[];
+  watermark: string | null;
+  full: boolean;
+}
+
+const SESSIONS_SYNC_PREFIX = 'perfection.sessions:';
+
 const MOCK_STUDENTS: Student[] = [
   {
     id: 'M-123',
@@ -99,16 +113,128 @@ export class StudentService {
     const parentNo = parts[0];
     const studentName = parts.slice(1).join('_');
 
-    let params = new HttpParams()
+    // The unfiltered list is kept locally and only changes are downloaded
+    if (month === undefined || month === null) {
+      return this.syncSessionsForStudent(user.identifier, studentName);
+    }
+
+    const params = new HttpParams()
       .set('phone_number', user.identifier)
+      .set('student_name', studentName)
+      .set('month', String(month));
+
+    return this.http.get<{ sessions: any[] }>(`${environment.apiUrl}/parent/sessions`, { params }).pipe(
+      map(resp => resp.sessions || []),
+      catchError(() => of([]))
+    );
+  }
+
+  /**
+   * All sessions of a student, from the local copy updated with
+   * /parent/sessions/changes (rows changed or deleted since the stored watermark).
+   */
+  private syncSessionsForStudent(phone: string, studentName: string): Observable<any[]> {
+    const key = `${SESSIONS_SYNC_PREFIX}${phone}:${studentName}`;
+    const cached = this.readSessionsCache(key);
+
+    let params = new HttpParams()
+      .set('phone_number', phone)
       .set('student_name', studentName);
+    if (cached?.watermark) {
+      params = params.set('since', cached.watermark);
+    }
+
+    return this.http.get<SessionChanges>(`${environment.apiUrl}/parent/sessions/changes`, { params }).pipe(
+      map(resp => {
+        const byId = new Map<string, any>();
+        if (!resp.full && cached) {
+          for (const s of cached.sessions) byId.set(String(s.id), s);
+        }
+        for (const id of resp.deleted || []) byId.delete(String(id));
+        for (const s of resp.sessions || []) byId.set(String(s.id), s);
+
+        const sessions = Array.from(byId.values());
+        try {
+          localStorage.setItem(key, JSON.stringify({ watermark: resp.watermark, sessions }));
+        } catch {
+          // storage full or unavailable: next visit downloads the full list again
+        }
+        return sessions;
+      }),
+      catchError(() => of(cached ? cached.sessions : []))
+    );
+  }
+
+  private readSessionsCache(key: string): { watermark: string | null; sessions: any[] } | null {
+    try {
+      const raw = localStorage.getItem(key);
+      const parsed = raw ? JSON.parse(raw) : null;
+      return parsed && Array.isArray(parsed.sessions) ? parsed : null;
+    } catch {
+      return null;
+    }
+  }
+
+  /**
+   * Emits whenever an upload changed the parent's sessions, from the
+   * /parent/events Server-Sent Events stream. Also emits after the stream
+   * reconnects (events may have been missed meanwhile), spread over a few
+   * seconds so a server restart doesn't bring every dashboard back at once.
+   */
+  watchSessionUpdates(): Observable<void> {
+    const user = this.authService.getCurrentUser();
+    if (!user || !user.identifier || typeof EventSource === 'undefined') return of();
+
+    // EventSource can't send an Authorization header
+    const token = this.authService.getToken();
+    if (!token) return of();
+
+    return new Observable<void>(subscriber => {
+      const source = new EventSource(`${environment.apiUrl}/parent/events?access_token=${encodeURIComponent(token)}`);
+      let dropped = false;
+      let timer: ReturnType<typeof setTimeout> | undefined;
+
+      source.addEventListener('sessions', () => subscriber.next());
+      source.onerror = () => { dropped = true; };
+      source.onopen = () => {
+        if (!dropped) return;
+        dropped = false;
+        clearTimeout(timer);
+        timer = setTimeout(() => subscriber.next(), Math.random() * 10000);
+      };
+
+      return () => {
+        clearTimeout(timer);
+        source.close();
+      };
+    });
+  }
+
+  /**
+   * One page of a student's sessions, newest upload first. Pass the returned
+   * nextCursor to load the following page; it is null on the last page.
+   */
+  getSessionsPageForStudent(combinedId: string, limit: number, cursor?: string | null, month?: number | null): Observable<SessionsPage> {
+    const user = this.authService.getCurrentUser();
+    if (!user || !user.identifier) return of({ sessions: [], nextCursor: null });
+
+    const parts = combinedId.split('_');
+    const studentName = parts.slice(1).join('_');
+
+    let params = new HttpParams()
+      .set('phone_number', user.identifier)
+      .set('student_name', studentName)
+      .set('limit', String(limit));
+    if (cursor) {
+      params = params.set('cursor', cursor);
+    }
     if (month !== undefined && month !== null) {
       params = params.set('month', String(month));
     }
 
-    return this.http.get<{ sessions: any[] }>(`${environment.apiUrl}/parent/sessions`, { params }).pipe(
-      map(resp => resp.sessions || []),
-      catchError(() => of([]))
+    return this.http.get<{ sessions: any[]; next_cursor: string | null }>(`${environment.apiUrl}/parent/sessions`, { params }).pipe(
+      map(resp => ({ sessions: resp.sessions || [], nextCursor: resp.next_cursor || null })),
+      catchError(() => of({ sessions: [], nextCursor: null }))
     );
   }
 
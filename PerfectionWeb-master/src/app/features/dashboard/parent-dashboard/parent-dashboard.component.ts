@@ -1,4 +1,5 @@
-import { Component, signal, OnInit, ViewChild, ElementRef } from '@angular/core';
+import { Component, signal, OnInit, OnDestroy, ViewChild, ElementRef } from '@angular/core';
+import { Subscription } from 'rxjs';
 import { CommonModule } from '@angular/common';
 import { FormsModule } from '@angular/forms';
 import { Router } from '@angular/router';
@@ -49,6 +50,11 @@ export interface Session {
   isGeneralExam?: boolean;
 }
 
+// Sessions per request in month views; later pages load as the carousel nears its end
+const SESSIONS_PAGE_SIZE = 20;
+// Width of one session card plus its gap (px)
+const SESSION_CARD_SCROLL = 464;
+
 interface UniqueStudent {
   parentNumber: string;
   name: string;
@@ -70,7 +76,7 @@ interface UniqueStudent {
   templateUrl: './parent-dashboard.component.html',
   styleUrls: ['./parent-dashboard.component.scss']
 })
-export class ParentDashboardComponent implements OnInit {
+export class ParentDashboardComponent implements OnInit, OnDestroy {
   // Icons
   readonly Atom = Atom;
   readonly Users = Users;
@@ -115,8 +121,14 @@ export class ParentDashboardComponent implements OnInit {
   // Loading and error states
   isLoadingStudents = signal(true);
   isLoadingSessions = signal(false);
+  isLoadingMoreSessions = signal(false);
   hasError = signal(false);
 
+  // Cursor of the next page of the selected month's sessions (null: all loaded)
+  sessionsCursor = signal<string | null>(null);
+  // Responses for an earlier student/month selection are dropped
+  private sessionsRequest = 0;
+
   // Settings modal / change password
   showSettings = signal<boolean>(false);
   currentPassword = signal('');
@@ -124,6 +136,9 @@ export class ParentDashboardComponent implements OnInit {
   confirmPassword = signal('');
   settingsMessage = signal<string>('');
 
+  // Live updates: sessions are re-fetched only when an upload touched them
+  private sessionUpdates?: Subscription;
+
   // Language / translations - CHANGED DEFAULT TO ARABIC
   lang = signal<'en' | 'ar'>('ar');
 
@@ -153,6 +168,11 @@ export class ParentDashboardComponent implements OnInit {
     }
 
     this.loadStudents();
+    this.sessionUpdates = this.studentService.watchSessionUpdates().subscribe(() => this.applyMonthFilter());
+  }
+
+  ngOnDestroy(): void {
+    this.sessionUpdates?.unsubscribe();
   }
 
   // Helper method to set language and update DOM
@@ -262,56 +282,106 @@ export class ParentDashboardComponent implements OnInit {
 
   loadSessionsForStudent(student: UniqueStudent, month?: number | null): void {
     this.isLoadingSessions.set(true);
+    this.isLoadingMoreSessions.set(false);
+    this.sessionsCursor.set(null);
+    const request = ++this.sessionsRequest;
+
+    // Without a month the whole history comes from the local copy kept in sync
+    if (month === undefined || month === null) {
+      this.studentService.getSessionsForStudent(student.combinedId).subscribe({
+        next: (sessions) => {
+          if (request !== this.sessionsRequest) return;
+          this.setSessions(sessions as Session[]);
+          this.isLoadingSessions.set(false);
+        },
+        error: () => {
+          if (request !== this.sessionsRequest) return;
+          this.setSessions([]);
+          this.isLoadingSessions.set(false);
+        }
+      });
+      return;
+    }
 
-    this.studentService.getSessionsForStudent(student.combinedId, month).subscribe({
-      next: (sessions) => {
-        // Sort sessions by upload/created time (most recent first).
-        const sortedSessions = (sessions as Session[]).slice().sort((a: any, b: any) => {
-          const getTimestamp = (s: any) => {
-            const keys = ['created_at', 'start_time', 'startTime', 'date'];
-            for (const k of keys) {
-              if (s && s[k]) {
-                const t = Date.parse(String(s[k]));
-                if (!isNaN(t)) return t;
-              }
-            }
-            return 0;
-          };
-          return getTimestamp(b) - getTimestamp(a);
-        });
-
-        this.sessions.set(sortedSessions);
+    // Newest page first; the rest is fetched lazily by loadMoreSessions()
+    this.studentService.getSessionsPageForStudent(student.combinedId, SESSIONS_PAGE_SIZE, null, month).subscribe({
+      next: (page) => {
+        if (request !== this.sessionsRequest) return;
+        this.setSessions(page.sessions as Session[]);
+        this.sessionsCursor.set(page.nextCursor);
         this.isLoadingSessions.set(false);
-
-        // Calculate session statistics using returned sessions list
-        const regularSessions = (sortedSessions as any[]).filter((s: any) => {
-          const sessionAny = s as any;
-          const isGeneralExam =
-            sessionAny.is_general_exam === true ||
-            sessionAny.is_general_exam === 'true' ||
-            sessionAny.is_general_exam === 1 ||
-            sessionAny.isGeneralExam === true;
-          return !isGeneralExam; // Exclude general exams
-        });
-
-        const total = regularSessions.length;
-        const attended = regularSessions.filter((s: any) => s.attendance === 'attended').length;
-        const missed = regularSessions.filter((s: any) => s.attendance === 'missed').length;
-
-        this.sessionCount.set(total);
-        this.attendedCount.set(attended);
-        this.missedCount.set(missed);
       },
-      error: (err) => {
+      error: () => {
+        if (request !== this.sessionsRequest) return;
+        this.setSessions([]);
         this.isLoadingSessions.set(false);
-        this.sessionCount.set(0);
-        this.attendedCount.set(0);
-        this.missedCount.set(0);
-        this.sessions.set([]);
       }
     });
   }
 
+  loadMoreSessions(): void {
+    const student = this.selectedStudent();
+    const cursor = this.sessionsCursor();
+    if (!student || !cursor || this.isLoadingMoreSessions()) return;
+
+    this.isLoadingMoreSessions.set(true);
+    const request = this.sessionsRequest;
+    this.studentService.getSessionsPageForStudent(student.combinedId, SESSIONS_PAGE_SIZE, cursor, this.selectedMonth()).subscribe(page => {
+      if (request !== this.sessionsRequest) return;
+      this.setSessions(this.sessions().concat(page.sessions as Session[]));
+      this.sessionsCursor.set(page.nextCursor);
+      this.isLoadingMoreSessions.set(false);
+    });
+  }
+
+  onSessionsScroll(): void {
+    if (!this.sessionCarousel || !this.sessionsCursor()) return;
+    const container = this.sessionCarousel.nativeElement;
+    // scrollLeft is negative in right-to-left layouts
+    const remaining = container.scrollWidth - container.clientWidth - Math.abs(container.scrollLeft);
+    if (remaining < 2 * SESSION_CARD_SCROLL) {
+      this.loadMoreSessions();
+    }
+  }
+
+  private setSessions(sessions: Session[]): void {
+    // Sort sessions by upload/created time (most recent first).
+    const sortedSessions = sessions.slice().sort((a: any, b: any) => {
+      const getTimestamp = (s: any) => {
+        const keys = ['created_at', 'start_time', 'startTime', 'date'];
+        for (const k of keys) {
+          if (s && s[k]) {
+            const t = Date.parse(String(s[k]));
+            if (!isNaN(t)) return t;
+          }
+        }
+        return 0;
+      };
+      return getTimestamp(b) - getTimestamp(a);
+    });
+
+    this.sessions.set(sortedSessions);
+
+    // Calculate session statistics using the sessions loaded so far
+    const regularSessions = (sortedSessions as any[]).filter((s: any) => {
+      const sessionAny = s as any;
+      const isGeneralExam =
+        sessionAny.is_general_exam === true ||
+        sessionAny.is_general_exam === 'true' ||
+        sessionAny.is_general_exam === 1 ||
+        sessionAny.isGeneralExam === true;
+      return !isGeneralExam; // Exclude general exams
+    });
+
+    const total = regularSessions.length;
+    const attended = regularSessions.filter((s: any) => s.attendance === 'attended').length;
+    const missed = regularSessions.filter((s: any) => s.attendance === 'missed').length;
+
+    this.sessionCount.set(total);
+    this.attendedCount.set(attended);
+    this.missedCount.set(missed);
+  }
+
   applyMonthFilter(): void {
     const student = this.selectedStudent();
     const month = this.selectedMonth();
@@ -404,13 +474,12 @@ export class ParentDashboardComponent implements OnInit {
   scrollSessions(direction: 'left' | 'right'): void {
     if (!this.sessionCarousel) return;
 
-    const scrollAmount = 464;
     const container = this.sessionCarousel.nativeElement;
 
     if (direction === 'left') {
-      container.scrollLeft -= scrollAmount;
+      container.scrollLeft -= SESSION_CARD_SCROLL;
     } else {
-      container.scrollLeft += scrollAmount;
+      container.scrollLeft += SESSION_CARD_SCROLL;
     }
   }
 